@@ -23,112 +23,1146 @@
 
 import socket
 import threading
-import pickle
 import sys
+import os
 import argparse
 import signal
 import time
+import asyncio
+import types
+from concurrent.futures import ThreadPoolExecutor
 
-# Lista de contatos da agenda
-contacts = {}
+from protocol import (BINARY, CODECS, PICKLE, decode, payload_codec, recv_frame, recv_frame_async, send_message,
+                      send_message_async)
+from peers import PeerPool, HealthMonitor
+from replication import ACK_MODES, ReplicationQueue
+from oplog import OperationLog
+from storage import Storage
+from index import NameIndex, SearchIndex, PhoneIndex, search_key
+from merkle import LEAVES, MerkleTree, differing_buckets
+from store import ContactStore
+from ring import HashRing, node_key
+from hlc import HybridLogicalClock
+from gossip import GossipDisseminator
+from metrics import Registry, serve_metrics
+from profiler import SamplingProfiler
+from changefeed import ChangeFeed
+from idempotency import TokenStore
+from transfer import COMPRESSIONS, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE, TRANSFER_RETRIES, StateTransfer, pack_chunk
 
-# Função para sincronizar as alterações com outras agendas
-def sync_with_other_servers(action, name, phone=None, servers=[]):
-    update = (action, name, phone)
-    for server in servers:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect(server)
-                s.sendall(pickle.dumps(update))
-                print(f"Sincronizando {action} para {server}: Nome={name}, Telefone={phone}")
-        except ConnectionRefusedError:
-            print(f"Servidor {server} está offline. Não foi possível sincronizar.")
+# Relógio que gera as versões das escritas desta agenda (o nome da agenda desempata versões iguais)
+clock = HybridLogicalClock()
+
+# Lista de contatos da agenda, dividida em partes com travas próprias (acessada por várias threads)
+contacts = ContactStore(clock=clock)
+
+# Alterações da agenda enviadas aos clientes inscritos ('subscribe')
+change_feed = ChangeFeed()
+
+# Respostas das escritas com token de idempotência, desta agenda e recebidas pela replicação
+request_tokens = TokenStore()
+
+# Intervalo (s) das mensagens vazias enviadas aos clientes inscritos quando nada muda, para detectar conexões perdidas
+SUBSCRIBE_HEARTBEAT = 15.0
+
+# Nomes em ordem alfabética, usados para a visualização paginada
+name_index = NameIndex()
+
+# Índice para buscas por prefixo (e por trecho do nome, com --substring_search)
+search_index = SearchIndex()
+
+# Índice reverso de telefone (só dígitos) para nomes
+phone_index = PhoneIndex()
+
+# Árvore de hashes da agenda, usada para comparar agendas sem transferir os contatos
+merkle_tree = MerkleTree()
+
+# Máximo de folhas (grupos de nomes) reparadas por rodada de anti-entropia com cada agenda
+MAX_REPAIR_BUCKETS = 4096
+
+# Quantidade máxima de telefones numa única consulta em lote
+MAX_LOOKUP_PHONES = 10000
+
+# Ações de escrita que chegam em lote (importação)
+BULK_ACTIONS = ('add_many', 'upsert_many')
+
+# Requisições de outras agendas que devolvem a agenda inteira (ou quase)
+FULL_STATE_ACTIONS = ('fetch_data', 'fetch_ops', 'fetch_chunk')
+
+# Requisições de outras agendas rápidas e só de leitura (ou só em memória), atendidas no próprio laço de eventos
+# no modo assíncrono; as demais escrevem na agenda ou esperam o disco e saem do laço
+INLINE_SYNC_ACTIONS = ('probe', 'merkle_nodes', 'ping', 'hello', 'tokens')
+
+# Registros por parte e compressão da cópia completa recebida de outra agenda (--transfer_chunk_size e --transfer_compression)
+transfer_chunk_size = DEFAULT_CHUNK_SIZE
+transfer_compression = 'zlib'
+
+# Quantidade padrão de contatos por mensagem na exportação
+EXPORT_CHUNK_SIZE = 5000
+
+# Quantidade padrão e máxima de contatos por página
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+
+# Log ordenado de todas as operações aplicadas (locais e recebidas de outras agendas)
+operation_log = OperationLog()
+
+# Última posição (época, sequência) conhecida do log de cada outra agenda
+peer_positions = {}
+
+# Endereço de sincronização desta agenda, usado pelas outras para identificá-la
+node_address = None
+
+# Conexões persistentes com as outras agendas, reaproveitadas entre sincronizações
+peer_pool = PeerPool()
+
+# Fila de replicação em segundo plano (criada ao iniciar, conforme --ack_mode)
+replication_queue = None
+
+# Tempo máximo que uma escrita espera pelas confirmações das outras agendas
+ack_timeout = 5.0
+
+# Armazenamento local (log de escrita antecipada + snapshots), ativo com --data_dir
+storage = None
+
+# Anel de hashes consistentes do cluster (ativo com --cluster); sem ele, todas as agendas guardam todos os contatos
+ring = None
+
+# Quantas agendas do cluster guardam cada contato
+replication_factor = 2
+
+# Trava para as mudanças de membros do cluster (entrada e saída de agendas)
+membership_lock = threading.Lock()
+
+# Threads para consultar as agendas do cluster em paralelo
+cluster_executor = ThreadPoolExecutor(max_workers=16)
+
+# Ações de clientes encaminhadas às agendas responsáveis pelo nome, no modo cluster
+ROUTED_ACTIONS = ('add', 'remove', 'update')
+
+# Ações de clientes respondidas juntando as respostas de todas as agendas, no modo cluster
+GATHERED_ACTIONS = ('view', 'view_page', 'search', 'lookup_phone')
+
+# Quantidade de contatos por mensagem ao transferi-los entre agendas do cluster
+REBALANCE_BATCH_SIZE = 5000
+
+# Disseminação por fofoca (ativa com --gossip), no lugar do envio de cada escrita a todas as agendas
+gossip = None
+
+# Intervalo máximo (s) entre as limpezas de lápides antigas
+TOMBSTONE_GC_INTERVAL = 3600
+
+# Ações conhecidas, usadas como rótulo das métricas (as demais são contadas como 'unknown')
+CLIENT_ACTIONS = ROUTED_ACTIONS + BULK_ACTIONS + GATHERED_ACTIONS + ('view_stream', 'export', 'digest', 'peer_health', 'leave_cluster', 'stats', 'hello', 'subscribe')
+SYNC_ACTIONS = ('add', 'remove', 'update', 'batch', 'fetch_data', 'fetch_ops', 'fetch_chunk', 'probe', 'merkle_nodes', 'merkle_buckets', 'merkle_repair',
+                'ping', 'gossip', 'forward', 'join', 'leave', 'hello', 'tokens')
+
+# Métricas da agenda, lidas pela ação 'stats' e, com --metrics_port, por HTTP no formato de texto do Prometheus
+metrics = Registry()
+client_request_seconds = metrics.histogram('agenda_client_request_seconds', 'Duração das requisições de clientes, por ação')
+client_errors = metrics.counter('agenda_client_errors_total', 'Requisições de clientes respondidas com erro, por ação')
+sync_request_seconds = metrics.histogram('agenda_sync_request_seconds', 'Duração das requisições de outras agendas, por ação')
+open_connections = metrics.gauge('agenda_connections', 'Conexões abertas, de clientes (client) e de outras agendas (sync)')
+snapshot_contacts = metrics.gauge('agenda_snapshot_contacts', 'Contatos gravados no último snapshot')
+snapshot_bytes = metrics.gauge('agenda_snapshot_bytes', 'Tamanho do último snapshot em disco')
+snapshot_seconds = metrics.gauge('agenda_snapshot_seconds', 'Duração da gravação do último snapshot')
+
+# Profiler por amostragem das requisições (ativo com --profile_output)
+profiler = None
+
+# Com --disable_pickle, só conexões no formato binário são aceitas
+pickle_disabled = False
+
+# Função para obter as agendas responsáveis por um nome no modo cluster (a primeira é a principal)
+def owners_of(name):
+    return ring.owners(name, replication_factor)
+
+# Função para obter as outras agendas que guardam o contato (None, fora do modo cluster: todas)
+def replica_targets(name):
+    if ring is None:
+        return None
+    return [node for node in owners_of(name) if node != node_address]
+
+# Função para sincronizar as alterações com outras agendas (a replicação acontece em segundo plano)
+# Com "token", as agendas que recebem a escrita guardam também a resposta dela
+def sync_with_other_servers(action, name, phone=None, version=None, seq=0, token=None, response=None):
+    gossip_operations([(action, name, phone, version, seq)])
+    return replication_queue.submit(action, name, phone, version, seq, replica_targets(name), token, response)
+
+# Função para repassar operações (ação, nome, telefone, versão, sequência) desta agenda pela fofoca, quando ativa
+# O id de cada operação (agenda de origem, época, sequência) permite às outras agendas descartar repetições
+def gossip_operations(operations):
+    if gossip is not None:
+        epoch = operation_log.epoch
+        gossip.publish([((node_address, epoch, seq), (action, name, phone, version))
+                        for action, name, phone, version, seq in operations])
+
+# Função para aplicar as operações recebidas pela fofoca
+def apply_gossip(operations):
+    wait_durable(apply_remote(operations))
+    print(f"Aplicando {len(operations)} operações recebidas pela fofoca.")
+
+# Função para obter um campo do estado da fila de replicação de cada agenda, para as métricas
+def replication_stats(field):
+    if replication_queue is None:
+        return []
+    return [({'peer': node_key(server)}, state[field]) for server, state in replication_queue.stats().items()]
+
+metrics.callback('agenda_contacts', 'Contatos na agenda', lambda: len(contacts))
+metrics.callback('agenda_tombstones', 'Remoções guardadas como lápides', lambda: contacts.tombstone_count())
+metrics.callback('agenda_oplog_seq', 'Sequência da última operação do log', lambda: operation_log.position()[1])
+metrics.callback('agenda_replication_pending', 'Operações na fila de replicação, por agenda', lambda: replication_stats('pending'))
+metrics.callback('agenda_replication_in_flight', 'Operações sendo enviadas, por agenda', lambda: replication_stats('in_flight'))
+metrics.callback('agenda_replication_hints', 'Operações guardadas para agendas indisponíveis', lambda: replication_stats('hints'))
+metrics.callback('agenda_replication_lag_seconds', 'Espera da operação mais antiga ainda não entregue, por agenda', lambda: replication_stats('lag_seconds'))
+
+# Função para executar uma requisição marcando a thread para o profiler por amostragem, quando ativo
+def profiled(process, *args):
+    if profiler is None:
+        return process(*args)
+    with profiler.track():
+        return process(*args)
+
+# Função para registrar nas métricas a duração de uma requisição de cliente e se ela terminou com erro
+def record_client_request(action, response, started):
+    label = action if action in CLIENT_ACTIONS else 'unknown'
+    client_request_seconds.observe(time.perf_counter() - started, action=label)
+    if isinstance(response, str) and response.startswith("Erro"):
+        client_errors.inc(action=label)
+
+# Função para registrar nas métricas a duração de uma requisição de outra agenda
+def record_sync_request(action, started):
+    sync_request_seconds.observe(time.perf_counter() - started, action=action if action in SYNC_ACTIONS else 'unknown')
+
+# Função para esperar a gravação em disco da operação "seq", quando a persistência local está ativa
+def wait_durable(seq):
+    if storage is not None:
+        storage.wait_durable(seq)
+
+# Função para verificar se a escrita foi gravada e se a replicação atingiu o modo de confirmação escolhido
+def replication_error(subject, seq, ack):
+    wait_durable(seq)
+    confirmed, needed = ack.wait(ack_timeout)
+    if confirmed >= needed:
+        return None
+    return f"Erro: {subject} gravado nesta agenda, mas só {confirmed} de {needed} agendas confirmaram a replicação."
+
+# Função para atualizar os índices e o log de operações após uma alteração (chamada com a trava do contato)
+# Recebe os registros (telefone, versão) antigo e novo; retorna (sequência, versão) da operação
+def record_change(action, name, old, new):
+    old_phone = old[0] if old is not None else None
+    phone, version = new if new is not None else (None, None)
+    if phone is not None:
+        name_index.add(name)
+        search_index.add(name)
+    else:
+        name_index.remove(name)
+        search_index.remove(name)
+    phone_index.replace(name, old_phone, phone)
+    merkle_tree.update(name, old, new)
+    seq = operation_log.append(action, name, phone, version)
+    change_feed.publish(name, old_phone, phone)
+    return seq, version
+
+# Função para aplicar uma alteração na agenda, registrando-a no log de operações
+# Sem "version" a alteração é desta agenda e recebe uma versão nova; com ela (operação de outra agenda),
+# só é aplicada se for mais nova que a do registro local, para que todas as agendas terminem iguais
+# Com "condition" ('absent' ou 'present') a alteração só acontece se o contato não existir ou existir;
+# retorna (sequência, versão) da operação, ou None quando ela não foi aplicada
+def apply_operation(action, name, phone=None, version=None, condition=None):
+    return contacts.apply(action, name, phone, version, condition, on_change=record_change)
+
+# Função para aplicar operações (ação, nome, telefone, versão) de outras agendas, retornando a sequência da última aplicada
+def apply_remote(operations):
+    last_seq = 0
+    for operation in operations:
+        if operation[0] == 'forget':
+            continue  # Só desta agenda; versões antigas ainda o repassam em 'fetch_ops'
+        applied = apply_operation(*operation)
+        if applied is not None:
+            last_seq = applied[0]
+    return last_seq
+
+# Função para juntar registros (nome -> (telefone, versão)) de outra agenda: fica a versão mais nova de cada nome
+def merge_records(records):
+    changes = 0
+    for name, (phone, version) in records.items():
+        if apply_operation('update' if phone is not None else 'remove', name, phone, version) is not None:
+            changes += 1
+    return changes
+
+# Função para reconstruir os índices depois de substituir a agenda inteira
+def rebuild_indexes():
+    current = contacts.snapshot()
+    name_index.rebuild(current.contacts)
+    search_index.rebuild(current.contacts)
+    phone_index.rebuild(current.contacts)
+    merkle_tree.rebuild(current.records)
+    change_feed.reset()
+
+# Função para obter os registros (inclusive lápides) de cada folha da árvore de hashes
+def bucket_contents(buckets):
+    contents = {}
+    for bucket, names in merkle_tree.bucket_names(buckets).items():
+        records = {name: contacts.record(name) for name in names}
+        contents[bucket] = {name: record for name, record in records.items() if record is not None}
+    return contents
+
+# Função para montar a resposta de 'fetch_ops': as operações após a posição pedida ou, se não for possível, a agenda completa
+# Com "chunked", a agenda completa não é enviada: a outra agenda a pede em partes ('fetch_chunk')
+def operations_since(position, chunked=False):
+    epoch, seq = operation_log.position()
+    ops = operation_log.since(*position) if position else None
+    if ops is not None:
+        # 'forget' fica no log só para a gravação em disco desta agenda: repassado, apagaria sem condição um
+        # registro que a outra agenda pode ter mais novo (ou que agora é dela, no cluster)
+        return {'epoch': epoch, 'seq': seq, 'ops': [op[1:] for op in ops if op[0] <= seq and op[1] != 'forget']}
+    if chunked:
+        return {'epoch': epoch, 'seq': seq, 'full_copy': True}
+    # A posição é lida antes da cópia: reaplicar operações posteriores a ela é inofensivo
+    return {'epoch': epoch, 'seq': seq, 'records': contacts.snapshot().records}
+
+# Função para montar uma parte da cópia completa ('fetch_chunk'): os registros, inclusive lápides, das folhas
+# da árvore de hashes do cursor (uma folha) até "end", juntando cerca de "limit" registros
+# Só a parte pedida é copiada e serializada, sem montar a agenda inteira na memória
+def state_chunk(options):
+    cursor = int(options.get('cursor') or 0)
+    end = int(options.get('end', LEAVES))
+    limit = max(1, min(int(options.get('limit', DEFAULT_CHUNK_SIZE)), MAX_CHUNK_SIZE))
+    compression = options.get('compression', 'zlib')
+    if not 0 <= cursor < end <= LEAVES or compression not in COMPRESSIONS:
+        return f"Erro: Parte inválida (folhas {cursor} a {end}, compressão {compression})."
+    names, next_bucket = merkle_tree.names_from(cursor, limit, end)
+    records = {}
+    for name in names:
+        record = contacts.record(name)
+        if record is not None:
+            records[name] = record
+    chunk = pack_chunk(records, compression)
+    chunk['next_cursor'] = next_bucket if next_bucket < end else None
+    return chunk
+
+# Função para processar uma requisição de outro servidor (retorna None quando não há resposta)
+def process_sync_request(action, name, phone):
+    if action == 'add':
+        apply_operation(action, name, phone)
+        print(f"Adicionando contato de outro servidor: {name} - {phone}")
+    elif action == 'remove':
+        apply_operation(action, name, phone)
+        print(f"Removendo contato de outro servidor: {name}")
+    elif action == 'update':
+        apply_operation(action, name, phone)
+        print(f"Atualizando contato de outro servidor: {name} - {phone}")
+    elif action == 'batch':
+        # Lote de operações já agrupadas pela agenda de origem (o lote vem no campo "name")
+        last_seq = apply_remote(name)
+        # Quando presente, "phone" traz (origem, época, sequência) até onde estamos em dia com a origem
+        if phone is not None:
+            origin, epoch, seq = phone
+            peer_positions[origin] = (epoch, seq)
+            if storage is not None:
+                storage.log_peer_position(origin, epoch, seq)
+        wait_durable(last_seq)
+        print(f"Aplicando lote de {len(name)} operações de outro servidor.")
+        return 'ok'
+    elif action == 'fetch_data':
+        return contacts.snapshot().encoded()  # Envia a cópia completa da agenda, serializada uma vez por versão
+    elif action == 'fetch_ops':
+        # "name" traz a última posição (época, sequência) conhecida; "phone" == 'chunked' pede a cópia em partes
+        return operations_since(name, phone == 'chunked')
+    elif action == 'fetch_chunk':
+        return state_chunk(name or {})
+    elif action == 'probe':
+        # Situação desta agenda, para quem está iniciando escolher a origem mais atualizada
+        epoch, seq = operation_log.position()
+        return {'epoch': epoch, 'seq': seq, 'version': clock.last(), 'root': merkle_tree.root(), 'contacts': len(contacts)}
+    elif action == 'merkle_nodes':
+        depth, indices = name
+        return merkle_tree.nodes(depth, indices)
+    elif action == 'merkle_buckets':
+        return bucket_contents(name)
+    elif action == 'ping':
+        return 'pong'  # Verificação periódica de saúde
+    elif action == 'gossip':
+        # Operações repassadas pela fofoca (em "name") e a lista de membros de quem as enviou (em "phone")
+        if gossip is None:
+            apply_gossip([operation for _, _, operation in name])
+            return []
+        return gossip.receive(name, phone)
+    elif action == 'forward':
+        # Requisição de cliente repassada por outra agenda do cluster, respondida só com os dados desta agenda
+        request_action, request_name, request_phone, options = name
+        return process_client_request(request_action, request_name, request_phone, options)
+    elif action == 'join':
+        return sorted(add_member(name))  # "name" traz o endereço da agenda que entrou; responde com os membros
+    elif action == 'leave':
+        remove_member(name)
+        return 'ok'
+    elif action == 'merkle_repair':
+        changes = sum(merge_records(records) for records in name.values())
+        print(f"Anti-entropia: {changes} contatos reparados a pedido de outro servidor.")
+        return 'ok'
+    elif action == 'hello':
+        return accepted_codecs()
+    elif action == 'tokens':
+        # Tokens (token, resposta) das escritas de um lote já recebido, para as repetições delas nesta agenda
+        request_tokens.put_many(name)
+    return None
+
+# Formatos de mensagem aceitos por esta agenda, informados na ação 'hello'
+def accepted_codecs():
+    return [BINARY] if pickle_disabled else list(CODECS)
+
+# Função para escolher o formato de uma conexão pela primeira mensagem dela; as respostas usam o mesmo formato
+def connection_codec(payload):
+    codec = payload_codec(payload)
+    if codec == PICKLE and pickle_disabled:
+        raise ConnectionResetError("Mensagem em pickle recusada (--disable_pickle).")
+    return codec
 
 # Função para receber atualizações de outros servidores
 def handle_server_sync(conn):
+    open_connections.inc(kind='sync')
+    codec = None
     try:
         while True:
-            data = conn.recv(1024)
-            if not data:
+            frame = recv_frame(conn)
+            if frame is None:
                 break
 
-            action, name, phone = pickle.loads(data)
-            if action == 'add':
-                contacts[name] = phone
-                print(f"Adicionando contato de outro servidor: {name} - {phone}")
-            elif action == 'remove':
-                contacts.pop(name, None)
-                print(f"Removendo contato de outro servidor: {name}")
-            elif action == 'update':
-                contacts[name] = phone
-                print(f"Atualizando contato de outro servidor: {name} - {phone}")
-            elif action == 'fetch_data':
-                conn.sendall(pickle.dumps(contacts))  # Envia a cópia completa da agenda
+            request_id, payload = frame
+            codec = codec or connection_codec(payload)
+            action, name, phone = decode(payload, codec)
+            started = time.perf_counter()
+            response = profiled(process_sync_request, action, name, phone)
+            if response is not None:
+                send_message(conn, response, request_id, codec)
+            record_sync_request(action, started)
     except ConnectionResetError:
         print("Conexão com outro servidor foi perdida.")
     finally:
+        open_connections.dec(kind='sync')
         conn.close()
 
+# Função para separar os campos de uma requisição; o 4º campo (opções) é opcional
+def unpack_request(request):
+    action, name, phone, *extra = request
+    return action, name, phone, (extra[0] if extra else None) or {}
+
+# Função para limitar o tamanho de página pedido pelo cliente
+def page_size(limit):
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+# Função para juntar os telefones aos nomes de uma página
+def with_phones(names):
+    page = []
+    for contact_name in names:
+        contact_phone = contacts.get(contact_name)
+        if contact_phone is not None:
+            page.append((contact_name, contact_phone))
+    return page
+
+# Função para montar uma página de contatos em ordem alfabética, a partir do cursor (último nome já recebido)
+# A posição do feed de alterações é lida antes da página: o cliente inscrito reaplica à página as alterações posteriores
+def contacts_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    limit = page_size(limit)
+    position = change_feed.position()
+    names = name_index.page(cursor, limit)
+    next_cursor = names[-1] if len(names) == limit else None
+    return {'contacts': with_phones(names), 'next_cursor': next_cursor, 'total': len(name_index), 'position': position}
+
+# Função para montar a página que começa na posição "offset" da ordem alfabética
+# A resposta repete o "offset"; sem ele (agendas antigas, cluster), o cliente pagina só por cursor
+def contacts_page_at(offset, limit=DEFAULT_PAGE_SIZE):
+    limit = page_size(limit)
+    offset = max(0, int(offset))
+    position = change_feed.position()
+    names = name_index.page_at(offset, limit)
+    next_cursor = names[-1] if len(names) == limit else None
+    return {'contacts': with_phones(names), 'next_cursor': next_cursor, 'total': len(name_index), 'offset': offset,
+            'position': position}
+
+# Função para buscar contatos pelo começo do nome ou, no modo 'substring', por qualquer trecho dele
+def search_contacts(query, mode='prefix', cursor=None, limit=DEFAULT_PAGE_SIZE):
+    limit = page_size(limit)
+    position = change_feed.position()
+    if mode == 'substring':
+        names = search_index.substring(query, cursor, limit)
+    else:
+        names = search_index.prefix(query, cursor, limit)
+    next_cursor = names[-1] if len(names) == limit else None
+    return {'contacts': with_phones(names), 'next_cursor': next_cursor, 'position': position}
+
+# Função para gerar as páginas da visualização em fluxo, uma mensagem por página
+def stream_contacts(cursor=None, limit=DEFAULT_PAGE_SIZE, page_function=contacts_page):
+    while True:
+        page = page_function(cursor, limit)
+        cursor = page['next_cursor']
+        page['done'] = cursor is None
+        yield page
+        if cursor is None:
+            break
+
+# Função para obter a posição do feed de onde começa uma inscrição: a enviada pelo cliente ou, sem ela, a atual
+def subscription_start(position):
+    try:
+        epoch, seq = position
+        return epoch, int(seq)
+    except (TypeError, ValueError):
+        return change_feed.position()
+
+# Função para montar uma mensagem da inscrição; alterações None (posição que não vale mais) viram um pedido
+# para o cliente recarregar a agenda ('resync'), a partir da posição atual
+# Retorna a mensagem e a nova posição da inscrição
+def change_message(epoch, seq, changes):
+    if changes is None:
+        epoch, seq = change_feed.position()
+        return {'epoch': epoch, 'seq': seq, 'changes': [], 'resync': True, 'done': False}, epoch, seq
+    if changes:
+        seq = changes[-1][0]
+    return {'epoch': epoch, 'seq': seq, 'changes': changes, 'resync': False, 'done': False}, epoch, seq
+
+# Função para gerar as mensagens da ação 'subscribe': primeiro as alterações desde a posição do cliente (na hora),
+# depois cada nova leva de alterações (seq, ação, nome, telefone) assim que acontece, sem fim
+# Sem alterações, uma mensagem vazia a cada SUBSCRIBE_HEARTBEAT segundos
+def stream_changes(position):
+    epoch, seq = subscription_start(position)
+    changes = change_feed.since(epoch, seq)
+    while True:
+        message, epoch, seq = change_message(epoch, seq, changes)
+        yield message
+        changes = change_feed.wait_since(epoch, seq, SUBSCRIBE_HEARTBEAT)
+
+# Mesmas mensagens no modo assíncrono, esperando as alterações sem bloquear o laço de eventos
+async def stream_changes_async(position):
+    epoch, seq = subscription_start(position)
+    changes = change_feed.since(epoch, seq)
+    while True:
+        message, epoch, seq = change_message(epoch, seq, changes)
+        yield message
+        changes = await change_feed.wait_since_async(epoch, seq, SUBSCRIBE_HEARTBEAT)
+
+# Função para aplicar um lote de contatos (nome, telefone); registros inválidos são informados sem abortar o lote
+def apply_many(action, records):
+    operations = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            record_name, record_phone = record
+        except (TypeError, ValueError):
+            errors.append((index, None, "Registro inválido."))
+            continue
+        if not isinstance(record_name, str) or not isinstance(record_phone, str) or not record_name or not record_phone:
+            errors.append((index, record_name, "Nome e Telefone são obrigatórios!"))
+            continue
+        # A inclusão é condicional; no "upsert", um contato já existente é atualizado
+        operation = 'add'
+        applied = apply_operation('add', record_name, record_phone, condition='absent')
+        if applied is None and action == 'upsert_many':
+            operation = 'update'
+            applied = apply_operation('update', record_name, record_phone)
+        if applied is None:
+            errors.append((index, record_name, f"Contato {record_name} já existe."))
+            continue
+        seq, version = applied
+        operations.append((operation, record_name, record_phone, version, seq))
+    print(f"Aplicando lote de {len(operations)} contatos ({len(errors)} erros).")
+
+    response = {'applied': len(operations), 'errors': errors}
+    gossip_operations(operations)
+    # O lote é replicado e confirmado de uma vez para cada grupo de agendas de destino
+    for targets, group in group_by_targets(operations):
+        ack = replication_queue.submit_many(group, targets)
+        error = replication_error(f"Lote de {len(operations)} contatos", group[-1][4], ack)
+        if error:
+            response['replication_error'] = error
+    return response
+
+# Função para separar operações pelas agendas que devem recebê-las (um único grupo fora do modo cluster)
+def group_by_targets(operations):
+    if ring is None:
+        return [(None, operations)] if operations else []
+    groups = {}
+    for operation in operations:
+        groups.setdefault(tuple(replica_targets(operation[1])), []).append(operation)
+    return list(groups.items())
+
+# Função para encaminhar uma requisição de cliente à primeira agenda responsável disponível
+def forward_request(owners, action, name, phone, options):
+    for owner in owners:
+        try:
+            return peer_pool.get(owner).request(('forward', (action, name, phone, dict(options, local=True)), None))
+        except OSError:
+            print(f"Servidor {owner} indisponível; tentando a próxima agenda responsável.")
+    return f"Erro: Nenhuma agenda responsável por {name} está disponível."
+
+# Função para enviar uma requisição a todas as agendas do cluster (esta inclusive) e juntar as respostas
+def gather_request(action, name, phone, options):
+    # A posição ("offset") não vale para a união das agendas: o cluster pagina só por cursor
+    local_options = {key: value for key, value in options.items() if key != 'offset'}
+    local_options['local'] = True
+    members = [node for node in ring.nodes if node != node_address]
+    futures = [cluster_executor.submit(peer_pool.get(node).request, ('forward', (action, name, phone, local_options), None))
+               for node in members]
+    responses = []
+    if node_address in ring:
+        if action == 'view':
+            responses.append(contacts.snapshot().contacts)  # Sem a versão já serializada, que serve só para envio
+        else:
+            responses.append(process_client_request(action, name, phone, local_options))
+    for node, future in zip(members, futures):
+        try:
+            responses.append(future.result())
+        except OSError:
+            print(f"Servidor {node} indisponível; a resposta pode estar incompleta.")
+    return merge_responses(action, responses, options)
+
+# Função para juntar as respostas das agendas do cluster; cada contato pode vir de várias agendas
+def merge_responses(action, responses, options):
+    errors = [response for response in responses if isinstance(response, str) and response.startswith("Erro")]
+    if errors:
+        return errors[0]
+    if action == 'view':
+        merged = {}
+        for response in responses:
+            if isinstance(response, dict):
+                merged.update(response)
+        return merged if merged else "Agenda vazia."
+    if action == 'lookup_phone':
+        if 'phones' in options:
+            return {phone: sorted(set().union(*(response[phone] for response in responses))) for phone in options['phones']}
+        return sorted(set().union(*responses))
+    # Páginas (view_page e search): cada agenda devolve a sua página; a página do cluster é o começo da união
+    limit = page_size(options.get('limit', DEFAULT_PAGE_SIZE))
+    merged = {}
+    more = False
+    for response in responses:
+        merged.update(response['contacts'])
+        more = more or response['next_cursor'] is not None
+    names = sorted(merged, key=search_key if action == 'search' else None)
+    page = names[:limit]
+    next_cursor = page[-1] if page and (more or len(names) > limit) else None
+    result = {'contacts': [(contact_name, merged[contact_name]) for contact_name in page], 'next_cursor': next_cursor}
+    if action == 'view_page':
+        result['total'] = None  # Desconhecido: cada contato está em várias agendas
+    return result
+
+# Função para montar uma página da agenda do cluster inteiro
+def cluster_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    return gather_request('view_page', None, None, {'cursor': cursor, 'limit': limit})
+
+# Função para distribuir um lote entre as agendas responsáveis: os registros desta agenda são aplicados aqui,
+# os demais são encaminhados em sub-lotes, um por grupo de agendas responsáveis
+def route_many(action, records, options):
+    local = []
+    remote = {}  # agendas responsáveis -> [(posição no lote, registro)]
+    for index, record in enumerate(records):
+        record_name = record[0] if isinstance(record, (tuple, list)) and record else None
+        owners = owners_of(record_name) if isinstance(record_name, str) else [node_address]
+        if node_address in owners:
+            local.append((index, record))
+        else:
+            remote.setdefault(tuple(owners), []).append((index, record))
+
+    response = {'applied': 0, 'errors': []}
+    parts = [(local, apply_many(action, [record for _, record in local]))] if local else []
+    for owners, items in remote.items():
+        parts.append((items, forward_request(owners, action, [record for _, record in items], None, options)))
+    for items, part in parts:
+        if not isinstance(part, dict):
+            response['errors'].extend((index, record[0], part) for index, record in items)
+            continue
+        response['applied'] += part['applied']
+        response['errors'].extend((items[index][0], error_name, message) for index, error_name, message in part['errors'])
+        if 'replication_error' in part:
+            response['replication_error'] = part['replication_error']
+    response['errors'].sort(key=lambda error: error[0])
+    return response
+
+# Função para executar uma escrita com token de idempotência só uma vez; as repetições recebem a mesma resposta
+def deduplicated(options, process):
+    token = options.get('token')
+    if token is None:
+        return process()
+    return request_tokens.run_once(token, process)
+
+# Função para aplicar a escrita de um cliente ('add', 'remove' ou 'update') nesta agenda e replicá-la
+def process_write(action, name, phone, token=None):
+    if action == 'add':
+        applied = apply_operation('add', name, phone, condition='absent')
+        if applied is not None:
+            seq, version = applied
+            print(f"Adicionando contato: {name} - {phone}")
+            done = f"Contato {name} adicionado com sucesso!"
+            ack = sync_with_other_servers('add', name, phone, version, seq, token, done)
+            response = replication_error(f"Contato {name}", seq, ack) or done
+        else:
+            response = f"Erro: Contato {name} já existe."
+    elif action == 'remove':
+        applied = apply_operation('remove', name, condition='present')
+        if applied is not None:
+            seq, version = applied
+            print(f"Removendo contato: {name}")
+            done = f"Contato {name} removido com sucesso!"
+            ack = sync_with_other_servers('remove', name, version=version, seq=seq, token=token, response=done)
+            response = replication_error(f"Contato {name}", seq, ack) or done
+        else:
+            response = f"Erro: Contato {name} não encontrado."
+    elif action == 'update':
+        applied = apply_operation('update', name, phone, condition='present')
+        if applied is not None:
+            seq, version = applied
+            print(f"Atualizando contato: {name} - {phone}")
+            done = f"Contato {name} atualizado com sucesso!"
+            ack = sync_with_other_servers('update', name, phone, version, seq, token, done)
+            response = replication_error(f"Contato {name}", seq, ack) or done
+        else:
+            response = f"Erro: Contato {name} não encontrado."
+    return response
+
+# Função para processar uma requisição de cliente e montar a resposta
+def process_client_request(action, name, phone, options=None):
+    options = options or {}
+    # No modo cluster, o pedido vai às agendas responsáveis, a não ser que já tenha sido encaminhado ("local")
+    routed = ring is not None and not options.get('local')
+    if routed and action in ROUTED_ACTIONS:
+        owners = owners_of(name)
+        if node_address not in owners:
+            return deduplicated(options, lambda: forward_request(owners, action, name, phone, options))
+    elif routed and action in BULK_ACTIONS:
+        return route_many(action, name or [], options)
+    elif routed and action in GATHERED_ACTIONS:
+        return gather_request(action, name, phone, options)
+
+    if action in ROUTED_ACTIONS:
+        response = deduplicated(options, lambda: process_write(action, name, phone, options.get('token')))
+    elif action == 'view':
+        # Enquanto a agenda não muda, todas as visualizações reaproveitam os mesmos bytes
+        current = contacts.snapshot()
+        response = current.encoded() if current else "Agenda vazia."
+    elif action == 'view_page':
+        if options.get('offset') is not None:
+            response = contacts_page_at(options['offset'], options.get('limit', DEFAULT_PAGE_SIZE))
+        else:
+            response = contacts_page(options.get('cursor'), options.get('limit', DEFAULT_PAGE_SIZE))
+    elif action == 'view_stream':
+        response = stream_contacts(options.get('cursor'), options.get('limit', DEFAULT_PAGE_SIZE), cluster_page if routed else contacts_page)
+    elif action in BULK_ACTIONS:
+        response = apply_many(action, name or [])  # Os registros vêm no campo "name"
+    elif action == 'export':
+        response = stream_contacts(options.get('cursor'), options.get('limit', EXPORT_CHUNK_SIZE), cluster_page if routed else contacts_page)
+    elif action == 'subscribe':
+        # Alterações enviadas à medida que acontecem; no cluster, cada agenda só vê os contatos que guarda
+        if routed:
+            response = "Erro: A inscrição em alterações não está disponível no modo cluster."
+        else:
+            response = stream_changes(options.get('position'))
+    elif action == 'digest':
+        # Permite conferir se duas agendas estão iguais comparando só o hash da raiz
+        response = {'root': f"{merkle_tree.root():016x}", 'contacts': len(contacts)}
+    elif action == 'lookup_phone':
+        # Um telefone no campo "phone" ou vários em options['phones']
+        if 'phones' in options:
+            phones = list(options['phones'])
+            if len(phones) > MAX_LOOKUP_PHONES:
+                response = f"Erro: No máximo {MAX_LOOKUP_PHONES} telefones por consulta."
+            else:
+                response = phone_index.lookup(phones)
+        else:
+            response = phone_index.lookup([phone])[phone]
+    elif action == 'search':
+        response = search_contacts(name or '', options.get('mode', 'prefix'), options.get('cursor'), options.get('limit', DEFAULT_PAGE_SIZE))
+    elif action == 'stats':
+        # Métricas desta agenda e, com o profiler ativo, as pilhas de chamadas mais frequentes
+        response = metrics.collect()
+        if profiler is not None:
+            response['profile'] = profiler.top()
+    elif action == 'hello':
+        # Formatos de mensagem aceitos, para o cliente escolher o binário quando a agenda o conhece
+        response = accepted_codecs()
+    elif action == 'peer_health':
+        # Estado das conexões com as outras agendas (disponível ou não, falhas seguidas)
+        response = {f"{address[0]}:{address[1]}": state for address, state in peer_pool.status().items()}
+    elif action == 'leave_cluster':
+        # Retira uma agenda do cluster ("IP:PORTA_SINC" no campo "name"; esta agenda, se vazio)
+        if ring is None:
+            response = "Erro: Esta agenda não está em modo cluster."
+        else:
+            response = leave_cluster(parse_address(name) if name else node_address)
+    else:
+        response = f"Erro: Ação {action} desconhecida."
+    return response
+
 # Função para tratar ações dos clientes
 def handle_client(conn, addr, servers):
     print(f"Conexão estabelecida com {addr}")
+    open_connections.inc(kind='client')
+    codec = None
     try:
         while True:
-            data = conn.recv(1024)
-            if not data:
+            frame = recv_frame(conn)
+            if frame is None:
                 break
 
-            action, name, phone = pickle.loads(data)
-
-            if action == 'add':
-                if name not in contacts:
-                    contacts[name] = phone
-                    print(f"Adicionando contato: {name} - {phone}")
-                    sync_with_other_servers('add', name, phone, servers)
-                    response = f"Contato {name} adicionado com sucesso!"
-                else:
-                    response = f"Erro: Contato {name} já existe."
-            elif action == 'remove':
-                if name in contacts:
-                    del contacts[name]
-                    print(f"Removendo contato: {name}")
-                    sync_with_other_servers('remove', name, servers=servers)
-                    response = f"Contato {name} removido com sucesso!"
-                else:
-                    response = f"Erro: Contato {name} não encontrado."
-            elif action == 'update':
-                if name in contacts:
-                    contacts[name] = phone
-                    print(f"Atualizando contato: {name} - {phone}")
-                    sync_with_other_servers('update', name, phone, servers=servers)
-                    response = f"Contato {name} atualizado com sucesso!"
-                else:
-                    response = f"Erro: Contato {name} não encontrado."
-            elif action == 'view':
-                response = contacts if contacts else "Agenda vazia."
-
-            conn.sendall(pickle.dumps(response))
-    except ConnectionResetError:
+            # O id da requisição volta na resposta, permitindo várias requisições em andamento
+            request_id, payload = frame
+            codec = codec or connection_codec(payload)
+            request = decode(payload, codec)
+            started = time.perf_counter()
+            action, name, phone, options = unpack_request(request)
+            response = profiled(process_client_request, action, name, phone, options)
+            if isinstance(response, types.GeneratorType):
+                for part in response:  # Respostas em fluxo: várias mensagens com o mesmo id
+                    send_message(conn, part, request_id, codec)
+            else:
+                send_message(conn, response, request_id, codec)
+            record_client_request(action, response, started)
+    except (ConnectionResetError, BrokenPipeError):  # Inclusive clientes inscritos que já saíram
         print(f"Conexão com {addr} perdida.")
     finally:
         print(f"Cliente {addr} desconectado.")
+        open_connections.dec(kind='client')
         conn.close()
 
+# Função para consultar outra agenda ao iniciar: posição do log, versão mais recente e raiz da árvore de hashes
+# Retorna None se ela não responder, e {} para agendas anteriores ao formato binário, que não conhecem 'probe'
+def probe_server(server):
+    peer = peer_pool.get(server)
+    try:
+        peer.ping()
+        if peer.codec != BINARY:
+            return {}
+        return peer.request(('probe', None, None))
+    except OSError:
+        return None
+
+# Função para consultar todas as outras agendas ao mesmo tempo, da mais atualizada (versão mais recente já vista)
+# para a menos; as agendas fora do ar custam um só tempo limite de conexão, e não um por agenda
+def probe_servers(servers):
+    with ThreadPoolExecutor(max_workers=max(1, len(servers))) as executor:
+        infos = list(executor.map(probe_server, servers))
+    reachable = []
+    for server, info in zip(servers, infos):
+        if info is None:
+            print(f"Servidor {server} não está disponível para sincronização inicial.")
+        else:
+            reachable.append((server, info))
+    # Agendas antigas, sem versão, ficam por último, na ordem de --other_servers
+    reachable.sort(key=lambda item: tuple(item[1].get('version', (-1, -1))), reverse=True)
+    return reachable
+
+# Função para copiar a agenda inteira em partes de várias agendas iguais (mesma raiz) ao mesmo tempo, cada uma com
+# um intervalo diferente de folhas; o intervalo de uma agenda que falhar continua com as outras
+# Com mais de uma agenda, cada intervalo é tentado só uma vez de novo com a sua, antes de passar às outras
+def copy_from_servers(sources):
+    count = len(sources)
+    transfers = [StateTransfer(merge_records, transfer_chunk_size, transfer_compression, LEAVES * index // count, LEAVES * (index + 1) // count)
+                 for index in range(count)]
+
+    def run(transfer, server, retries=TRANSFER_RETRIES):
+        try:
+            transfer.run(peer_pool.get(server).request, retries)
+        except OSError as e:
+            print(f"Cópia com {server} interrompida: {e}")
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        list(executor.map(run, transfers, sources, [TRANSFER_RETRIES if count == 1 else 1] * count))
+    for transfer in transfers:
+        for server in sources:
+            if transfer.cursor is None:
+                break
+            run(transfer, server)
+    if any(transfer.cursor is not None for transfer in transfers):
+        raise ConnectionError("Nenhuma agenda conseguiu terminar a cópia.")
+    return sum(transfer.received for transfer in transfers), sum(transfer.compressed_bytes for transfer in transfers)
+
+# Função para aplicar as operações feitas numa agenda de origem a partir de "position" (durante a cópia)
+# Reaplicar as que já vieram nas partes é inofensivo; se o log dela já não as tiver, a anti-entropia repara as diferenças
+def catch_up(server, position):
+    data = peer_pool.get(server).request(('fetch_ops', position, 'chunked'))
+    if 'ops' in data:
+        apply_remote(data['ops'])
+        position = (data['epoch'], data['seq'])
+    peer_positions[server] = position
+    if storage is not None:
+        storage.log_peer_position(server, *position)
+
 # Função para sincronizar dados ao iniciar, caso agenda estivesse offline
+# Todas as outras agendas são consultadas ao mesmo tempo e a origem é a mais atualizada que responder
+# Quando ela já não tem no log as operações desde a última posição conhecida, a agenda inteira é copiada em partes,
+# dividida entre as agendas iguais a ela; uma cópia interrompida continua da última parte aplicada
 def fetch_data_from_other_servers(servers):
     print("Sincronizando dados ao iniciar...")
-    for server in servers:
+    reachable = probe_servers(servers)
+    for server, info in reachable:
+        peer = peer_pool.get(server)
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect(server)
-                s.sendall(pickle.dumps(('fetch_data', None, None)))
-                data = pickle.loads(s.recv(1024))
-                contacts.update(data)
-                print(f"Sincronização inicial com {server} completa.")
-                break  # Conecta e sincroniza de apenas um servidor ativo
-        except ConnectionRefusedError:
+            # Pede só as operações posteriores à última posição conhecida do log dessa agenda
+            data = peer.request(('fetch_ops', peer_positions.get(server), 'chunked'))
+            peer_positions[server] = (data['epoch'], data['seq'])
+            if 'ops' in data:
+                apply_remote(data['ops'])
+                if storage is not None:
+                    storage.log_peer_position(server, data['epoch'], data['seq'])
+                print(f"Sincronização inicial com {server} completa ({len(data['ops'])} operações).")
+            elif 'full_copy' in data:
+                started = time.time()
+                # As outras agendas com a mesma raiz têm exatamente os mesmos registros e dividem a cópia
+                twins = [(other, other_info) for other, other_info in reachable
+                         if other != server and 'root' in other_info and other_info['root'] == info['root']]
+                received, compressed_bytes = copy_from_servers([server] + [other for other, _ in twins])
+                catch_up(server, peer_positions[server])
+                for other, other_info in twins:
+                    try:
+                        catch_up(other, (other_info['epoch'], other_info['seq']))
+                    except OSError:
+                        pass
+                if storage is not None:
+                    write_snapshot()  # Os registros recebidos passam do log de escrita para um snapshot
+                print(f"Sincronização inicial com {server} completa (cópia em partes de {len(twins) + 1} agendas: {received} registros, "
+                      f"{compressed_bytes} bytes comprimidos, {time.time() - started:.1f} s).")
+            elif any(contacts.snapshot().parts):
+                # Cópia completa numa só mensagem (agenda antiga) sobre uma agenda com dados: cada nome fica com a versão mais nova
+                changes = merge_records(data['records'])
+                print(f"Sincronização inicial com {server} completa (cópia completa, {changes} contatos alterados).")
+            else:
+                # Cópia completa numa agenda vazia: substitui a agenda de uma vez e inicia uma nova época do log,
+                # já que as operações locais anteriores deixam de descrever o estado atual
+                contacts.replace_all(data['records'])
+                rebuild_indexes()
+                operation_log.reset()
+                if storage is not None:
+                    storage.reset(operation_log.epoch, data['records'], peer_positions)
+                print(f"Sincronização inicial com {server} completa (cópia completa).")
+            break  # Sincroniza com a agenda mais atualizada que responder
+        except OSError:
             print(f"Servidor {server} não está disponível para sincronização inicial.")
 
+# Função para carregar a agenda salva em disco (snapshot + log de escrita antecipada)
+def load_local_data():
+    state = storage.load()
+    if state is not None:
+        contacts.replace_all(state['records'])
+        rebuild_indexes()
+        peer_positions.update(state['peer_positions'])
+        operation_log.restore(state['epoch'], state['seq'], state['ops'])
+        print(f"Agenda carregada do disco: {len(contacts)} contatos, sequência {state['seq']}.")
+    storage.open(operation_log.epoch)
+    operation_log.sink = storage.log_operation
+
+# Função para copiar o estado atual de forma consistente para um snapshot
+def capture_state():
+    epoch, seq = operation_log.position()  # Lida antes da cópia: o log reaplica o que vier depois
+    return epoch, seq, contacts.snapshot().records, dict(peer_positions)
+
+# Função para gravar um snapshot, registrando o tamanho e a duração nas métricas
+def write_snapshot():
+    started = time.perf_counter()
+    count = storage.snapshot(capture_state)
+    snapshot_seconds.set(time.perf_counter() - started)
+    snapshot_contacts.set(count)
+    snapshot_bytes.set(os.path.getsize(storage.snapshot_path))
+    return count
+
+# Função para gravar snapshots periodicamente, quando houve alterações
+def snapshot_loop(interval):
+    last_seq = operation_log.position()[1]
+    while True:
+        time.sleep(interval)
+        epoch, seq = operation_log.position()
+        if seq != last_seq:
+            count = write_snapshot()
+            last_seq = seq
+            print(f"Snapshot gravado: {count} contatos até a sequência {seq}.")
+
+# Função para comparar a agenda com outra pela árvore de hashes e reparar só os grupos de nomes diferentes
+# Os registros dos grupos são trocados nos dois sentidos e cada agenda fica com a versão mais nova de cada nome
+def anti_entropy_round(server):
+    peer = peer_pool.get(server)
+    buckets = differing_buckets(merkle_tree, lambda depth, indices: peer.request(('merkle_nodes', (depth, indices), None)), MAX_REPAIR_BUCKETS)
+    if not buckets:
+        return 0
+    remote = peer.request(('merkle_buckets', buckets, None))
+    changes = sum(merge_records(records) for records in remote.values())
+    peer.request(('merkle_repair', bucket_contents(buckets), None))
+    print(f"Anti-entropia: {len(buckets)} grupos comparados com {server}, {changes} contatos reparados aqui.")
+    return len(buckets)
+
+# Função para apagar periodicamente as lápides (remoções) mais antigas que "ttl" segundos
+# Uma agenda fora do ar por mais tempo que isso pode trazer de volta um contato removido
+def tombstone_gc_loop(ttl):
+    while True:
+        time.sleep(min(ttl, TOMBSTONE_GC_INTERVAL))
+        limit = time.time_ns() // 1000000 - int(ttl * 1000)
+        purged = 0
+        for name, (phone, version) in contacts.snapshot().items():
+            # Com a versão, a lápide só é apagada se não foi substituída por uma escrita mais nova
+            if phone is None and version[0] < limit and apply_operation('forget', name, version=version) is not None:
+                purged += 1
+        if purged:
+            print(f"{purged} lápides antigas apagadas.")
+
+# Função para executar a anti-entropia periodicamente com todas as outras agendas
+# "peers()" retorna as agendas comparadas em cada rodada
+def anti_entropy_loop(interval, peers):
+    while True:
+        time.sleep(interval)
+        for server in peers():
+            try:
+                anti_entropy_round(server)
+            except OSError:
+                print(f"Servidor {server} indisponível para anti-entropia.")
+
+# Função para listar as outras agendas conhecidas (de --other_servers, do anel do cluster ou descobertas pela fofoca)
+def known_peers(servers):
+    if gossip is not None:
+        members = gossip.member_list()
+    elif ring is not None:
+        members = ring.nodes
+    else:
+        members = servers
+    return [member for member in members if member != node_address]
+
+# Função para converter um endereço "IP:PORTA" em (IP, porta)
+def parse_address(text):
+    ip, port = text.rsplit(":", 1)
+    return ip, int(port)
+
+# Função para transferir os contatos cujas agendas responsáveis mudaram ao trocar o anel
+# Só os nomes com responsáveis diferentes são enviados; "joined" é uma agenda que entrou ou voltou ao cluster
+# e deve receber todos os contatos pelos quais responde
+def rebalance(old_ring, new_ring, joined=None):
+    transfers = {}  # agenda -> operações a enviar
+    dropped = []
+    for name, (phone, version) in contacts.snapshot().items():
+        old_owners = old_ring.owners(name, replication_factor)
+        new_owners = new_ring.owners(name, replication_factor)
+        if old_owners == new_owners and joined not in new_owners:
+            continue
+        # Quem envia é a primeira responsável antiga que continua no cluster (ou esta agenda, se nenhuma continua)
+        survivors = [node for node in old_owners if node in new_ring and node != joined]
+        if (survivors[0] if survivors else node_address) == node_address:
+            for node in new_owners:
+                if node != node_address and (node not in old_owners or node == joined):
+                    # Lápides também são enviadas, para que a remoção chegue às novas responsáveis
+                    transfers.setdefault(node, []).append(('add' if phone is not None else 'remove', name, phone, version))
+        if node_address not in new_owners:
+            dropped.append(name)
+
+    failed = set()
+    for node, operations in transfers.items():
+        peer = peer_pool.get(node)
+        try:
+            for start in range(0, len(operations), REBALANCE_BATCH_SIZE):
+                peer.request(('batch', operations[start:start + REBALANCE_BATCH_SIZE], None))
+            print(f"Rebalanceamento: {len(operations)} contatos enviados para {node}.")
+        except OSError:
+            print(f"Servidor {node} indisponível para o rebalanceamento.")
+            failed.update(operation[1] for operation in operations)
+    # Os contatos que deixaram de ser desta agenda só são apagados depois de entregues
+    for name in dropped:
+        if name not in failed:
+            apply_operation('forget', name)
+    if dropped:
+        print(f"Rebalanceamento: {len(dropped) - len(failed & set(dropped))} contatos deixaram esta agenda.")
+
+# Função para trocar o anel do cluster ("update" cria o novo a partir do atual) e transferir os contatos afetados
+def change_ring(update, joined=None):
+    global ring
+    with membership_lock:
+        old_ring = ring
+        ring = new_ring = update(old_ring)
+    threading.Thread(target=rebalance, args=(old_ring, new_ring, joined), daemon=True).start()
+    return new_ring
+
+# Função para incluir uma agenda no cluster, retornando os membros atuais
+def add_member(node):
+    if node not in ring:
+        replication_queue.add_peer(node)
+        print(f"Agenda {node} entrou no cluster.")
+    return change_ring(lambda current: current.with_node(node), joined=node).nodes
+
+# Função para retirar uma agenda do cluster (se for esta, ela entrega os seus contatos e passa só a encaminhar pedidos)
+def remove_member(node):
+    if node not in ring:
+        return
+    if node != node_address:
+        replication_queue.remove_peer(node)
+    print(f"Agenda {node} saiu do cluster.")
+    change_ring(lambda current: current.without_node(node))
+
+# Função para retirar uma agenda do cluster, avisando todas as agendas
+def leave_cluster(node):
+    for member in ring.nodes:
+        if member == node_address:
+            continue
+        try:
+            peer_pool.get(member).request(('leave', node, None))
+        except OSError:
+            print(f"Servidor {member} indisponível para ser avisado da saída de {node}.")
+    remove_member(node)
+    return f"Agenda {node[0]}:{node[1]} retirada do cluster."
+
+# Função para entrar no cluster: avisa as agendas conhecidas e aprende os demais membros com elas
+# As agendas avisadas enviam para esta os contatos pelos quais ela passa a responder
+def join_cluster(seeds, sync_port):
+    global ring
+    # Espera o próprio servidor de sincronização aceitar conexões, para poder receber os contatos
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', sync_port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    pending = list(seeds)
+    contacted = set()
+    learned = set()
+    while pending:
+        server = pending.pop()
+        if server in contacted:
+            continue
+        contacted.add(server)
+        try:
+            members = peer_pool.get(server).request(('join', node_address, None))
+        except OSError:
+            print(f"Servidor {server} não está disponível para entrar no cluster.")
+            continue
+        for member in members:
+            if member != node_address and member not in contacted:
+                replication_queue.add_peer(member)
+                learned.add(member)
+                pending.append(member)
+    # As agendas do cluster já têm as cópias atuais: esta só descarta o que deixou de ser seu, sem reenviar nada
+    with membership_lock:
+        ring = HashRing(ring.nodes | learned)
+    drop_unowned()
+    print(f"Agenda no cluster com {len(ring)} membros.")
+
+# Função para apagar os contatos pelos quais esta agenda não responde mais
+def drop_unowned():
+    dropped = 0
+    for name, _ in contacts.snapshot().items():
+        if node_address not in owners_of(name):
+            apply_operation('forget', name)
+            dropped += 1
+    if dropped:
+        print(f"{dropped} contatos de outras agendas descartados.")
+
+# Função para gravar um último snapshot antes de encerrar
+def save_final_snapshot():
+    if storage is not None:
+        write_snapshot()
+        print("Snapshot final gravado.")
+
+# Função para encerrar a agenda ao receber SIGTERM
+def shutdown(signum, frame):
+    save_final_snapshot()
+    if profiler is not None:
+        profiler.flush()
+    # Encerra na hora, como o SIGTERM padrão, sem esperar as threads de clientes ainda conectados
+    sys.stdout.flush()
+    os._exit(0)
+
 # Função para iniciar o servidor de sincronização
 def start_sync_server(sync_port):
     sync_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -167,25 +1201,232 @@ def start_client_server(host, port, servers):
     finally:
         client_socket.close()
 
+# Função para elevar o limite de arquivos abertos, permitindo dezenas de milhares de conexões
+def raise_open_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return  # Sistema sem o módulo resource (Windows)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+# Função para executar uma requisição, fora do laço de eventos quando ela pode bloquear
+async def run_request_async(process, action, name, phone, options):
+    # Lotes, cópias completas e pedidos ao cluster sempre saem do laço de eventos;
+    # escritas simples só quando esperam disco ou replicação, ou trazem token (a repetição de uma escrita
+    # ainda em andamento espera por ela)
+    waits = replication_queue.ack_mode != 'local' or storage is not None
+    if ring is not None or action in BULK_ACTIONS or action == 'view' or (action in ('add', 'remove', 'update') and (waits or 'token' in options)):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, profiled, process, action, name, phone, options)
+    return profiled(process, action, name, phone, options)
+
+# Função para receber atualizações de outros servidores no modo assíncrono
+async def handle_server_sync_async(reader, writer):
+    open_connections.inc(kind='sync')
+    codec = None
+    try:
+        while True:
+            frame = await recv_frame_async(reader)
+            if frame is None:
+                break
+
+            request_id, payload = frame
+            codec = codec or connection_codec(payload)
+            action, name, phone = decode(payload, codec)
+            started = time.perf_counter()
+            if action not in INLINE_SYNC_ACTIONS:
+                # Lotes, fofoca e reparos esperam o disco, e a cópia completa (ou o pedido encaminhado) é demorada:
+                # atendidos fora do laço de eventos, para não travar as outras conexões
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(None, profiled, process_sync_request, action, name, phone)
+            else:
+                response = profiled(process_sync_request, action, name, phone)
+            if response is not None:
+                await send_message_async(writer, response, request_id, codec)
+            record_sync_request(action, started)
+    except ConnectionResetError:
+        print("Conexão com outro servidor foi perdida.")
+    except asyncio.CancelledError:
+        pass  # Agenda sendo encerrada
+    finally:
+        open_connections.dec(kind='sync')
+        writer.close()
+
+# Função para tratar ações dos clientes no modo assíncrono
+async def handle_client_async(reader, writer):
+    addr = writer.get_extra_info('peername')
+    print(f"Conexão estabelecida com {addr}")
+    open_connections.inc(kind='client')
+    codec = None
+    try:
+        while True:
+            frame = await recv_frame_async(reader)
+            if frame is None:
+                break
+
+            request_id, payload = frame
+            codec = codec or connection_codec(payload)
+            request = decode(payload, codec)
+            started = time.perf_counter()
+            action, name, phone, options = unpack_request(request)
+            if action == 'subscribe' and ring is None:
+                response = stream_changes_async(options.get('position'))
+            else:
+                response = await run_request_async(process_client_request, action, name, phone, options)
+            if isinstance(response, types.AsyncGeneratorType):
+                async for part in response:
+                    await send_message_async(writer, part, request_id, codec)
+            elif isinstance(response, types.GeneratorType):
+                for part in response:  # Respostas em fluxo: várias mensagens com o mesmo id
+                    await send_message_async(writer, part, request_id, codec)
+            else:
+                await send_message_async(writer, response, request_id, codec)
+            record_client_request(action, response, started)
+    except ConnectionResetError:
+        print(f"Conexão com {addr} perdida.")
+    except asyncio.CancelledError:
+        pass  # Agenda sendo encerrada
+    finally:
+        print(f"Cliente {addr} desconectado.")
+        open_connections.dec(kind='client')
+        writer.close()
+
+# Função para iniciar os servidores de clientes e de sincronização num único laço de eventos
+async def start_async_servers(host, port, sync_port):
+    raise_open_file_limit()
+    change_feed.attach_loop()
+    sync_server = await asyncio.start_server(handle_server_sync_async, '0.0.0.0', sync_port, reuse_address=True, backlog=4096)
+    print(f"Servidor de sincronização (asyncio) escutando na porta {sync_port}...")
+    client_server = await asyncio.start_server(handle_client_async, host, port, reuse_address=True, backlog=4096)
+    print(f"Servidor cliente (asyncio) escutando em {host}:{port}...")
+
+    # No laço de eventos o SIGTERM só sinaliza a parada, para os servidores fecharem de forma ordenada
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        pass  # Windows: mantém o tratador de sinal padrão
+
+    async with sync_server, client_server:
+        await stop.wait()
+    save_final_snapshot()
+    if profiler is not None:
+        profiler.flush()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Servidor de Agenda Distribuída")
     parser.add_argument('--host', type=str, required=True, help='IP do servidor')
     parser.add_argument('--port', type=int, required=True, help='Porta do servidor para clientes')
     parser.add_argument('--sync_port', type=int, required=True, help='Porta para sincronização entre servidores')
     parser.add_argument('--other_servers', nargs='*', help='Outros servidores no formato IP:SYNC_PORT')
+    parser.add_argument('--ack_mode', choices=ACK_MODES, default='local', help='Quando confirmar escritas ao cliente: local, majority ou all')
+    parser.add_argument('--ack_timeout', type=float, default=5.0, help='Tempo máximo (s) de espera pelas confirmações de replicação')
+    parser.add_argument('--batch_size', type=int, default=1000, help='Máximo de operações por lote de replicação')
+    parser.add_argument('--async_mode', action='store_true', help='Atende clientes e sincronização com asyncio em vez de uma thread por conexão')
+    parser.add_argument('--substring_search', action='store_true', help='Mantém um índice de trigramas para buscar por qualquer trecho do nome')
+    parser.add_argument('--anti_entropy_interval', type=float, default=30.0, help='Intervalo (s) entre comparações de hashes com as outras agendas (0 desativa)')
+    parser.add_argument('--data_dir', type=str, help='Diretório para salvar a agenda em disco (log de escrita antecipada + snapshots)')
+    parser.add_argument('--fsync_interval', type=float, default=0.005, help='Tempo máximo (s) para juntar escritas num mesmo fsync')
+    parser.add_argument('--fsync_batch', type=int, default=512, help='Quantidade de escritas que dispara um fsync imediato')
+    parser.add_argument('--snapshot_interval', type=float, default=60.0, help='Intervalo (s) entre snapshots da agenda')
+    parser.add_argument('--cluster', action='store_true', help='Divide os contatos entre as agendas (anel de hashes consistentes) em vez de copiar tudo em todas')
+    parser.add_argument('--replication_factor', type=int, default=2, help='No modo cluster, quantas agendas guardam cada contato')
+    parser.add_argument('--connect_timeout', type=float, default=1.0, help='Tempo máximo (s) para conectar a outra agenda')
+    parser.add_argument('--heartbeat_interval', type=float, default=1.0, help='Intervalo (s) entre verificações de saúde das outras agendas (0 desativa)')
+    parser.add_argument('--gossip', action='store_true', help='Espalha as escritas por fofoca (algumas agendas aleatórias por rodada); --other_servers vira só a lista inicial de contatos')
+    parser.add_argument('--gossip_fanout', type=int, default=3, help='Agendas que recebem cada rodada de fofoca')
+    parser.add_argument('--gossip_interval', type=float, default=0.05, help='Intervalo (s) entre rodadas de fofoca')
+    parser.add_argument('--gossip_rounds', type=int, default=0, help='Rodadas em que cada operação é repassada (0: conforme o tamanho do cluster)')
+    parser.add_argument('--metrics_port', type=int, default=0, help='Porta HTTP para as métricas no formato do Prometheus (GET /metrics; 0 desativa)')
+    parser.add_argument('--metrics_host', type=str, default='127.0.0.1', help='IP onde as métricas são servidas')
+    parser.add_argument('--profile_output', type=str, help='Ativa o profiler por amostragem das requisições, gravando as pilhas neste arquivo')
+    parser.add_argument('--profile_interval', type=float, default=0.005, help='Intervalo (s) entre amostras do profiler')
+    parser.add_argument('--transfer_chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help='Registros por parte ao receber a cópia completa de outra agenda')
+    parser.add_argument('--transfer_compression', choices=COMPRESSIONS, default='zlib', help='Compressão das partes da cópia completa recebida (zlib, lzma ou none)')
+    parser.add_argument('--disable_pickle', action='store_true', help='Recusa conexões em pickle, aceitando só o formato binário (clientes e agendas antigos deixam de conectar)')
+    parser.add_argument('--tombstone_ttl', type=float, default=7 * 24 * 3600, help='Tempo (s) que as remoções ficam guardadas como lápides antes de serem apagadas (0 mantém para sempre)')
 
     args = parser.parse_args()
+    pickle_disabled = args.disable_pickle
+    transfer_chunk_size = args.transfer_chunk_size
+    transfer_compression = args.transfer_compression
+    if args.gossip and args.cluster:
+        parser.error("--gossip e --cluster não podem ser usados juntos")
+    if args.gossip and args.ack_mode != 'local':
+        parser.error("com --gossip as escritas são confirmadas só localmente (--ack_mode local)")
 
     # Carrega a lista de outros servidores fornecidos pelo usuário
     servers = []
     if args.other_servers:
         for server in args.other_servers:
-            ip, port = server.split(":")
-            servers.append((ip, int(port)))
+            servers.append(parse_address(server))
+
+    if args.substring_search:
+        search_index = SearchIndex(substring=True)
+
+    # Carrega a agenda salva em disco, se a persistência local estiver ativa
+    if args.data_dir:
+        storage = Storage(args.data_dir, args.fsync_interval, args.fsync_batch)
+        load_local_data()
+        threading.Thread(target=snapshot_loop, args=(args.snapshot_interval,), daemon=True).start()
+    signal.signal(signal.SIGTERM, shutdown)
+
+    # Inicia a replicação em segundo plano para as outras agendas
+    # Com --data_dir, as operações que agendas indisponíveis deixaram de receber são guardadas em disco
+    node_address = (args.host, args.sync_port)
+    clock.node = node_key(node_address)
+    ack_timeout = args.ack_timeout
+    peer_pool.connect_timeout = args.connect_timeout
+    hint_dir = None
+    if args.data_dir:
+        hint_dir = os.path.join(args.data_dir, 'hints')
+        os.makedirs(hint_dir, exist_ok=True)
+    if args.gossip:
+        # Os membros do cluster são descobertos pela fofoca, a partir de --other_servers
+        replication_queue = ReplicationQueue(peer_pool, [], node_address, operation_log, args.ack_mode, args.batch_size, hint_dir)
+        gossip = GossipDisseminator(peer_pool, node_address, servers, apply_gossip, args.gossip_fanout, args.gossip_interval, args.gossip_rounds)
+    else:
+        replication_queue = ReplicationQueue(peer_pool, servers, node_address, operation_log, args.ack_mode, args.batch_size, hint_dir)
+    peer_pool.add_recover_listener(replication_queue.peer_recovered)
+
+    # Verifica periodicamente as outras agendas, para pular na hora as que estão fora do ar
+    if args.heartbeat_interval > 0:
+        HealthMonitor(peer_pool, lambda: known_peers(servers), args.heartbeat_interval)
+
+    if args.cluster:
+        # Cada contato fica só nas agendas responsáveis por ele; as agendas conhecidas enviam os contatos desta
+        # ao receberem o aviso de entrada (a anti-entropia compara agendas inteiras e não se aplica)
+        replication_factor = args.replication_factor
+        ring = HashRing(servers + [node_address])
+        threading.Thread(target=join_cluster, args=(servers, args.sync_port), daemon=True).start()
+    else:
+        # Sincroniza com os outros servidores ao iniciar (caso estivesse offline)
+        fetch_data_from_other_servers(servers)
+
+        # Compara periodicamente a agenda com as outras e repara as diferenças
+        # (na fofoca, com uma agenda aleatória por rodada)
+        if args.anti_entropy_interval > 0 and servers:
+            peers = (lambda: gossip.sample(1)) if gossip is not None else (lambda: servers)
+            threading.Thread(target=anti_entropy_loop, args=(args.anti_entropy_interval, peers), daemon=True).start()
+
+    if args.metrics_port:
+        serve_metrics(metrics, args.metrics_host, args.metrics_port)
+        print(f"Métricas em http://{args.metrics_host}:{args.metrics_port}/metrics")
+    if args.profile_output:
+        profiler = SamplingProfiler(args.profile_interval, args.profile_output)
 
-    # Sincroniza com os outros servidores ao iniciar (caso estivesse offline)
-    fetch_data_from_other_servers(servers)
+    # Apaga as lápides antigas, que já chegaram a todas as agendas
+    if args.tombstone_ttl > 0:
+        threading.Thread(target=tombstone_gc_loop, args=(args.tombstone_ttl,), daemon=True).start()
 
     # Inicializa os servidores de clientes e sincronização
-    threading.Thread(target=start_sync_server, args=(args.sync_port,), daemon=True).start()
-    start_client_server(args.host, args.port, servers)
+    if args.async_mode:
+        asyncio.run(start_async_servers(args.host, args.port, args.sync_port))
+    else:
+        threading.Thread(target=start_sync_server, args=(args.sync_port,), daemon=True).start()
+        start_client_server(args.host, args.port, servers)
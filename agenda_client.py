@@ -0,0 +1,528 @@
+import asyncio
+import itertools
+import random
+import socket
+import threading
+import time
+import uuid
+
+from protocol import BINARY, PICKLE, negotiate, send_message, recv_message, send_message_async, recv_message_async
+
+# Gerador de ids para casar cada resposta com sua requisição
+request_ids = itertools.count(1)
+
+# Quantidade padrão de contatos por página
+PAGE_SIZE = 100
+
+# Marca colocada nas filas de respostas quando a conexão termina (modo assíncrono)
+CLOSED = object()
+
+# Escritas que recebem um token de idempotência no cliente com várias agendas: repetidas em outra agenda depois
+# de uma falha, não são aplicadas duas vezes
+WRITE_ACTIONS = ('add', 'remove', 'update')
+
+# Tempo máximo (s) sem receber nada numa resposta em fluxo depois da primeira parte; as inscrições recebem
+# uma mensagem vazia a cada 15 s, então uma conexão calada por mais tempo que isso caiu
+STREAM_TIMEOUT = 40.0
+
+# Espera (s) antes de voltar a usar uma agenda que falhou, dobrada a cada falha seguida até MAX_NODE_RETRY_DELAY
+NODE_RETRY_DELAY = 1.0
+MAX_NODE_RETRY_DELAY = 30.0
+
+# Peso de cada nova medição na média móvel da latência de uma agenda
+LATENCY_WEIGHT = 0.2
+
+# Sem novas medições, a latência guardada cai pela metade a cada LATENCY_HALF_LIFE segundos: uma agenda que
+# esteve lenta volta a ser experimentada
+LATENCY_HALF_LIFE = 5.0
+
+
+# Função para montar uma requisição; as opções só são enviadas quando existem
+def make_request(action, name=None, phone=None, options=None):
+    return (action, name, phone, options) if options else (action, name, phone)
+
+
+# Função para acrescentar um token de idempotência às escritas de uma requisição (as demais ficam como estão)
+def with_token(request):
+    action, name, phone, options = (tuple(request) + (None,))[:4]
+    if action not in WRITE_ACTIONS or (options and 'token' in options):
+        return request
+    return make_request(action, name, phone, dict(options or {}, token=uuid.uuid4().hex))
+
+
+# Função para enviar requisições ao servidor
+def send_request(server_socket, action, name=None, phone=None, options=None, codec=PICKLE):
+    return send_requests(server_socket, [make_request(action, name, phone, options)], codec)[0]
+
+
+# Função para receber uma resposta em fluxo (várias mensagens com o mesmo id), página por página
+def stream_request(server_socket, action, name=None, phone=None, options=None, codec=PICKLE):
+    request_id = next(request_ids)
+    send_message(server_socket, make_request(action, name, phone, options), request_id, codec)
+    while True:
+        message = recv_message(server_socket, codec)
+        if message is None:
+            raise ConnectionResetError("Servidor encerrou a conexão.")
+        reply_id, part = message
+        if reply_id != request_id:
+            continue
+        if not isinstance(part, dict):
+            raise ValueError(part)
+        yield part
+        if part.get('done', True):
+            break
+
+
+# Função para enviar várias requisições de uma vez, sem esperar cada resposta
+def send_requests(server_socket, requests, codec=PICKLE):
+    pending = {}
+    for request in requests:
+        request_id = next(request_ids)
+        pending[request_id] = len(pending)
+        send_message(server_socket, request, request_id, codec)
+
+    responses = [None] * len(pending)
+    while pending:
+        message = recv_message(server_socket, codec)
+        if message is None:
+            raise ConnectionResetError("Servidor encerrou a conexão.")
+        request_id, response = message
+        if request_id in pending:
+            responses[pending.pop(request_id)] = response
+    return responses
+
+
+# Métodos de cada ação da agenda, comuns aos clientes síncrono e assíncrono
+# Cada um só monta a requisição e a entrega a "request" (ou "stream", para as respostas em fluxo)
+class AgendaActions:
+    def add(self, name, phone):
+        return self.request('add', name, phone)
+
+    def update(self, name, phone):
+        return self.request('update', name, phone)
+
+    def remove(self, name):
+        return self.request('remove', name)
+
+    # A agenda inteira (nome -> telefone), ou a mensagem "Agenda vazia."
+    def view(self):
+        return self.request('view')
+
+    # Página a partir do cursor ou, com "offset", da posição na ordem alfabética (a resposta repete o "offset"
+    # quando a agenda o atende; agendas antigas e o cluster o ignoram e voltam ao começo)
+    def view_page(self, cursor=None, limit=PAGE_SIZE, offset=None):
+        options = {'cursor': cursor, 'limit': limit}
+        if offset is not None:
+            options['offset'] = offset
+        return self.request('view_page', options=options)
+
+    def view_stream(self, cursor=None, limit=PAGE_SIZE):
+        return self.stream('view_stream', options={'cursor': cursor, 'limit': limit})
+
+    # Exportação em partes; sem "limit", a agenda usa o tamanho de parte padrão dela
+    def export(self, cursor=None, limit=None):
+        options = {'cursor': cursor}
+        if limit:
+            options['limit'] = limit
+        return self.stream('export', options=options)
+
+    def search(self, query, mode='prefix', cursor=None, limit=PAGE_SIZE):
+        return self.request('search', query, options={'mode': mode, 'cursor': cursor, 'limit': limit})
+
+    # Nomes com o telefone informado
+    def lookup_phone(self, phone):
+        return self.request('lookup_phone', phone=phone)
+
+    # Nomes de cada telefone: {telefone: [nomes]}
+    def lookup_phones(self, phones):
+        return self.request('lookup_phone', options={'phones': list(phones)})
+
+    def add_many(self, records):
+        return self.request('add_many', list(records))
+
+    def upsert_many(self, records):
+        return self.request('upsert_many', list(records))
+
+    # Alterações da agenda à medida que acontecem, sem fim: {'epoch', 'seq', 'changes': [(seq, ação, nome, telefone)], 'resync'}
+    # Com a última posição (época, sequência) recebida, começa pelas alterações perdidas; 'resync' pede para recarregar a agenda
+    # Ocupa a conexão enquanto durar: use um cliente só para ela
+    def subscribe(self, position=None):
+        return self.stream('subscribe', options={'position': position})
+
+    def digest(self):
+        return self.request('digest')
+
+    def peer_health(self):
+        return self.request('peer_health')
+
+    # Métricas da agenda: nome -> {rótulos: valor}
+    def stats(self):
+        return self.request('stats')
+
+    # Retira uma agenda do cluster ("IP:PORTA_SINC"; a agenda conectada, se None)
+    def leave_cluster(self, node=None):
+        return self.request('leave_cluster', node)
+
+
+# Cliente sem interface gráfica, com uma conexão persistente com uma agenda
+# As respostas são as da agenda, sem conversão: textos de sucesso ou de erro ("Erro: ...") e dicionários
+# Pode ser usado por várias threads; as requisições de uma mesma conexão são atendidas uma de cada vez
+# Usa o formato binário quando a agenda o conhece e o pickle com as agendas antigas
+class AgendaClient(AgendaActions):
+    def __init__(self, host, port, timeout=None, codec=BINARY):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = self._connect()
+        self.codec = codec
+        if codec == BINARY and not negotiate(self.sock):
+            self.sock.close()
+            self.sock = self._connect()
+            self.codec = PICKLE
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, action, name=None, phone=None, options=None):
+        with self.lock:
+            return send_request(self.sock, action, name, phone, options, self.codec)
+
+    # Envia várias requisições (ação, nome, telefone[, opções]) de uma vez e retorna as respostas na mesma ordem
+    def request_many(self, requests):
+        with self.lock:
+            return send_requests(self.sock, requests, self.codec)
+
+    # Gera as partes de uma resposta em fluxo; a conexão fica reservada até a última parte
+    def stream(self, action, name=None, phone=None, options=None):
+        with self.lock:
+            yield from stream_request(self.sock, action, name, phone, options, self.codec)
+
+
+# Cliente assíncrono (asyncio): várias requisições podem estar em andamento na mesma conexão,
+# e cada resposta é entregue a quem a pediu pelo id
+class AsyncAgendaClient(AgendaActions):
+    def __init__(self, reader, writer, codec=PICKLE):
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.ids = itertools.count(1)
+        self.pending = {}  # id da requisição -> fila das respostas
+        self.reader_task = asyncio.get_running_loop().create_task(self._read_responses())
+
+    # Conecta usando o formato binário quando a agenda o conhece, e o pickle com as agendas antigas
+    @classmethod
+    async def connect(cls, host, port, codec=BINARY):
+        reader, writer = await cls._open(host, port)
+        if codec == BINARY and not await cls._negotiate(reader, writer):
+            writer.close()
+            reader, writer = await cls._open(host, port)
+            codec = PICKLE
+        return cls(reader, writer, codec)
+
+    @staticmethod
+    async def _open(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+    # Mesmo combinado de "negotiate", antes de iniciar a leitura das respostas
+    @staticmethod
+    async def _negotiate(reader, writer):
+        try:
+            await send_message_async(writer, ('hello', None, None), codec=BINARY)
+            reply = await recv_message_async(reader, BINARY)
+        except (OSError, asyncio.IncompleteReadError):
+            return False
+        return reply is not None and isinstance(reply[1], list) and BINARY in reply[1]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        self.reader_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def _read_responses(self):
+        try:
+            while True:
+                message = await recv_message_async(self.reader, self.codec)
+                if message is None:
+                    break
+                request_id, response = message
+                queue = self.pending.get(request_id)
+                if queue is not None:
+                    queue.put_nowait(response)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for queue in self.pending.values():
+                queue.put_nowait(CLOSED)
+
+    async def _send(self, request):
+        if self.reader_task.done():
+            raise ConnectionResetError("Servidor encerrou a conexão.")
+        request_id = next(self.ids)
+        queue = self.pending[request_id] = asyncio.Queue()
+        await send_message_async(self.writer, request, request_id, self.codec)
+        return request_id, queue
+
+    @staticmethod
+    async def _receive(queue):
+        response = await queue.get()
+        if response is CLOSED:
+            raise ConnectionResetError("Servidor encerrou a conexão.")
+        return response
+
+    async def request(self, action, name=None, phone=None, options=None):
+        request_id, queue = await self._send(make_request(action, name, phone, options))
+        try:
+            return await self._receive(queue)
+        finally:
+            del self.pending[request_id]
+
+    # Envia várias requisições de uma vez e retorna as respostas na mesma ordem
+    async def request_many(self, requests):
+        sent = [await self._send(request) for request in requests]
+        try:
+            return [await self._receive(queue) for _, queue in sent]
+        finally:
+            for request_id, _ in sent:
+                del self.pending[request_id]
+
+    # Gera (async for) as partes de uma resposta em fluxo
+    async def stream(self, action, name=None, phone=None, options=None):
+        request_id, queue = await self._send(make_request(action, name, phone, options))
+        try:
+            while True:
+                part = await self._receive(queue)
+                if not isinstance(part, dict):
+                    raise ValueError(part)
+                yield part
+                if part.get('done', True):
+                    break
+        finally:
+            del self.pending[request_id]
+
+
+# Estado de uma agenda no cliente com várias agendas
+class Endpoint:
+    def __init__(self, address):
+        self.address = address
+        self.client = None  # Conexão (AgendaClient), aberta no primeiro uso
+        self.connect_lock = threading.Lock()
+        self.outstanding = 0  # Requisições em andamento
+        self.latency = 0.0  # Média móvel (s); 0 até a primeira resposta, para toda agenda ser experimentada
+        self.measured_at = 0.0  # Momento da última medição (time.monotonic)
+        self.failures = 0
+        self.retry_at = 0.0  # Até quando a agenda é evitada depois de uma falha (time.monotonic)
+
+    # Custo estimado de mandar mais uma requisição para esta agenda
+    def load(self, now):
+        return self.latency * 0.5 ** ((now - self.measured_at) / LATENCY_HALF_LIFE) * (self.outstanding + 1)
+
+
+# Cliente com várias agendas (lista de (IP, porta)), para distribuir as leituras e continuar quando uma agenda cai
+# Cada requisição vai para uma agenda disponível: de duas sorteadas, a de menor latência média ponderada pelas
+# requisições em andamento. Numa falha de conexão, a requisição é repetida em outra agenda, e a que falhou é
+# evitada por um tempo (ConnectionError quando nenhuma responde)
+# As escritas levam um token de idempotência: se a tentativa que falhou chegou a ser aplicada, a agenda da
+# repetição já conhece o token (pela replicação) e devolve a mesma resposta, sem aplicar de novo
+# Pode ser usado por várias threads; cada agenda tem uma conexão, e as respostas em fluxo abrem uma conexão própria
+class BalancedAgendaClient(AgendaActions):
+    def __init__(self, addresses, timeout=None, codec=BINARY):
+        if not addresses:
+            raise ValueError("Informe ao menos uma agenda.")
+        self.endpoints = [Endpoint(tuple(address)) for address in addresses]
+        self.timeout = timeout
+        self.codec = codec
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for endpoint in self.endpoints:
+            with endpoint.connect_lock:
+                if endpoint.client is not None:
+                    endpoint.client.close()
+                    endpoint.client = None
+
+    # Escolhe (e conta como em andamento) a agenda da próxima tentativa, fora as de "tried"
+    # "prefer" é o endereço desejado, usado se estiver disponível; sem agendas disponíveis, tenta a que volta primeiro
+    # None quando todas já foram tentadas
+    def _choose(self, tried, prefer=None):
+        now = time.monotonic()
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried]
+            if not candidates:
+                return None
+            healthy = [endpoint for endpoint in candidates if endpoint.retry_at <= now]
+            preferred = [endpoint for endpoint in healthy if endpoint.address == prefer]
+            if preferred:
+                chosen = preferred[0]
+            elif healthy:
+                chosen = min(random.sample(healthy, min(2, len(healthy))), key=lambda endpoint: endpoint.load(now))
+            else:
+                chosen = min(candidates, key=lambda endpoint: endpoint.retry_at)
+            chosen.outstanding += 1
+            return chosen
+
+    # Registra o fim de uma tentativa (sempre, para não deixar requisições em andamento esquecidas): a latência
+    # ("elapsed"), só quando ela deu certo, ou, se a agenda falhou, o tempo até ela voltar a ser usada
+    def _release(self, endpoint, elapsed=None, failed=False):
+        with self.lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.retry_at = time.monotonic() + min(NODE_RETRY_DELAY * 2 ** (endpoint.failures - 1),
+                                                           MAX_NODE_RETRY_DELAY)
+            elif elapsed is not None:
+                now = time.monotonic()
+                latency = endpoint.latency * 0.5 ** ((now - endpoint.measured_at) / LATENCY_HALF_LIFE)
+                endpoint.latency = latency + (elapsed - latency) * (LATENCY_WEIGHT if latency else 1)
+                endpoint.measured_at = now
+                endpoint.failures = 0
+                endpoint.retry_at = 0.0
+
+    # Conexão com a agenda, aberta no primeiro uso; retorna também se ela já existia
+    def _client(self, endpoint):
+        with endpoint.connect_lock:
+            if endpoint.client is not None:
+                return endpoint.client, True
+            endpoint.client = AgendaClient(*endpoint.address, timeout=self.timeout, codec=self.codec)
+            return endpoint.client, False
+
+    def _drop(self, endpoint, client):
+        with endpoint.connect_lock:
+            if endpoint.client is client:
+                endpoint.client = None
+        client.close()
+
+    # Executa "call" (que recebe um AgendaClient) numa agenda, trocando de agenda a cada falha de conexão
+    # Uma conexão antiga que falha (a agenda pode ter reiniciado) é trocada por uma nova antes de desistir da agenda
+    # Outros erros (mensagem inválida, interrupção) são repassados, descartando a conexão, que pode ter ficado no
+    # meio de uma mensagem
+    def _call(self, call, prefer=None):
+        tried = []
+        error = None
+        while True:
+            endpoint = self._choose(tried, prefer)
+            if endpoint is None:
+                raise ConnectionError(f"Nenhuma agenda respondeu: {error}")
+            started = time.perf_counter()
+            elapsed = None
+            failed = False
+            try:
+                for attempt in range(2):
+                    client = None
+                    try:
+                        client, reused = self._client(endpoint)
+                        response = call(client)
+                    except (OSError, EOFError) as e:
+                        error = e
+                        if client is not None:
+                            self._drop(endpoint, client)
+                        if client is not None and reused and not attempt:
+                            continue
+                        failed = True
+                        break
+                    except BaseException:
+                        if client is not None:
+                            self._drop(endpoint, client)
+                        raise
+                    elapsed = time.perf_counter() - started
+                    return response
+            finally:
+                self._release(endpoint, elapsed, failed)
+            tried.append(endpoint)
+
+    def request(self, action, name=None, phone=None, options=None, prefer=None):
+        action, name, phone, *rest = with_token(make_request(action, name, phone, options))
+        return self._call(lambda client: client.request(action, name, phone, *rest), prefer)
+
+    # Envia várias requisições de uma vez para uma mesma agenda e retorna as respostas na mesma ordem
+    def request_many(self, requests):
+        requests = [with_token(request) for request in requests]
+        return self._call(lambda client: client.request_many(requests))
+
+    # Gera as partes de uma resposta em fluxo, numa conexão só para ela
+    # A conexão e a primeira parte têm o tempo limite das requisições; as seguintes, STREAM_TIMEOUT
+    # Troca de agenda só enquanto nenhuma parte foi recebida
+    def stream(self, action, name=None, phone=None, options=None, prefer=None):
+        tried = []
+        error = None
+        while True:
+            endpoint = self._choose(tried, prefer)
+            if endpoint is None:
+                raise ConnectionError(f"Nenhuma agenda respondeu: {error}")
+            tried.append(endpoint)
+            started = time.perf_counter()
+            client = None
+            try:
+                client = AgendaClient(*endpoint.address, timeout=self.timeout, codec=self.codec)
+                parts = client.stream(action, name, phone, options)
+                first = next(parts, None)
+            except (OSError, EOFError) as e:
+                error = e
+                self._release(endpoint, failed=True)
+                if client is not None:
+                    client.close()
+                continue
+            except BaseException:
+                self._release(endpoint)
+                if client is not None:
+                    client.close()
+                raise
+            self._release(endpoint, time.perf_counter() - started)
+            with client:
+                if first is None:  # Fluxo sem partes
+                    return
+                client.sock.settimeout(STREAM_TIMEOUT)
+                yield first
+                yield from parts
+            return
+
+    # Endereço de uma agenda disponível para uma conexão longa (inscrição), fora as de "exclude" se houver outras
+    def pick_address(self, exclude=()):
+        endpoint = self._choose([endpoint for endpoint in self.endpoints if endpoint.address in exclude]) \
+            or self._choose([])
+        self._release(endpoint)
+        return endpoint.address
+
+    # Marca uma agenda como indisponível (falha percebida fora do cliente, como numa inscrição)
+    def mark_failed(self, address):
+        for endpoint in self.endpoints:
+            if endpoint.address == address:
+                with self.lock:
+                    endpoint.outstanding += 1
+                self._release(endpoint, failed=True)
+
+    # Estado de cada agenda: requisições em andamento, latência média (ms), falhas seguidas e se está disponível
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return {f"{endpoint.address[0]}:{endpoint.address[1]}": {
+                        'outstanding': endpoint.outstanding, 'latency_ms': round(endpoint.latency * 1000, 2),
+                        'failures': endpoint.failures, 'available': endpoint.retry_at <= now}
+                    for endpoint in self.endpoints}
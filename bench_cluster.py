@@ -0,0 +1,225 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from agenda_client import AgendaClient
+
+# Carga padrão: proporção de cada ação
+DEFAULT_MIX = 'add=35,update=35,remove=10,view_page=20'
+
+# Ações aceitas na carga
+MIX_ACTIONS = ('add', 'update', 'remove', 'view', 'view_page', 'search', 'lookup_phone')
+
+# Percentis de latência informados
+PERCENTILES = (('p50', 0.50), ('p99', 0.99), ('p999', 0.999))
+
+
+# Função para ler a carga no formato "ação=peso,ação=peso"
+def parse_mix(text):
+    mix = []
+    for item in text.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in MIX_ACTIONS:
+            raise argparse.ArgumentTypeError(f"ação {action} desconhecida (use {', '.join(MIX_ACTIONS)})")
+        try:
+            mix.append((action, float(weight or 1)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"peso inválido para {action}: {weight}")
+    return mix
+
+
+# Função para calcular um percentil (posição mais próxima) de uma lista já ordenada
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Função para iniciar uma agenda local e esperar a porta de clientes aceitar conexões
+def start_node(index, nodes, host, base_port, server_args):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agenda1.py')
+    others = [f"{host}:{base_port + 1000 + other}" for other in range(nodes) if other != index]
+    command = [sys.executable, script, '--host', host, '--port', str(base_port + index),
+               '--sync_port', str(base_port + 1000 + index), *server_args]
+    if others:
+        command += ['--other_servers', *others]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+
+def wait_for_port(host, port, timeout=30.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+# Classe que gera as requisições de um processo da carga, de forma reproduzível (semente + número do processo)
+class Workload:
+    def __init__(self, worker, mix, seed, keys, shared):
+        self.rng = random.Random(f"{seed}-{worker}")
+        self.actions = [action for action, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.keys = keys
+        # Com "shared", todos os processos usam os mesmos nomes (escritas concorrentes no mesmo contato)
+        self.prefix = "Bench" if shared else f"Bench {worker}"
+
+    def _name(self):
+        return f"{self.prefix}-{self.rng.randrange(self.keys)}"
+
+    def _phone(self):
+        return f"{self.rng.randrange(10 ** 8):08d}"
+
+    # Próxima requisição: (ação, nome, telefone, opções)
+    def next_request(self):
+        action = self.rng.choices(self.actions, self.weights)[0]
+        if action in ('add', 'update'):
+            return action, self._name(), self._phone(), None
+        if action == 'remove':
+            return action, self._name(), None, None
+        if action == 'view_page':
+            return action, None, None, {'cursor': self._name(), 'limit': 100}
+        if action == 'search':
+            return action, self.prefix, None, {'limit': 100}
+        if action == 'lookup_phone':
+            return action, None, self._phone(), None
+        return action, None, None, None
+
+
+# Função executada por cada processo: envia requisições a uma agenda até o fim do tempo, medindo cada uma
+def run_worker(address, worker, mix, seed, keys, shared, duration, start_at, results):
+    workload = Workload(worker, mix, seed, keys, shared)
+    latencies = {action: [] for action, _ in mix}
+    errors = 0
+    with AgendaClient(*address) as client:
+        while time.time() < start_at:
+            time.sleep(0.001)
+        deadline = start_at + duration
+        while time.time() < deadline:
+            action, name, phone, options = workload.next_request()
+            started = time.perf_counter()
+            response = client.request(action, name, phone, options)
+            latencies[action].append(time.perf_counter() - started)
+            # Inclusões de nomes existentes e alterações de nomes ausentes são respostas normais da carga
+            if isinstance(response, str) and response.startswith("Erro") and 'já existe' not in response and 'não encontrado' not in response:
+                errors += 1
+    results.put((latencies, errors))
+
+
+# Função para esperar todas as agendas terem a mesma raiz da árvore de hashes; retorna o tempo, ou None se não convergirem
+def wait_convergence(addresses, timeout):
+    started = time.time()
+    clients = [AgendaClient(*address) for address in addresses]
+    try:
+        while time.time() - started < timeout:
+            roots = {client.digest()['root'] for client in clients}
+            if len(roots) == 1:
+                return time.time() - started
+            time.sleep(0.01)
+        return None
+    finally:
+        for client in clients:
+            client.close()
+
+
+# Função para executar uma medição: "processes" processos distribuídos entre as agendas, pelo tempo pedido
+def measure(addresses, processes, mix, seed, keys, shared, duration):
+    results = multiprocessing.Queue()
+    start_at = time.time() + 0.5 + processes * 0.01  # Dá tempo de todas as conexões serem abertas
+    workers = [multiprocessing.Process(target=run_worker, args=(addresses[i % len(addresses)], i, mix, seed, keys, shared,
+                                                                duration, start_at, results))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    latencies = {action: [] for action, _ in mix}
+    errors = 0
+    for _ in workers:
+        worker_latencies, worker_errors = results.get()
+        for action, values in worker_latencies.items():
+            latencies[action].extend(values)
+        errors += worker_errors
+    for worker in workers:
+        worker.join()
+
+    report = {'processes': processes, 'duration': duration, 'errors': errors, 'actions': {}}
+    total = []
+    for action, values in latencies.items():
+        values.sort()
+        total.extend(values)
+        report['actions'][action] = dict(count=len(values), **{name: percentile(values, fraction) for name, fraction in PERCENTILES})
+    total.sort()
+    report['ops_per_second'] = len(total) / duration
+    report['all'] = dict(count=len(total), **{name: percentile(total, fraction) for name, fraction in PERCENTILES})
+    return report
+
+
+# Função para exibir o resultado de uma medição
+def print_report(report):
+    print(f"\n{report['processes']} processos: {report['ops_per_second']:.0f} ops/s, {report['errors']} erros")
+    print(f"{'ação':>12} {'requisições':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'p999 (ms)':>10}")
+    for action, stats in list(report['actions'].items()) + [('total', report['all'])]:
+        print(f"{action:>12} {stats['count']:>12} {stats['p50'] * 1000:>10.2f} {stats['p99'] * 1000:>10.2f} {stats['p999'] * 1000:>10.2f}")
+    if 'convergence' in report:
+        convergence = report['convergence']
+        print(f"Convergência das réplicas: {'não convergiu' if convergence is None else f'{convergence:.3f} s'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede vazão, latência (p50/p99/p999) e tempo de convergência de um cluster de agendas")
+    parser.add_argument('--nodes', type=int, default=3, help='Agendas locais iniciadas para o teste')
+    parser.add_argument('--servers', nargs='*', help='Usa agendas já em execução (IP:PORTA de clientes) em vez de iniciar agendas locais')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='IP das agendas locais')
+    parser.add_argument('--base_port', type=int, default=16000, help='Porta de clientes da primeira agenda local (sincronização: +1000)')
+    parser.add_argument('--processes', type=int, nargs='*', default=[4, 16], help='Quantidades de processos de carga a medir')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'Proporção das ações, ex.: {DEFAULT_MIX}')
+    parser.add_argument('--keys', type=int, default=10000, help='Nomes diferentes usados por cada processo')
+    parser.add_argument('--shared_keys', action='store_true', help='Todos os processos escrevem nos mesmos nomes (conflitos entre agendas)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Duração (s) de cada medição')
+    parser.add_argument('--seed', type=int, default=1, help='Semente da carga, para repetir a mesma sequência de requisições')
+    parser.add_argument('--convergence_timeout', type=float, default=60.0, help='Tempo máximo (s) de espera pela convergência (0 não mede)')
+    parser.add_argument('--json', type=str, help='Arquivo onde gravar os resultados em JSON, para comparar execuções')
+    parser.add_argument('--server_args', nargs=argparse.REMAINDER, default=[], help='Argumentos extras para as agendas iniciadas (ex.: --async_mode)')
+
+    args = parser.parse_args()
+    nodes = []
+    if args.servers:
+        addresses = []
+        for server in args.servers:
+            ip, port = server.rsplit(':', 1)
+            addresses.append((ip, int(port)))
+    else:
+        addresses = [(args.host, args.base_port + index) for index in range(args.nodes)]
+        nodes = [start_node(index, args.nodes, args.host, args.base_port, args.server_args) for index in range(args.nodes)]
+    # No modo cluster cada agenda guarda só parte dos contatos: as raízes nunca são iguais
+    measure_convergence = args.convergence_timeout > 0 and '--cluster' not in args.server_args
+
+    try:
+        for address in addresses:
+            wait_for_port(*address)
+        reports = []
+        for processes in args.processes:
+            report = measure(addresses, processes, args.mix, args.seed, args.keys, args.shared_keys, args.duration)
+            if measure_convergence:
+                report['convergence'] = wait_convergence(addresses, args.convergence_timeout)
+            print_report(report)
+            reports.append(report)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'nodes': len(addresses), 'mix': dict(args.mix), 'seed': args.seed, 'server_args': args.server_args,
+                           'results': reports}, f, indent=2)
+    finally:
+        for node in nodes:
+            node.terminate()
+        for node in nodes:
+            node.wait()
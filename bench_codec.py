@@ -0,0 +1,84 @@
+import argparse
+import json
+import random
+import time
+
+from protocol import CODECS, decode, encode
+
+# Mensagens medidas: a agenda inteira ('view'), a cópia completa com versões e lápides ('records'),
+# uma lista de operações como a enviada na recuperação ('ops') e uma página de contatos ('page')
+MESSAGES = ('view', 'records', 'ops', 'page')
+
+# Contatos por página na mensagem 'page'
+PAGE_SIZE = 1000
+
+# Fração dos registros que são lápides (remoções) na mensagem 'records'
+TOMBSTONE_FRACTION = 0.1
+
+
+# Função para gerar a agenda de teste: nome -> (telefone ou None, versão), sempre igual para a mesma semente
+def make_records(count, seed):
+    rng = random.Random(seed)
+    nodes = [f"127.0.0.1:{5001 + index}" for index in range(3)]
+    records = {}
+    for index in range(count):
+        phone = None if rng.random() < TOMBSTONE_FRACTION else f"{rng.randrange(10 ** 8):08d}"
+        version = (1700000000000 + rng.randrange(10 ** 9), rng.randrange(4), rng.choice(nodes))
+        records[f"Contato {index:07d}"] = (phone, version)
+    return records
+
+
+# Função para montar cada mensagem medida a partir da agenda de teste
+def make_messages(records):
+    contacts = {name: phone for name, (phone, _) in records.items() if phone is not None}
+    ops = [(seq, 'update' if phone is not None else 'remove', name, phone, version)
+           for seq, (name, (phone, version)) in enumerate(records.items(), 1)]
+    page = {'contacts': sorted(contacts.items())[:PAGE_SIZE], 'next_cursor': None, 'total': len(contacts)}
+    return {'view': contacts, 'records': {'epoch': 1, 'seq': len(ops), 'records': records},
+            'ops': {'epoch': 1, 'seq': len(ops), 'ops': ops}, 'page': page}
+
+
+# Função para medir o menor tempo (s) de "repeat" execuções
+def best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+# Função para medir tamanho e tempos de serialização de uma mensagem em cada formato
+def measure(message, repeat):
+    results = {}
+    for codec in CODECS:
+        payload = encode(message, codec)
+        if decode(payload, codec) != message:
+            raise AssertionError(f"O formato {codec} não reproduz a mensagem original.")
+        results[codec] = {'bytes': len(payload),
+                          'encode': best_time(lambda: encode(message, codec), repeat),
+                          'decode': best_time(lambda: decode(payload, codec), repeat)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara o formato binário com o pickle: tamanho e tempo de serialização das mensagens")
+    parser.add_argument('--contacts', type=int, nargs='*', default=[10000, 100000, 1000000], help='Tamanhos de agenda a medir')
+    parser.add_argument('--messages', nargs='*', choices=MESSAGES, default=list(MESSAGES), help='Mensagens a medir')
+    parser.add_argument('--repeat', type=int, default=3, help='Execuções de cada medição (vale a mais rápida)')
+    parser.add_argument('--seed', type=int, default=1, help='Semente da agenda de teste')
+    parser.add_argument('--json', type=str, help='Arquivo onde gravar os resultados em JSON, para comparar execuções')
+
+    args = parser.parse_args()
+    reports = []
+    print(f"{'mensagem':>9} {'contatos':>9} {'formato':>8} {'bytes':>12} {'codificar (ms)':>15} {'decodificar (ms)':>17}")
+    for count in args.contacts:
+        messages = make_messages(make_records(count, args.seed))
+        for name in args.messages:
+            results = measure(messages[name], args.repeat)
+            for codec, stats in results.items():
+                print(f"{name:>9} {count:>9} {codec:>8} {stats['bytes']:>12} {stats['encode'] * 1000:>15.1f} {stats['decode'] * 1000:>17.1f}")
+            reports.append({'message': name, 'contacts': count, 'results': results})
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'seed': args.seed, 'repeat': args.repeat, 'results': reports}, f, indent=2)
@@ -0,0 +1,85 @@
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from protocol import send_message, recv_message
+
+# Proporção de cada tipo de requisição na carga mista
+OPERATION_MIX = (('add', 0.3), ('update', 0.3), ('remove', 0.1), ('lookup_phone', 0.3))
+
+
+# Função para escolher a próxima requisição da carga mista
+def next_request(rng, worker, counter):
+    action = rng.choices([action for action, _ in OPERATION_MIX], [weight for _, weight in OPERATION_MIX])[0]
+    # Cada conexão usa um conjunto próprio de nomes, para que as inclusões não colidam entre si
+    name = f"Bench {worker}-{rng.randrange(max(counter, 1))}"
+    phone = f"{rng.randrange(10 ** 8):08d}"
+    if action == 'add':
+        return ('add', f"Bench {worker}-{counter}", phone)
+    if action == 'lookup_phone':
+        return ('lookup_phone', None, phone)
+    return (action, name, phone)
+
+
+# Função executada por cada processo: envia requisições numa conexão até o fim do tempo
+def run_connection(host, port, worker, duration, start_at, results):
+    rng = random.Random(worker)
+    with socket.create_connection((host, port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while time.time() < start_at:
+            time.sleep(0.001)
+        operations = 0
+        deadline = start_at + duration
+        while time.time() < deadline:
+            send_message(sock, next_request(rng, worker, operations), operations + 1)
+            if recv_message(sock) is None:
+                break
+            operations += 1
+    results.put(operations)
+
+
+# Função para medir a vazão (operações por segundo) com um número de conexões simultâneas
+def measure(host, port, connections, duration):
+    results = multiprocessing.Queue()
+    start_at = time.time() + 0.5  # Dá tempo de todas as conexões serem abertas
+    workers = [multiprocessing.Process(target=run_connection, args=(host, port, f"{connections}.{i}", duration, start_at, results))
+               for i in range(connections)]
+    for worker in workers:
+        worker.start()
+    total = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    return total / duration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede a vazão da agenda com carga mista (inclusões, alterações, remoções e buscas) e várias conexões")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='IP da agenda')
+    parser.add_argument('--port', type=int, default=15000, help='Porta da agenda para clientes')
+    parser.add_argument('--connections', type=int, nargs='*', default=[1, 2, 4, 8, 16, 32], help='Quantidades de conexões simultâneas a medir')
+    parser.add_argument('--duration', type=float, default=5.0, help='Duração (s) de cada medição')
+    parser.add_argument('--start_server', action='store_true', help='Inicia uma agenda local (agenda1.py) para o teste')
+    parser.add_argument('--server_args', nargs=argparse.REMAINDER, default=[], help='Argumentos extras para a agenda iniciada (ex.: --async_mode)')
+
+    args = parser.parse_args()
+    server = None
+    if args.start_server:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agenda1.py')
+        server = subprocess.Popen([sys.executable, script, '--host', args.host, '--port', str(args.port),
+                                   '--sync_port', str(args.port + 1), *args.server_args], stdout=subprocess.DEVNULL)
+        time.sleep(1)
+
+    try:
+        print(f"{'conexões':>9} {'ops/s':>10} {'ops/s por conexão':>18}")
+        for connections in args.connections:
+            throughput = measure(args.host, args.port, connections, args.duration)
+            print(f"{connections:>9} {throughput:>10.0f} {throughput / connections:>18.0f}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
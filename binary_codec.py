@@ -0,0 +1,308 @@
+import struct
+import sys
+from array import array
+from operator import itemgetter
+
+# Formato binário das mensagens, no lugar do pickle: cada valor é um byte de tipo seguido do conteúdo,
+# com cabeçalhos de tamanho fixo (struct) e textos em UTF-8 precedidos do tamanho
+# Decodificar só cria os tipos abaixo: ao contrário do pickle, uma mensagem não consegue executar código
+# O primeiro byte é a versão do formato; nunca é 0x80, o primeiro byte das mensagens em pickle
+FORMAT_VERSION = 1
+
+# Tipos de valor
+NONE, TRUE, FALSE, INT, BIG_INT, FLOAT, STR, BYTES, LIST, TUPLE, MAP, TABLE = range(12)
+
+# Listas de tuplas de mesmo tamanho (TABLE) e dicionários (MAP) são gravados por colunas: todos os
+# primeiros campos, depois todos os segundos... Cada coluna usa a codificação mais compacta para o que contém
+COLUMN_ANY, COLUMN_INT, COLUMN_STR, COLUMN_OPTIONAL_STR, COLUMN_ENUM, COLUMN_TABLE = range(6)
+
+# Máximo de textos distintos numa coluna de valores repetidos (ações, agendas de origem das versões)
+MAX_ENUM_SIZE = 255
+
+# Valores olhados para decidir se vale a pena procurar textos repetidos na coluna
+ENUM_SAMPLE_SIZE = 64
+
+# Profundidade máxima de valores aninhados aceita ao decodificar
+MAX_DEPTH = 64
+
+TAG = struct.Struct('!B')
+INT_HEADER = struct.Struct('!q')
+FLOAT_HEADER = struct.Struct('!d')
+SIZE_HEADER = struct.Struct('!I')
+# Quantidade de linhas + quantidade de colunas
+TABLE_HEADER = struct.Struct('!II')
+# Os mesmos cabeçalhos já com o byte de tipo, para a codificação
+TAG_INT = struct.Struct('!Bq')
+TAG_FLOAT = struct.Struct('!Bd')
+TAG_SIZE = struct.Struct('!BI')
+TAG_TABLE = struct.Struct('!BII')
+
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+
+# Separador dos textos de uma coluna, juntados num só bloco; colunas com textos que o contêm usam COLUMN_ANY
+SEPARATOR = '\0'
+
+BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def _pack_array(typecode, values):
+    packed = array(typecode, values)
+    if not BIG_ENDIAN:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_array(typecode, data):
+    unpacked = array(typecode)
+    unpacked.frombytes(data)
+    if not BIG_ENDIAN:
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+# Função para juntar textos num só bloco UTF-8, ou None se algum contiver o separador
+def _join_texts(texts):
+    joined = SEPARATOR.join(texts)
+    if joined.count(SEPARATOR) != len(texts) - 1:
+        return None
+    return joined.encode('utf-8')
+
+
+def _split_texts(data, count):
+    texts = str(data, 'utf-8').split(SEPARATOR)
+    if len(texts) != count:
+        raise ValueError("Quantidade de textos não confere com o cabeçalho.")
+    return texts
+
+
+# Largura comum das tuplas, ou None se não forem todas tuplas (não vazias) do mesmo tamanho
+# As verificações usam map/set, sem um laço em Python por valor
+def _table_width(values):
+    if set(map(type, values)) != {tuple}:
+        return None
+    widths = set(map(len, values))
+    if len(widths) != 1 or 0 in widths:
+        return None
+    return widths.pop()
+
+
+# Colunas de uma lista de tuplas de mesmo tamanho
+def _columns(values, width):
+    return [list(map(itemgetter(index), values)) for index in range(width)]
+
+
+# Coluna de textos com poucos valores distintos: tabela dos textos + um byte por linha
+def _encode_enum(values, out):
+    if len(set(values[:ENUM_SAMPLE_SIZE])) * 4 > min(len(values), ENUM_SAMPLE_SIZE):
+        return False
+    table = dict.fromkeys(values)
+    if len(table) > MAX_ENUM_SIZE:
+        return False
+    texts = _join_texts(list(table))
+    if texts is None:
+        return False
+    for index, text in enumerate(table):
+        table[text] = index
+    out.append(TAG_SIZE.pack(COLUMN_ENUM, len(table)))
+    out.append(SIZE_HEADER.pack(len(texts)))
+    out.append(texts)
+    out.append(bytes(map(table.__getitem__, values)))
+    return True
+
+
+def _encode_column(values, out):
+    kinds = set(map(type, values))
+    if kinds == {str}:
+        if _encode_enum(values, out):
+            return
+        texts = _join_texts(values)
+        if texts is not None:
+            out.append(TAG_SIZE.pack(COLUMN_STR, len(texts)))
+            out.append(texts)
+            return
+    elif kinds == {int}:
+        try:
+            packed = _pack_array('q', values)
+        except OverflowError:
+            packed = None
+        if packed is not None:
+            out.append(TAG.pack(COLUMN_INT))
+            out.append(packed)
+            return
+    elif kinds == {tuple}:
+        width = _table_width(values)
+        if width is not None:
+            out.append(TAG_SIZE.pack(COLUMN_TABLE, width))
+            for column in _columns(values, width):
+                _encode_column(column, out)
+            return
+    if kinds == {str, type(None)}:
+        texts = _join_texts(['' if value is None else value for value in values])
+        if texts is not None:
+            out.append(TAG_SIZE.pack(COLUMN_OPTIONAL_STR, len(texts)))
+            out.append(texts)
+            out.append(bytes([value is None for value in values]))
+            return
+    out.append(TAG.pack(COLUMN_ANY))
+    for value in values:
+        _encode(value, out)
+
+
+def _encode(value, out):
+    kind = type(value)
+    if kind is str:
+        data = value.encode('utf-8')
+        out.append(TAG_SIZE.pack(STR, len(data)))
+        out.append(data)
+    elif value is None:
+        out.append(TAG.pack(NONE))
+    elif kind is bool:
+        out.append(TAG.pack(TRUE if value else FALSE))
+    elif kind is int:
+        if INT_MIN <= value <= INT_MAX:
+            out.append(TAG_INT.pack(INT, value))
+        else:
+            data = str(value).encode('ascii')
+            out.append(TAG_SIZE.pack(BIG_INT, len(data)))
+            out.append(data)
+    elif kind is float:
+        out.append(TAG_FLOAT.pack(FLOAT, value))
+    elif kind is tuple:
+        out.append(TAG_SIZE.pack(TUPLE, len(value)))
+        for item in value:
+            _encode(item, out)
+    elif kind is list:
+        width = _table_width(value) if value else None
+        if width is None:
+            out.append(TAG_SIZE.pack(LIST, len(value)))
+            for item in value:
+                _encode(item, out)
+        else:
+            out.append(TAG_TABLE.pack(TABLE, len(value), width))
+            for column in _columns(value, width):
+                _encode_column(column, out)
+    elif kind is dict:
+        out.append(TAG_SIZE.pack(MAP, len(value)))
+        _encode_column(list(value), out)
+        _encode_column(list(value.values()), out)
+    elif kind in (bytes, bytearray, memoryview):
+        data = bytes(value)
+        out.append(TAG_SIZE.pack(BYTES, len(data)))
+        out.append(data)
+    else:
+        raise TypeError(f"Tipo {kind.__name__} não pode ser enviado no formato binário.")
+
+
+# Função para serializar um valor no formato binário
+def dumps(value):
+    out = [TAG.pack(FORMAT_VERSION)]
+    _encode(value, out)
+    return b''.join(out)
+
+
+# Leitor de uma mensagem binária; qualquer inconsistência vira ValueError
+class Reader:
+    def __init__(self, payload):
+        self.data = memoryview(payload)
+        self.position = 0
+
+    def take(self, size):
+        start = self.position
+        end = start + size
+        if end > len(self.data):
+            raise ValueError("Mensagem binária truncada.")
+        self.position = end
+        return self.data[start:end]
+
+    def unpack(self, layout):
+        return layout.unpack(self.take(layout.size))
+
+    # Quantidade de itens (ou bytes) declarada no cabeçalho, limitada pelo que ainda resta da mensagem
+    def count(self):
+        (count,) = self.unpack(SIZE_HEADER)
+        if count > len(self.data) - self.position:
+            raise ValueError("Quantidade de itens maior que a mensagem.")
+        return count
+
+    # Colunas de uma tabela, já como tuplas (as colunas internas são montadas antes das externas)
+    def rows(self, count, width, depth):
+        if not width:
+            raise ValueError("Tabela sem colunas.")
+        return list(zip(*[self.column(count, depth) for _ in range(width)]))
+
+    def column(self, count, depth):
+        (kind,) = self.unpack(TAG)
+        if kind == COLUMN_STR:
+            return _split_texts(self.take(self.count()), count)
+        if kind == COLUMN_INT:
+            return _unpack_array('q', self.take(count * 8))
+        if kind == COLUMN_ENUM:
+            size = self.count()
+            table = _split_texts(self.take(self.count()), size)
+            try:
+                return [table[index] for index in self.take(count)]
+            except IndexError:
+                raise ValueError("Índice fora da tabela de textos.")
+        if kind == COLUMN_OPTIONAL_STR:
+            texts = _split_texts(self.take(self.count()), count)
+            return [None if missing else text for text, missing in zip(texts, self.take(count))]
+        if kind == COLUMN_TABLE:
+            if depth > MAX_DEPTH:
+                raise ValueError("Mensagem binária aninhada demais.")
+            return self.rows(count, self.count(), depth + 1)
+        if kind == COLUMN_ANY:
+            return [self.value(depth + 1) for _ in range(count)]
+        raise ValueError(f"Coluna de tipo {kind} desconhecida na mensagem binária.")
+
+    def value(self, depth=0):
+        if depth > MAX_DEPTH:
+            raise ValueError("Mensagem binária aninhada demais.")
+        (kind,) = self.unpack(TAG)
+        if kind == STR:
+            return str(self.take(self.count()), 'utf-8')
+        if kind == INT:
+            return self.unpack(INT_HEADER)[0]
+        if kind == NONE:
+            return None
+        if kind == TRUE:
+            return True
+        if kind == FALSE:
+            return False
+        if kind == FLOAT:
+            return self.unpack(FLOAT_HEADER)[0]
+        if kind == TUPLE:
+            return tuple([self.value(depth + 1) for _ in range(self.count())])
+        if kind == LIST:
+            return [self.value(depth + 1) for _ in range(self.count())]
+        if kind == MAP:
+            count = self.count()
+            keys = self.column(count, depth)
+            values = self.column(count, depth)
+            try:
+                return dict(zip(keys, values))
+            except TypeError:
+                raise ValueError("Chave de dicionário inválida.")
+        if kind == TABLE:
+            count, width = self.unpack(TABLE_HEADER)
+            return self.rows(count, width, depth)
+        if kind == BIG_INT:
+            return int(str(self.take(self.count()), 'ascii'))
+        if kind == BYTES:
+            return bytes(self.take(self.count()))
+        raise ValueError(f"Tipo {kind} desconhecido na mensagem binária.")
+
+
+# Função para desserializar uma mensagem no formato binário (ValueError se ela for inválida)
+def loads(payload):
+    reader = Reader(payload)
+    try:
+        (version,) = reader.unpack(TAG)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Versão {version} do formato binário não suportada.")
+        value = reader.value()
+    except (struct.error, UnicodeDecodeError, RecursionError) as e:
+        raise ValueError(f"Mensagem binária inválida: {e}")
+    if reader.position != len(reader.data):
+        raise ValueError("Bytes sobrando no fim da mensagem binária.")
+    return value
@@ -0,0 +1,107 @@
+import asyncio
+import collections
+import itertools
+import threading
+import uuid
+
+# Alterações guardadas para os clientes que se reconectam ('subscribe' com a última posição recebida)
+MAX_CHANGES = 10000
+
+
+# Alterações da agenda como os clientes as veem (contato criado, alterado ou removido), em ordem, para a ação 'subscribe'
+# Diferente do log de operações, não traz versões nem lápides: só o que muda na lista de contatos
+# A posição (época, sequência) é própria do feed; a época muda quando a agenda inteira é substituída,
+# e um cliente numa posição que não vale mais precisa recarregar a agenda
+class ChangeFeed:
+    def __init__(self, max_changes=MAX_CHANGES):
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.entries = collections.deque(maxlen=max_changes)  # (seq, ação, nome, telefone)
+        self.changed = threading.Condition()
+        # Laço de eventos do modo assíncrono e os futuros de quem espera nele, registrados com a trava "changed"
+        # (a mesma da publicação): uma publicação nunca cai entre a conferência da posição e a espera
+        self.loop = None
+        self.waiters = set()
+
+    # Liga o feed ao laço de eventos em execução, para wait_since_async esperar sem bloquear o laço
+    def attach_loop(self):
+        self.loop = asyncio.get_running_loop()
+
+    # Registra a mudança de um contato, dados o telefone antigo e o novo (None quando ele não existe)
+    # Mudanças só de versão (lápide sobre lápide, mesmo telefone) não interessam aos clientes
+    def publish(self, name, old_phone, phone):
+        if old_phone == phone:
+            return
+        action = 'add' if old_phone is None else 'remove' if phone is None else 'update'
+        with self.changed:
+            self.seq += 1
+            self.entries.append((self.seq, action, name, phone))
+            self.changed.notify_all()
+            waiters = self._take_waiters()
+        self._wake_loop(waiters)
+
+    # Retira os futuros que esperam (com a trava "changed"); cada um é acordado uma só vez
+    def _take_waiters(self):
+        waiters, self.waiters = self.waiters, set()
+        return waiters
+
+    def _wake_loop(self, waiters):
+        if waiters:
+            self.loop.call_soon_threadsafe(self._wake, waiters)
+
+    @staticmethod
+    def _wake(waiters):
+        for waiter in waiters:
+            if not waiter.done():  # Quem desistiu por tempo já teve o futuro cancelado
+                waiter.set_result(None)
+
+    # Posição atual do feed: (época, última sequência)
+    def position(self):
+        with self.changed:
+            return self.epoch, self.seq
+
+    # Alterações posteriores à posição, ou None se ela não vale mais (outra época, ou alterações já descartadas)
+    def since(self, epoch, seq):
+        with self.changed:
+            return self._since(epoch, seq)
+
+    def _since(self, epoch, seq):
+        if epoch != self.epoch or seq > self.seq:
+            return None
+        first_seq = self.entries[0][0] if self.entries else self.seq + 1
+        if seq < first_seq - 1:
+            return None
+        return list(itertools.islice(self.entries, seq - first_seq + 1, None))
+
+    # Como "since", mas espera até "timeout" segundos quando ainda não há alterações
+    def wait_since(self, epoch, seq, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.seq != seq or self.epoch != epoch, timeout)
+            return self._since(epoch, seq)
+
+    # Versão de wait_since para o modo assíncrono (requer attach_loop)
+    async def wait_since_async(self, epoch, seq, timeout):
+        waiter = self.loop.create_future()
+        with self.changed:
+            changes = self._since(epoch, seq)
+            if changes != []:
+                return changes
+            self.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.changed:
+                self.waiters.discard(waiter)
+        return self.since(epoch, seq)
+
+    # Inicia uma nova época (a agenda inteira foi substituída): os clientes conectados recarregam a agenda
+    def reset(self):
+        with self.changed:
+            self.epoch = uuid.uuid4().hex
+            self.seq = 0
+            self.entries.clear()
+            self.changed.notify_all()
+            waiters = self._take_waiters()
+        self._wake_loop(waiters)
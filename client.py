@@ -21,42 +21,317 @@
 # -----------------------------------------------------------------------------
 
 
-import socket
-import pickle
+import bisect
+import collections
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import messagebox, simpledialog
 import argparse
 
-# Função para conectar ao servidor escolhido pelo cliente
-def connect_to_server(host, port):
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((host, port))
-        print(f"Conectado ao servidor {host}:{port}")
-        return s
-    except ConnectionRefusedError:
-        print(f"Servidor {host}:{port} offline.")
-        return None
-
-# Função para enviar requisições ao servidor
-def send_request(server_socket, action, name=None, phone=None):
-    request = (action, name, phone)
-    server_socket.sendall(pickle.dumps(request))
-    response = pickle.loads(server_socket.recv(1024))
-    return response
+# As funções de requisição ficam em agenda_client.py, que não depende do Tkinter
+from agenda_client import STREAM_TIMEOUT, AgendaClient, BalancedAgendaClient
+from index import search_key
+
+# Quantidade de contatos buscados por página
+PAGE_SIZE = 100
+
+# Linhas visíveis da lista de contatos
+VISIBLE_ROWS = 10
+
+# Intervalo (ms) entre as entregas das respostas do servidor à janela
+POLL_INTERVAL_MS = 20
+
+# Espera (ms) depois da última tecla antes de buscar, para não pedir uma busca a cada letra digitada
+SEARCH_DELAY_MS = 250
+
+# Texto das linhas cuja página ainda não chegou
+LOADING_TEXT = "Carregando..."
+
+# Resposta entregue no lugar das requisições puladas por não interessarem mais
+SKIPPED = None
+
+# Máximo de linhas guardadas da agenda completa; as mais distantes do trecho visível são descartadas
+MAX_CACHED_ROWS = 1000
+
+# Alterações recebidas guardadas para reaplicar às páginas pedidas antes delas
+RECENT_CHANGES = 10000
+
+# Acima desta quantidade de alterações numa mensagem, recarregar as linhas visíveis sai mais barato
+MAX_APPLIED_CHANGES = PAGE_SIZE
+
+# Espera (s) antes de reconectar a inscrição em alterações
+RECONNECT_DELAY = 2.0
+
+# Tempo máximo (s) de espera por uma resposta antes de repetir a requisição em outra agenda
+REQUEST_TIMEOUT = 10.0
 
 # Função para exibir uma mensagem de erro
 def show_error_message(msg):
     messagebox.showerror("Erro", msg)
 
+# Threads que enviam as requisições às agendas, para a janela não travar esperando a rede
+# As leituras são atendidas por uma thread por agenda, em paralelo; as alterações, por uma thread só, na ordem em que
+# foram feitas. A escolha da agenda e a troca de agenda numa falha ficam com o BalancedAgendaClient
+# As respostas voltam por uma fila, esvaziada na thread do Tkinter com root.after (o Tkinter só pode ser usado por ela)
+class RequestWorker:
+    def __init__(self, root, agenda):
+        self.root = root
+        self.agenda = agenda
+        self.requests = queue.Queue()
+        self.changes = queue.Queue()
+        self.responses = queue.Queue()
+        for _ in agenda.endpoints:
+            threading.Thread(target=self.run, args=(self.requests,), daemon=True).start()
+        threading.Thread(target=self.run, args=(self.changes,), daemon=True).start()
+        self.root.after(POLL_INTERVAL_MS, self.deliver)
+
+    # Agenda uma requisição: "request" recebe o cliente das agendas e retorna a resposta, entregue depois a "callback"
+    # "wanted" (opcional) é conferida antes do envio, para pular pedidos que deixaram de interessar
+    # "ordered" põe a requisição na fila das alterações, enviadas uma de cada vez
+    def submit(self, request, callback, wanted=None, ordered=False):
+        (self.changes if ordered else self.requests).put((request, callback, wanted))
+
+    def run(self, requests):
+        while True:
+            request, callback, wanted = requests.get()
+            if wanted is not None and not wanted():
+                self.post(callback, SKIPPED)
+                continue
+            try:
+                response = request(self.agenda)
+            except (OSError, EOFError, ValueError) as e:
+                response = f"Erro: Falha na comunicação com o servidor ({e})."
+            self.post(callback, response)
+
+    # Entrega um valor a "callback" na thread do Tkinter (pode ser chamada de qualquer thread)
+    def post(self, callback, value):
+        self.responses.put((callback, value))
+
+    # Entrega só o que já estava na fila, para a janela não ficar presa enquanto chegam mais respostas
+    def deliver(self):
+        for _ in range(self.responses.qsize()):
+            callback, response = self.responses.get_nowait()
+            callback(response)
+        self.root.after(POLL_INTERVAL_MS, self.deliver)
+
+# Inscrição nas alterações de uma das agendas ('subscribe'), numa conexão só para ela e numa thread própria
+# Cada mensagem é entregue a "on_message" na thread do Tkinter; None avisa que a conexão caiu
+# Ao reconectar, envia a última posição recebida: a agenda manda o que foi perdido, ou pede para recarregar ('resync');
+# se a agenda caiu, a inscrição passa para outra, que não conhece a posição e também pede para recarregar
+# A agenda manda uma mensagem vazia a cada 15 s: sem nada por STREAM_TIMEOUT segundos, a conexão é dada como perdida
+# Agendas antigas e o modo cluster recusam a inscrição: "on_unavailable" é chamada e a thread termina
+class ChangeSubscription:
+    def __init__(self, agenda, worker, on_message, on_unavailable):
+        self.agenda = agenda
+        self.worker = worker
+        self.on_message = on_message
+        self.on_unavailable = on_unavailable
+        self.address = None  # Agenda da inscrição atual
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        position = None
+        failed = ()
+        while True:
+            self.address = self.agenda.pick_address(exclude=failed)
+            try:
+                with AgendaClient(*self.address, timeout=REQUEST_TIMEOUT) as subscriber:
+                    subscriber.sock.settimeout(STREAM_TIMEOUT)
+                    for message in subscriber.subscribe(position):
+                        position = (message['epoch'], message['seq'])
+                        failed = ()
+                        self.worker.post(self.on_message, message)
+            except ValueError as e:  # Resposta de erro no lugar das mensagens
+                self.worker.post(self.on_unavailable, str(e))
+                return
+            except (OSError, EOFError):  # Inclusive o tempo limite: conexão meio aberta ou agenda travada
+                self.agenda.mark_failed(self.address)
+                failed = (self.address,)
+            self.worker.post(self.on_message, None)
+            time.sleep(RECONNECT_DELAY)
+
+# Função para reaplicar a uma página (posição da primeira linha, linhas) as alterações que chegaram depois de ela ser lida
+# Alterações antes da página mudam a posição dela, as de dentro mudam as linhas; com "tail" (a página é o fim da
+# lista), contatos novos depois dela entram no fim. Retorna também quanto o total mudou
+def replay_changes(first, rows, changes, key, tail):
+    rows = list(rows)
+    keys = [key(row[0]) for row in rows]
+    delta = 0
+    for _, action, name, phone in changes:
+        step = 1 if action == 'add' else -1 if action == 'remove' else 0
+        delta += step
+        change_key = key(name)
+        if not rows or change_key > keys[-1]:
+            if tail and action == 'add':
+                rows.append((name, phone))
+                keys.append(change_key)
+            continue
+        if change_key < keys[0]:
+            first += step
+            continue
+        i = bisect.bisect_left(keys, change_key)
+        if keys[i] == change_key:
+            if action == 'remove':
+                del rows[i]
+                del keys[i]
+            else:
+                rows[i] = (name, phone)
+        elif action == 'add':
+            rows.insert(i, (name, phone))
+            keys.insert(i, change_key)
+    return first, rows, delta
+
+# Lista virtual: o Listbox tem só as linhas visíveis, e a barra de rolagem representa a lista inteira ("total" linhas)
+# As linhas ficam num dicionário posição -> (nome, telefone); as que ainda não chegaram aparecem como "Carregando..."
+# A cada mudança do trecho visível, "on_view(primeira, última)" é chamada para pedir as páginas que faltam
+class VirtualList:
+    def __init__(self, parent, on_view, rows=VISIBLE_ROWS, width=50):
+        self.frame = tk.Frame(parent)
+        self.listbox = tk.Listbox(self.frame, height=rows, width=width, activestyle='none', exportselection=False)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.on_view = on_view
+        self.rows = rows
+        self.top = 0  # Posição da primeira linha visível
+        self.total = 0
+        self.items = {}
+        self.key = None  # Ordem das linhas: pelo nome (None) ou pela chave de busca
+        self.selected = None  # Nome do contato selecionado
+
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind("<MouseWheel>", lambda event: self.scroll_by(-1 if event.delta > 0 else 1, 'units'))
+        self.listbox.bind("<Button-4>", lambda event: self.scroll_by(-1, 'units'))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll_by(1, 'units'))
+        self.listbox.bind("<Up>", lambda event: self.scroll_by(-1, 'units'))
+        self.listbox.bind("<Down>", lambda event: self.scroll_by(1, 'units'))
+        self.listbox.bind("<Prior>", lambda event: self.scroll_by(-1, 'pages'))
+        self.listbox.bind("<Next>", lambda event: self.scroll_by(1, 'pages'))
+
+    # Esvazia a lista (nova visualização ou busca)
+    def reset(self, key=None):
+        self.items = {}
+        self.key = key
+        self.total = 0
+        self.top = 0
+        self.selected = None
+        self.render()
+
+    # Descarta as linhas guardadas, mantendo o total e a rolagem; as visíveis são pedidas de novo
+    def clear_rows(self):
+        self.items = {}
+        self.render()
+
+    # Descarta as linhas mais distantes do trecho visível quando há mais de "limit" guardadas
+    def trim(self, limit):
+        if len(self.items) > limit:
+            center = self.top + self.rows // 2
+            kept = sorted(self.items, key=lambda position: abs(position - center))[:limit]
+            self.items = {position: self.items[position] for position in kept}
+
+    def sort_key(self, name):
+        return name if self.key is None else self.key(name)
+
+    # Aplica uma alteração ('add', 'update' ou 'remove') às linhas guardadas, sem pedir nada ao servidor
+    # As linhas depois do nome andam uma posição; um contato novo que cai entre linhas ainda não recebidas só
+    # muda as posições (a página dele virá do servidor). Sem "tail_known" (mais páginas a buscar pelo cursor),
+    # alterações depois da última linha recebida ficam para as próximas páginas
+    def apply_change(self, action, name, phone, tail_known=True):
+        positions = sorted(self.items)
+        keys = [self.sort_key(self.items[position][0]) for position in positions]
+        change_key = self.sort_key(name)
+        i = bisect.bisect_left(keys, change_key)
+        found = i < len(keys) and keys[i] == change_key
+        if action == 'update' or (action == 'add' and found):
+            if found:
+                self.items[positions[i]] = (name, phone)
+            return
+        if i == len(keys) and not tail_known:
+            return
+        before = positions[i - 1] if i > 0 else -1
+        after = positions[i] if i < len(positions) else self.total
+        if action == 'remove' and found:
+            del self.items[positions[i]]
+            i += 1
+            if name == self.selected:
+                self.selected = None
+        step = 1 if action == 'add' else -1
+        moved = [(position + step, self.items.pop(position)) for position in positions[i:]]
+        self.items.update(moved)
+        self.total += step
+        if action == 'add' and after == before + 1:
+            self.items[before + 1] = (name, phone)
+
+    # Guarda as linhas de uma página que começa na posição "first" e atualiza o total, se informado
+    def set_rows(self, first, contacts, total=None):
+        for position, contact in enumerate(contacts, first):
+            self.items[position] = contact
+        if total is not None:
+            self.total = total
+        self.render()
+
+    def has_row(self, position):
+        return position in self.items
+
+    # Nome do contato selecionado, ou None
+    def selected_name(self):
+        return self.selected
+
+    # Comando da barra de rolagem: ('moveto', fração) ou ('scroll', quantidade, 'units'/'pages')
+    def on_scroll(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            self.scroll_by(int(args[1]), args[2])
+
+    def scroll_by(self, amount, what):
+        self.scroll_to(self.top + amount * (self.rows if what == 'pages' else 1))
+        return "break"  # O Listbox não rola sozinho: ele só tem as linhas visíveis
+
+    def scroll_to(self, top):
+        top = max(0, min(top, self.total - self.rows))
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def on_select(self, event):
+        selection = self.listbox.curselection()
+        contact = self.items.get(self.top + selection[0]) if selection else None
+        if contact:
+            self.selected = contact[0]
+
+    # Redesenha só as linhas visíveis e pede as que faltam
+    def render(self):
+        last = min(self.top + self.rows, self.total)
+        lines = []
+        for position in range(self.top, last):
+            contact = self.items.get(position)
+            lines.append(f"{contact[0]}: {contact[1]}" if contact else LOADING_TEXT)
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *lines)
+        for row, position in enumerate(range(self.top, last)):
+            contact = self.items.get(position)
+            if contact and contact[0] == self.selected:
+                self.listbox.selection_set(row)
+        if self.total > self.rows:
+            self.scrollbar.set(self.top / self.total, last / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+        self.on_view(self.top, self.top + self.rows)
+
 class ContactApp:
-    def __init__(self, root, server_socket):
+    def __init__(self, root, agenda):
         self.root = root
-        self.server_socket = server_socket
+        self.agenda = agenda
         self.root.title("Agenda de Contatos")
 
-        self.contacts_list = tk.Listbox(self.root, height=10, width=50)
-        self.contacts_list.grid(row=0, column=0, columnspan=3)
+        # As requisições saem da thread do Tkinter; a janela continua respondendo com um servidor lento
+        self.worker = RequestWorker(self.root, agenda)
+
+        self.contacts_list = VirtualList(self.root, self.rows_needed)
+        self.contacts_list.frame.grid(row=0, column=0, columnspan=3)
 
         self.view_button = tk.Button(self.root, text="Visualizar Contatos", command=self.view_contacts)
         self.view_button.grid(row=1, column=0)
@@ -82,13 +357,210 @@ class ContactApp:
         self.update_button = tk.Button(self.root, text="Atualizar Contato", command=self.update_contact)
         self.update_button.grid(row=4, column=0, columnspan=2)
 
+        self.status_label = tk.Label(self.root, text="")
+        self.status_label.grid(row=4, column=2)
+
+        self.search_label = tk.Label(self.root, text="Buscar")
+        self.search_label.grid(row=5, column=0)
+
+        self.search_entry = tk.Entry(self.root)
+        self.search_entry.grid(row=5, column=1)
+        self.search_entry.bind("<KeyRelease>", lambda event: self.schedule_search())
+        self.search_timer = None
+
+        # Cada visualização ou busca tem um número; respostas de uma anterior são descartadas
+        self.generation = 0
+        self.query = ''
+        # Na agenda completa, as páginas são pedidas pela posição (qualquer ponto da lista, direto)
+        # Nas buscas, no cluster e com agendas antigas, em sequência pelo cursor, à medida que a rolagem chega ao fim
+        self.by_offset = True
+        self.next_cursor = None
+        self.pending = set()  # Posições das páginas pedidas e ainda não recebidas
+
+        # Cópia local da lista mantida pelas alterações enviadas pela agenda ('subscribe'): uma edição de qualquer
+        # cliente chega como uma alteração só, sem baixar a lista de novo
+        self.subscribed = False
+        self.feed_position = None  # (época, sequência) da última mensagem da inscrição
+        self.recent_changes = collections.deque(maxlen=RECENT_CHANGES)
+        self.early_pages = []  # Páginas lidas depois de alterações que ainda não chegaram pela inscrição
+        self.subscription = ChangeSubscription(agenda, self.worker, self.changes_received, self.subscription_unavailable)
+
+    def schedule_search(self):
+        if self.search_timer is not None:
+            self.root.after_cancel(self.search_timer)
+        self.search_timer = self.root.after(SEARCH_DELAY_MS, self.view_contacts)
+
     def view_contacts(self):
-        response = send_request(self.server_socket, 'view')
-        self.contacts_list.delete(0, tk.END)  # Limpa a lista atual
+        self.search_timer = None
+        self.generation += 1
+        self.query = self.search_entry.get()
+        self.by_offset = not self.query
+        self.next_cursor = None
+        self.pending = set()
+        self.early_pages = []
+        self.status_label.config(text=LOADING_TEXT)
+        self.contacts_list.reset(None if self.by_offset else search_key)
+        self.load_page(0)
 
-        if isinstance(response, dict):
-            for name, phone in response.items():
-                self.contacts_list.insert(tk.END, f"{name}: {phone}")
+    # Recarrega as linhas visíveis mantendo a rolagem (agenda substituída, muitas alterações de uma vez)
+    def refresh_contacts(self):
+        if not self.generation:
+            return
+        if not self.by_offset:
+            self.view_contacts()  # Pelo cursor, só recomeçando do início
+            return
+        self.generation += 1
+        self.pending = set()
+        self.early_pages = []
+        self.contacts_list.clear_rows()
+
+    # Se o contato aparece na lista atual (a agenda completa ou os resultados da busca por prefixo)
+    def matches(self, name):
+        return not self.query or search_key(name)[0].startswith(self.query.casefold())
+
+    # Se a lista já recebeu todas as linhas que vêm depois da última guardada
+    def tail_known(self):
+        return self.by_offset or (self.next_cursor is None and not self.pending)
+
+    def changes_received(self, message):
+        if message is None:
+            # Conexão perdida: até a reinscrição, as edições voltam a recarregar a lista
+            self.subscribed = False
+            self.release_early_pages()
+            return
+        self.subscribed = True
+        previous = self.feed_position
+        self.feed_position = (message['epoch'], message['seq'])
+        if message['resync'] or (previous is not None and previous[0] != message['epoch']):
+            # Alterações perdidas que a agenda não tem mais: a cópia local não vale mais
+            self.recent_changes.clear()
+            self.refresh_contacts()
+            return
+        self.recent_changes.extend(message['changes'])
+        changes = [change for change in message['changes'] if self.matches(change[2])]
+        if self.generation and changes:
+            if len(changes) > MAX_APPLIED_CHANGES:
+                self.refresh_contacts()
+            else:
+                tail_known = self.tail_known()
+                for _, action, name, phone in changes:
+                    self.contacts_list.apply_change(action, name, phone, tail_known)
+                self.contacts_list.render()
+                self.show_total()
+        self.release_early_pages()
+
+    def subscription_unavailable(self, error):
+        print(f"Sem atualizações automáticas: {error}")
+
+    # Alterações já aplicadas à lista e posteriores à posição em que a página foi lida, ou None se elas não
+    # estão mais guardadas
+    def changes_after(self, position):
+        if not self.subscribed or position is None or self.feed_position is None or position[0] != self.feed_position[0]:
+            return []
+        seq = position[1]
+        if seq >= self.feed_position[1]:
+            return []
+        if not self.recent_changes or self.recent_changes[0][0] > seq + 1:
+            return None
+        return [change for change in self.recent_changes if change[0] > seq and self.matches(change[2])]
+
+    # Se a página foi lida depois de alterações que ainda não chegaram pela inscrição
+    def page_is_ahead(self, position):
+        return (self.subscribed and position is not None and self.feed_position is not None
+                and position[0] == self.feed_position[0] and position[1] > self.feed_position[1])
+
+    def release_early_pages(self):
+        pages, self.early_pages = self.early_pages, []
+        for page in pages:
+            self.page_loaded(*page)
+
+    def show_total(self):
+        more = "+" if not self.by_offset and self.next_cursor is not None else ""
+        self.status_label.config(text=f"{self.contacts_list.total}{more} contato(s)")
+
+    # Chamada pela lista a cada rolagem: pede as páginas do trecho visível (e a seguinte) que ainda não chegaram
+    def rows_needed(self, first, last):
+        if not self.generation:
+            return
+        if self.by_offset:
+            for position in range(first - first % PAGE_SIZE, last + PAGE_SIZE, PAGE_SIZE):
+                if position < self.contacts_list.total and not self.contacts_list.has_row(position):
+                    self.load_page(position)
+        elif self.next_cursor is not None and last + PAGE_SIZE >= self.contacts_list.total:
+            self.load_page(self.contacts_list.total)
+
+    # Pede ao servidor a página que começa na posição "position" da lista
+    def load_page(self, position):
+        if position in self.pending:
+            return
+        self.pending.add(position)
+        generation = self.generation
+        if self.by_offset:
+            action, query, options = 'view_page', None, {'offset': position, 'limit': PAGE_SIZE}
+        else:
+            options = {'cursor': self.next_cursor, 'limit': PAGE_SIZE}
+            action, query = ('search', self.query) if self.query else ('view_page', None)
+
+        # Com a inscrição ativa, as páginas vêm da agenda dela: as posições das páginas e das alterações recebidas
+        # só se comparam dentro de uma mesma agenda. Sem ela, cada página vai para a agenda menos ocupada
+        prefer = self.subscription.address if self.subscribed else None
+
+        # Páginas que saíram da tela enquanto esperavam a vez não são mais pedidas
+        def wanted():
+            top = self.contacts_list.top
+            return generation == self.generation and top - PAGE_SIZE <= position < top + self.contacts_list.rows + PAGE_SIZE
+
+        self.worker.submit(lambda agenda: agenda.request(action, query, options=options, prefer=prefer),
+                           lambda response: self.page_loaded(generation, position, response),
+                           wanted if self.by_offset and position else None)
+
+    def page_loaded(self, generation, position, response):
+        if generation != self.generation:
+            return
+        if isinstance(response, dict) and self.page_is_ahead(response.get('position')):
+            # Aplicada agora, a página receberia de novo essas alterações quando elas chegassem
+            self.early_pages.append((generation, position, response))
+            return
+        self.pending.discard(position)
+        if response is SKIPPED:
+            # A página pode ter voltado à tela depois de pulada
+            self.rows_needed(self.contacts_list.top, self.contacts_list.top + self.contacts_list.rows)
+            return
+        if not isinstance(response, dict):
+            self.status_label.config(text="")
+            show_error_message(response)
+            return
+        if self.by_offset and 'offset' not in response:
+            # A agenda não conhece a paginação por posição: a resposta é a primeira página por cursor
+            self.by_offset = False
+            self.contacts_list.reset()
+        changes = self.changes_after(response.get('position'))
+        if changes is None:
+            self.refresh_contacts()
+            return
+        if self.by_offset:
+            tail = position + len(response['contacts']) >= response['total']
+            first, contacts, delta = replay_changes(position, response['contacts'], changes, self.contacts_list.sort_key, tail)
+            self.contacts_list.set_rows(first, contacts, response['total'] + delta)
+            self.contacts_list.trim(MAX_CACHED_ROWS)
+        else:
+            # As linhas são contíguas desde o início; a página entra depois da última, onde quer que ela esteja agora
+            position = self.contacts_list.total
+            self.next_cursor = response['next_cursor']
+            _, contacts, _ = replay_changes(position, response['contacts'], changes, self.contacts_list.sort_key, self.next_cursor is None)
+            self.contacts_list.set_rows(position, contacts, position + len(contacts))
+        self.show_total()
+
+    # Envia uma alteração e, se der certo, atualiza a lista
+    # A alteração leva um token de idempotência: repetida em outra agenda depois de uma falha, não é aplicada duas vezes
+    def send_change(self, action, name, phone=None):
+        self.worker.submit(lambda agenda: agenda.request(action, name, phone), self.change_done, ordered=True)
+
+    # Com a inscrição ativa, a própria alteração chega pela inscrição e atualiza a lista
+    def change_done(self, response):
+        if "sucesso" in response:
+            if not self.subscribed:
+                self.view_contacts()  # Atualiza a lista de contatos
         else:
             show_error_message(response)
 
@@ -100,23 +572,12 @@ class ContactApp:
             show_error_message("Nome e Telefone são obrigatórios!")
             return
 
-        response = send_request(self.server_socket, 'add', name, phone)
-        if "sucesso" in response:
-            self.view_contacts()  # Atualiza a lista de contatos
-        else:
-            show_error_message(response)
+        self.send_change('add', name, phone)
 
     def remove_contact(self):
-        selected = self.contacts_list.curselection()
-        if selected:
-            contact = self.contacts_list.get(selected[0])
-            name = contact.split(":")[0]
-
-            response = send_request(self.server_socket, 'remove', name)
-            if "sucesso" in response:
-                self.view_contacts()  # Atualiza a lista de contatos
-            else:
-                show_error_message(response)
+        name = self.contacts_list.selected_name()
+        if name:
+            self.send_change('remove', name)
         else:
             show_error_message("Selecione um contato para remover.")
 
@@ -128,32 +589,52 @@ class ContactApp:
             show_error_message("Nome e Telefone são obrigatórios!")
             return
 
-        response = send_request(self.server_socket, 'update', name, phone)
-        if "sucesso" in response:
-            self.view_contacts()  # Atualiza a lista de contatos
-        else:
-            show_error_message(response)
+        self.send_change('update', name, phone)
+
+# Função para ler a lista de agendas "IP:PORTA,IP:PORTA,..." (ValueError se algum item for inválido)
+def parse_servers(text):
+    addresses = []
+    for item in text.split(','):
+        host, _, port = item.strip().rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"Agenda inválida: {item.strip()!r} (use IP:PORTA).")
+        addresses.append((host, int(port)))
+    return addresses
 
 def main():
+    parser = argparse.ArgumentParser(description="Cliente gráfico da agenda de contatos")
+    parser.add_argument('--servers', help="Agendas para distribuir as requisições: IP:PORTA,IP:PORTA,...")
+    args = parser.parse_args()
+
     root = tk.Tk()
 
-    # Solicitar o IP e a porta do servidor
-    host = simpledialog.askstring("Conexão", "Digite o IP do servidor:")
-    port = simpledialog.askinteger("Conexão", "Digite a porta do servidor:")
+    # Solicitar as agendas: um IP (a porta é pedida em seguida) ou vários IP:PORTA separados por vírgula
+    text = args.servers or simpledialog.askstring("Conexão", "Digite o IP do servidor (ou IP:PORTA,IP:PORTA,... para várias agendas):")
+    if text and ':' not in text:
+        port = simpledialog.askinteger("Conexão", "Digite a porta do servidor:")
+        text = f"{text}:{port}" if port else None
 
-    if not host or not port:
+    try:
+        addresses = parse_servers(text) if text else None
+    except ValueError as e:
+        show_error_message(str(e))
+        addresses = None
+    if not addresses:
         show_error_message("IP ou porta inválidos. Encerrando o programa.")
         root.quit()
         return
 
-    # Tenta conectar ao servidor fornecido pelo usuário
-    server_socket = connect_to_server(host, port)
-    if not server_socket:
+    # Confere se alguma das agendas informadas responde
+    agenda = BalancedAgendaClient(addresses, timeout=REQUEST_TIMEOUT)
+    try:
+        agenda.request('hello')
+    except ConnectionError:
         show_error_message("Servidor offline ou não disponível.")
         root.quit()
         return
+    print(f"Conectado a {len(addresses)} agenda(s): {', '.join(f'{host}:{port}' for host, port in addresses)}")
 
-    app = ContactApp(root, server_socket)
+    app = ContactApp(root, agenda)
     root.mainloop()
 
 if __name__ == "__main__":
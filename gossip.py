@@ -0,0 +1,119 @@
+import collections
+import math
+import random
+import threading
+import time
+
+# Quantidade de ids de operações já vistas guardadas para descartar repetições
+SEEN_LIMIT = 1000000
+
+# Máximo de operações enviadas numa mensagem de fofoca (o restante vai nas rodadas seguintes)
+MAX_GOSSIP_BATCH = 5000
+
+# A cada quantas rodadas sem operações a lista de membros é trocada com uma agenda aleatória
+MEMBERSHIP_ROUNDS = 20
+
+
+# Função para calcular quantas rodadas uma operação é repassada, conforme o tamanho do cluster
+# Com "fanout" agendas por rodada, log_fanout(N) rodadas alcançam todas; as 2 extras cobrem perdas
+def default_rounds(members, fanout):
+    return max(3, math.ceil(math.log(members + 1) / math.log(max(fanout, 2))) + 2)
+
+
+# Disseminação epidêmica (fofoca): cada operação é repassada em rodadas para algumas agendas aleatórias,
+# que a repassam de novo enquanto houver rodadas, então o custo na agenda de origem não cresce com o cluster
+class GossipDisseminator:
+    def __init__(self, pool, origin, seeds, apply, fanout=3, interval=0.05, rounds=0):
+        self.pool = pool
+        self.origin = origin
+        self.apply = apply  # Função que aplica as operações recebidas, na ordem
+        self.fanout = fanout
+        self.interval = interval
+        self.rounds = rounds  # 0: calculado pelo tamanho do cluster
+        self.members = set(seeds) | {origin}
+        self.buffer = collections.OrderedDict()  # id da operação -> [operação, rodadas restantes]
+        self.seen = collections.OrderedDict()  # ids das operações já aplicadas (os mais antigos saem primeiro)
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _rounds(self):
+        return self.rounds or default_rounds(len(self.members), self.fanout)
+
+    def _mark_seen(self, operation_id):
+        if operation_id in self.seen:
+            return False
+        self.seen[operation_id] = None
+        if len(self.seen) > SEEN_LIMIT:
+            self.seen.popitem(last=False)
+        return True
+
+    # Até "count" outras agendas aleatórias, evitando as marcadas como indisponíveis
+    def sample(self, count):
+        with self.lock:
+            others = [member for member in self.members if member != self.origin]
+        available = [member for member in others if self.pool.get(member).available()]
+        candidates = available or others
+        return random.sample(candidates, min(count, len(candidates)))
+
+    def member_list(self):
+        with self.lock:
+            return sorted(self.members)
+
+    # Inclui os membros conhecidos por outra agenda
+    def merge_members(self, members):
+        with self.lock:
+            new = set(members) - self.members
+            self.members |= new
+        for member in new:
+            print(f"Agenda {member} descoberta pela fofoca.")
+
+    # Publica operações desta agenda: (id da operação, operação)
+    def publish(self, entries):
+        with self.lock:
+            rounds = self._rounds()
+            for operation_id, operation in entries:
+                self._mark_seen(operation_id)
+                self.buffer[operation_id] = [operation, rounds]
+
+    # Recebe uma mensagem de fofoca: aplica as operações ainda não vistas e as guarda para repassar
+    # Retorna a lista de membros conhecidos por esta agenda (a outra agenda aprende com ela)
+    def receive(self, entries, members):
+        fresh = []
+        with self.lock:
+            for operation_id, rounds, operation in entries:
+                if self._mark_seen(operation_id):
+                    fresh.append(operation)
+                    if rounds > 1:
+                        self.buffer[operation_id] = [operation, rounds - 1]
+        if fresh:
+            self.apply(fresh)
+        self.merge_members(members)
+        return self.member_list()
+
+    # Separa as operações da próxima rodada, descontando uma rodada de cada
+    def _take_round(self):
+        with self.lock:
+            entries = []
+            for operation_id, state in list(self.buffer.items())[:MAX_GOSSIP_BATCH]:
+                operation, rounds = state
+                entries.append((operation_id, rounds, operation))
+                state[1] -= 1
+                if state[1] == 0:
+                    del self.buffer[operation_id]
+            return entries
+
+    def _run(self):
+        idle_rounds = 0
+        while True:
+            time.sleep(self.interval)
+            entries = self._take_round()
+            if not entries:
+                idle_rounds += 1
+                if idle_rounds < MEMBERSHIP_ROUNDS:
+                    continue
+            idle_rounds = 0
+            for member in self.sample(self.fanout if entries else 1):
+                try:
+                    self.merge_members(self.pool.get(member).request(('gossip', entries, self.member_list())))
+                except OSError:
+                    print(f"Servidor {member} está offline. Não foi possível repassar a fofoca.")
@@ -0,0 +1,121 @@
+import collections
+import itertools
+import os
+import threading
+
+from storage import read_records, write_record, fsync_directory
+
+
+# Função para montar o nome do arquivo de operações pendentes de uma agenda
+def hint_path(directory, address):
+    host, port = address
+    return os.path.join(directory, f"hints-{host}_{port}.log")
+
+
+# Operações que uma agenda indisponível deixou de receber ("hinted handoff"), entregues em lote quando ela voltar
+# Só a operação mais recente de cada nome é mantida; com "path", as operações ficam também num arquivo, que
+# sobrevive a reinícios desta agenda: registros ('hint', id, operação) e ('done', [(nome, id)]) das já entregues
+# Os tokens de idempotência das escritas guardadas acompanham o nome ('token', nome, token, resposta), para serem
+# entregues junto com a operação
+class HintStore:
+    def __init__(self, path=None):
+        self.path = path
+        self.hints = collections.OrderedDict()  # nome -> (id, operação)
+        self.tokens = {}  # nome -> [(token, resposta)]
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.file = None
+        if path is not None:
+            self._load()
+
+    def __len__(self):
+        return len(self.hints)
+
+    # Lê o arquivo e o regrava só com as operações ainda não entregues
+    def _load(self):
+        if os.path.exists(self.path):
+            for record in read_records(self.path):
+                if record[0] == 'hint':
+                    _, hint_id, operation = record
+                    self.hints.pop(operation[1], None)
+                    self.hints[operation[1]] = (hint_id, operation)
+                elif record[0] == 'token':
+                    _, name, token, response = record
+                    self.tokens.setdefault(name, []).append((token, response))
+                else:
+                    for name, hint_id in record[1]:
+                        if self.hints.get(name, (None,))[0] == hint_id:
+                            del self.hints[name]
+                            self.tokens.pop(name, None)
+        self.tokens = {name: tokens for name, tokens in self.tokens.items() if name in self.hints}
+        self.ids = itertools.count(max((hint_id for hint_id, _ in self.hints.values()), default=0) + 1)
+        self._rewrite()
+
+    def _rewrite(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for hint_id, operation in self.hints.values():
+                write_record(f, ('hint', hint_id, operation))
+            for name, tokens in self.tokens.items():
+                for token, response in tokens:
+                    write_record(f, ('token', name, token, response))
+            f.flush()
+            os.fsync(f.fileno())
+        if self.file is not None:
+            self.file.close()
+        os.replace(tmp_path, self.path)
+        fsync_directory(os.path.dirname(self.path))
+        self.file = open(self.path, 'ab')
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # Guarda operações (ação, nome, telefone, versão) não entregues e os tokens (nome, token, resposta) delas
+    # Os tokens de uma operação substituída por outra mais nova do mesmo nome continuam valendo e ficam com ela
+    def add(self, operations, tokens=()):
+        if not operations:
+            return
+        with self.lock:
+            for operation in operations:
+                hint_id = next(self.ids)
+                self.hints.pop(operation[1], None)
+                self.hints[operation[1]] = (hint_id, operation)
+                if self.file is not None:
+                    write_record(self.file, ('hint', hint_id, operation))
+            for name, token, response in tokens:
+                self.tokens.setdefault(name, []).append((token, response))
+                if self.file is not None:
+                    write_record(self.file, ('token', name, token, response))
+            if self.file is not None:
+                self._sync()
+
+    # Até "limit" operações pendentes, das mais antigas para as mais novas, com os seus ids
+    def peek(self, limit):
+        with self.lock:
+            return list(itertools.islice(self.hints.items(), limit))
+
+    # Marca como entregues as operações devolvidas por "peek" (as que não foram substituídas por outras mais novas)
+    # e retorna os tokens (token, resposta) delas, a entregar depois das operações
+    def discard(self, entries):
+        with self.lock:
+            done = [(name, hint_id) for name, (hint_id, _) in entries if self.hints.get(name, (None,))[0] == hint_id]
+            tokens = []
+            for name, _ in done:
+                del self.hints[name]
+                tokens.extend(self.tokens.pop(name, ()))
+            if self.file is not None:
+                if self.hints:
+                    write_record(self.file, ('done', done))
+                    self._sync()
+                else:
+                    self._rewrite()  # Tudo entregue: o arquivo volta a ficar vazio
+            return tokens
+
+    # Descarta todas as operações guardadas
+    def clear(self):
+        with self.lock:
+            self.hints.clear()
+            self.tokens.clear()
+            if self.file is not None:
+                self._rewrite()
@@ -0,0 +1,38 @@
+import threading
+import time
+
+# Versão dos registros gravados antes de existir versionamento: perde para qualquer escrita nova
+ZERO_VERSION = (0, 0, '')
+
+
+# Relógio lógico híbrido: versões (milissegundos, contador, agenda) que acompanham o relógio do sistema,
+# mas nunca voltam atrás e sempre superam as versões já vistas de outras agendas
+# Comparar duas versões dá a mesma resposta em todas as agendas, o que decide as escritas concorrentes
+class HybridLogicalClock:
+    def __init__(self, node=''):
+        self.node = node
+        self.wall = 0
+        self.logical = 0
+        self.lock = threading.Lock()
+
+    # Nova versão para uma escrita desta agenda
+    def now(self):
+        physical = time.time_ns() // 1000000
+        with self.lock:
+            if physical > self.wall:
+                self.wall, self.logical = physical, 0
+            else:
+                self.logical += 1
+            return self.wall, self.logical, self.node
+
+    # Versão mais recente gerada ou vista até agora (milissegundos, contador), sem avançar o relógio
+    def last(self):
+        with self.lock:
+            return self.wall, self.logical
+
+    # Registra uma versão recebida de outra agenda, para que as próximas versões locais sejam maiores
+    def observe(self, version):
+        wall, logical, _ = version
+        with self.lock:
+            if (wall, logical) > (self.wall, self.logical):
+                self.wall, self.logical = wall, logical
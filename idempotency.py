@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+
+# Quantidade máxima de tokens guardados e por quanto tempo (s) cada um vale
+MAX_TOKENS = 100000
+TOKEN_TTL = 600.0
+
+
+# Respostas das escritas com token de idempotência: um cliente que repete a escrita (em outra conexão ou em outra
+# agenda, depois de uma falha) recebe a resposta guardada, sem que a escrita seja aplicada de novo
+# As agendas que recebem a escrita pela replicação também guardam o token (ver "put_many")
+class TokenStore:
+    def __init__(self, max_tokens=MAX_TOKENS, ttl=TOKEN_TTL):
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self.responses = collections.OrderedDict()  # token -> (validade, resposta), do mais antigo ao mais novo
+        self.running = {}  # token -> Event das escritas em andamento
+        self.lock = threading.Lock()
+
+    def _store(self, token, response, now):
+        self.responses[token] = (now + self.ttl, response)
+        self.responses.move_to_end(token)
+        while self.responses:
+            oldest, (expires, _) = next(iter(self.responses.items()))
+            if len(self.responses) <= self.max_tokens and expires > now:
+                break
+            del self.responses[oldest]
+
+    def _lookup(self, token, now):
+        entry = self.responses.get(token)
+        if entry is not None and entry[0] > now:
+            return entry
+        return None
+
+    # Executa "process" uma só vez por token e retorna a resposta; uma repetição com a escrita ainda em andamento
+    # espera por ela
+    def run_once(self, token, process):
+        while True:
+            with self.lock:
+                entry = self._lookup(token, time.monotonic())
+                if entry is not None:
+                    return entry[1]
+                event = self.running.get(token)
+                if event is None:
+                    event = self.running[token] = threading.Event()
+                    break
+            event.wait()
+        try:
+            response = process()
+            with self.lock:
+                self._store(token, response, time.monotonic())
+            return response
+        finally:
+            with self.lock:
+                del self.running[token]
+            event.set()
+
+    # Guarda os tokens (token, resposta) de escritas recebidas de outra agenda
+    def put_many(self, entries):
+        now = time.monotonic()
+        with self.lock:
+            for token, response in entries:
+                self._store(token, response, now)
+
+    def __len__(self):
+        return len(self.responses)
@@ -0,0 +1,130 @@
+import argparse
+import csv
+import itertools
+import json
+import socket
+import sys
+
+from protocol import send_message, recv_message
+
+# Nomes de coluna aceitos para o nome e o telefone
+NAME_FIELDS = ('name', 'nome')
+PHONE_FIELDS = ('phone', 'telefone')
+
+
+# Função para obter o primeiro campo presente num registro
+def first_field(record, fields):
+    for field in fields:
+        if field in record:
+            return record[field]
+    return None
+
+
+# Função para ler um CSV linha a linha, com ou sem cabeçalho (nome, telefone)
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        columns = [column.strip().lower() for column in first]
+        if any(column in NAME_FIELDS for column in columns):
+            name_column = next(i for i, column in enumerate(columns) if column in NAME_FIELDS)
+            phone_column = next((i for i, column in enumerate(columns) if column in PHONE_FIELDS), 1)
+        else:
+            name_column, phone_column = 0, 1
+            yield reader.line_num, first, name_column, phone_column
+        for row in reader:
+            yield reader.line_num, row, name_column, phone_column
+
+
+# Função para transformar as linhas do arquivo em registros (linha, nome, telefone), sem carregar o arquivo inteiro
+def read_records(path, file_format):
+    if file_format == 'csv':
+        for line, row, name_column, phone_column in read_csv(path):
+            if not row:
+                continue
+            if len(row) <= max(name_column, phone_column):
+                yield line, None, None
+            else:
+                yield line, row[name_column].strip(), row[phone_column].strip()
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line, text in enumerate(f, 1):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                except ValueError:
+                    yield line, None, None
+                    continue
+                if not isinstance(record, dict):
+                    yield line, None, None
+                    continue
+                phone = first_field(record, PHONE_FIELDS)
+                yield line, first_field(record, NAME_FIELDS), None if phone is None else str(phone)
+
+
+# Função para exibir os erros de um lote, indicando a linha do arquivo
+def report_errors(lines, response):
+    if not isinstance(response, dict):
+        print(f"Erro no lote: {response}")
+        return len(lines)
+    for index, name, message in response['errors']:
+        print(f"Linha {lines[index]} ({name}): {message}")
+    if 'replication_error' in response:
+        print(response['replication_error'])
+    return len(response['errors'])
+
+
+# Função para importar o arquivo em lotes, mantendo alguns lotes em andamento na mesma conexão
+def import_file(sock, path, file_format, action, chunk_size, window):
+    applied = failed = 0
+    in_flight = {}  # id da requisição -> linhas do lote
+    request_ids = itertools.count(1)
+
+    def collect():
+        nonlocal applied, failed
+        message = recv_message(sock)
+        if message is None:
+            raise ConnectionResetError("Servidor encerrou a conexão.")
+        request_id, response = message
+        lines = in_flight.pop(request_id)
+        failed += report_errors(lines, response)
+        if isinstance(response, dict):
+            applied += response['applied']
+
+    records = read_records(path, file_format)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        request_id = next(request_ids)
+        in_flight[request_id] = [line for line, _, _ in chunk]
+        send_message(sock, (action, [(name, phone) for _, name, phone in chunk], None), request_id)
+        while len(in_flight) >= window:
+            collect()
+    while in_flight:
+        collect()
+    return applied, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa contatos de um arquivo CSV ou JSONL para a agenda")
+    parser.add_argument('file', help='Arquivo CSV (nome,telefone) ou JSONL ({"name": ..., "phone": ...})')
+    parser.add_argument('--host', type=str, required=True, help='IP da agenda')
+    parser.add_argument('--port', type=int, required=True, help='Porta da agenda para clientes')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='Formato do arquivo (padrão: pela extensão)')
+    parser.add_argument('--upsert', action='store_true', help='Atualiza contatos existentes em vez de informar erro')
+    parser.add_argument('--chunk_size', type=int, default=5000, help='Contatos por lote')
+    parser.add_argument('--window', type=int, default=4, help='Lotes enviados antes de esperar as respostas')
+
+    args = parser.parse_args()
+    file_format = args.format or ('csv' if args.file.lower().endswith('.csv') else 'jsonl')
+    action = 'upsert_many' if args.upsert else 'add_many'
+
+    with socket.create_connection((args.host, args.port)) as sock:
+        applied, failed = import_file(sock, args.file, file_format, action, args.chunk_size, args.window)
+
+    print(f"Importação concluída: {applied} contatos gravados, {failed} com erro.")
+    sys.exit(1 if failed else 0)
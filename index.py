@@ -0,0 +1,240 @@
+import bisect
+import re
+import threading
+
+# Tudo o que não é dígito num telefone
+NON_DIGITS = re.compile(r'\D')
+
+
+# Lista ordenada dividida em blocos: inserções e remoções movem só um bloco, e não a lista inteira
+class SortedKeys:
+    BLOCK_SIZE = 1000
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.blocks = [keys[i:i + self.BLOCK_SIZE] for i in range(0, len(keys), self.BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.length = len(keys)
+
+    def __len__(self):
+        return self.length
+
+    # Insere a chave, retornando False se ela já existia
+    def add(self, key):
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            self.length = 1
+            return True
+        i = min(bisect.bisect_left(self.maxes, key), len(self.maxes) - 1)
+        block = self.blocks[i]
+        j = bisect.bisect_left(block, key)
+        if j < len(block) and block[j] == key:
+            return False
+        block.insert(j, key)
+        self.maxes[i] = block[-1]
+        self.length += 1
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self.blocks[i:i + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [self.blocks[i][-1], self.blocks[i + 1][-1]]
+        return True
+
+    # Remove a chave, retornando False se ela não existia
+    def remove(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            return False
+        block = self.blocks[i]
+        j = bisect.bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return False
+        del block[j]
+        self.length -= 1
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+        return True
+
+    # Até "limit" chaves a partir de "key" (inclusive, ou só as maiores com after=True)
+    def range_from(self, key=None, limit=100, after=False):
+        if key is None:
+            i, j = 0, 0
+        elif after:
+            i = bisect.bisect_right(self.maxes, key)
+            j = bisect.bisect_right(self.blocks[i], key) if i < len(self.blocks) else 0
+        else:
+            i = bisect.bisect_left(self.maxes, key)
+            j = bisect.bisect_left(self.blocks[i], key) if i < len(self.blocks) else 0
+        result = []
+        while i < len(self.blocks) and len(result) < limit:
+            result.extend(self.blocks[i][j:j + limit - len(result)])
+            i, j = i + 1, 0
+        return result
+
+    # Até "limit" chaves a partir da posição "start" na ordem (0 é a primeira); pula blocos inteiros pelo tamanho
+    def range_at(self, start, limit=100):
+        i = 0
+        while i < len(self.blocks) and start >= len(self.blocks[i]):
+            start -= len(self.blocks[i])
+            i += 1
+        result = []
+        j = start
+        while i < len(self.blocks) and len(result) < limit:
+            result.extend(self.blocks[i][j:j + limit - len(result)])
+            i, j = i + 1, 0
+        return result
+
+
+# Nomes da agenda mantidos em ordem, para paginação por cursor
+class NameIndex:
+    def __init__(self):
+        self.names = SortedKeys()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        with self.lock:
+            self.names.add(name)
+
+    def remove(self, name):
+        with self.lock:
+            self.names.remove(name)
+
+    # Reconstrói o índice a partir de todos os nomes da agenda
+    def rebuild(self, names):
+        names = SortedKeys(names)
+        with self.lock:
+            self.names = names
+
+    # Até "limit" nomes estritamente posteriores ao cursor (ou desde o início, sem cursor)
+    def page(self, cursor=None, limit=100):
+        with self.lock:
+            return self.names.range_from(cursor, limit, after=True)
+
+    # Até "limit" nomes a partir da posição "offset" na ordem alfabética, para ir direto a qualquer ponto da lista
+    def page_at(self, offset=0, limit=100):
+        with self.lock:
+            return self.names.range_at(offset, limit)
+
+
+# Função para normalizar um nome para as buscas (sem diferenciar maiúsculas e minúsculas)
+def search_key(name):
+    return name.casefold(), name
+
+
+# Função para extrair os trigramas (trechos de 3 caracteres) de um texto
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# Índice de busca por prefixo (lista ordenada) e, opcionalmente, por trecho do nome (trigramas)
+class SearchIndex:
+    def __init__(self, substring=False):
+        self.keys = SortedKeys()  # (nome normalizado, nome), em ordem
+        self.grams = {} if substring else None  # trigrama -> nomes que o contêm
+        self.lock = threading.Lock()
+
+    def add(self, name):
+        key = search_key(name)
+        with self.lock:
+            if not self.keys.add(key):
+                return
+            if self.grams is not None:
+                for gram in trigrams(key[0]):
+                    self.grams.setdefault(gram, set()).add(name)
+
+    def remove(self, name):
+        key = search_key(name)
+        with self.lock:
+            if not self.keys.remove(key):
+                return
+            if self.grams is not None:
+                for gram in trigrams(key[0]):
+                    names = self.grams.get(gram)
+                    if names is not None:
+                        names.discard(name)
+                        if not names:
+                            del self.grams[gram]
+
+    def rebuild(self, names):
+        keys = SortedKeys(search_key(name) for name in names)
+        grams = None
+        if self.grams is not None:
+            grams = {}
+            for folded, name in map(search_key, names):
+                for gram in trigrams(folded):
+                    grams.setdefault(gram, set()).add(name)
+        with self.lock:
+            self.keys = keys
+            if grams is not None:
+                self.grams = grams
+
+    # Nomes que começam com o prefixo, posteriores ao cursor (último nome já recebido)
+    def prefix(self, prefix, cursor=None, limit=100):
+        folded = prefix.casefold()
+        start = (folded,)
+        if cursor is not None and search_key(cursor) >= start:
+            start = search_key(cursor)
+        with self.lock:
+            keys = self.keys.range_from(start, limit, after=start != (folded,))
+        names = []
+        for key in keys:
+            if not key[0].startswith(folded):
+                break
+            names.append(key[1])
+        return names
+
+    # Nomes que contêm o trecho, posteriores ao cursor; trechos com menos de 3 letras usam a busca por prefixo
+    def substring(self, text, cursor=None, limit=100):
+        folded = text.casefold()
+        if self.grams is None or len(folded) < 3:
+            return self.prefix(text, cursor, limit)
+        with self.lock:
+            candidate_sets = [self.grams.get(gram, set()) for gram in trigrams(folded)]
+            candidate_sets.sort(key=len)
+            candidates = set(candidate_sets[0]).intersection(*candidate_sets[1:])
+        keys = sorted(key for key in map(search_key, candidates) if folded in key[0])
+        start = 0 if cursor is None else bisect.bisect_right(keys, search_key(cursor))
+        return [key[1] for key in keys[start:start + limit]]
+
+
+# Função para normalizar um telefone, mantendo só os dígitos
+def normalize_phone(phone):
+    return NON_DIGITS.sub('', str(phone))
+
+
+# Índice reverso: telefone normalizado -> nomes dos contatos com esse telefone
+class PhoneIndex:
+    def __init__(self):
+        self.names = {}
+        self.lock = threading.Lock()
+
+    # Registra a troca de telefone de um contato (None quando o contato não existia ou foi removido)
+    def replace(self, name, old_phone, new_phone):
+        with self.lock:
+            if old_phone is not None:
+                key = normalize_phone(old_phone)
+                names = self.names.get(key)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self.names[key]
+            if new_phone is not None:
+                self.names.setdefault(normalize_phone(new_phone), set()).add(name)
+
+    def rebuild(self, contacts):
+        names = {}
+        for name, phone in contacts.items():
+            names.setdefault(normalize_phone(phone), set()).add(name)
+        with self.lock:
+            self.names = names
+
+    # Nomes associados a cada telefone pedido
+    def lookup(self, phones):
+        keys = {phone: normalize_phone(phone) for phone in phones}
+        with self.lock:
+            return {phone: sorted(self.names.get(key, ())) if key else [] for phone, key in keys.items()}
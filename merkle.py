@@ -0,0 +1,115 @@
+import hashlib
+import threading
+
+# Árvore de hashes com 16 filhos por nó e 4 níveis abaixo da raiz: 65536 folhas (grupos de nomes)
+FANOUT = 16
+DEPTH = 4
+LEAVES = FANOUT ** DEPTH
+
+
+def _digest(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+# Função para descobrir a folha (grupo) de um nome; igual em todas as agendas
+def bucket_of(name):
+    return _digest(name.encode('utf-8')) % LEAVES
+
+
+# Função para calcular o hash de um registro (telefone, versão); lápides (telefone None) também entram
+def entry_hash(name, record):
+    return _digest(f"{name}\0{record!r}".encode('utf-8'))
+
+
+# Árvore de hashes sobre o espaço de nomes, atualizada a cada alteração
+# O hash de cada nó é o XOR dos hashes dos registros abaixo dele, o que permite atualizá-lo sem recalcular os vizinhos
+class MerkleTree:
+    def __init__(self):
+        self.levels = [[0] * (FANOUT ** depth) for depth in range(DEPTH + 1)]
+        self.members = {}  # folha -> nomes dos registros nela
+        self.lock = threading.Lock()
+
+    def _apply(self, bucket, delta):
+        index = bucket
+        for depth in range(DEPTH, -1, -1):
+            self.levels[depth][index] ^= delta
+            index //= FANOUT
+
+    # Registra a troca do registro de um nome (None quando o registro não existia ou foi apagado)
+    def update(self, name, old_record, new_record):
+        delta = 0
+        if old_record is not None:
+            delta ^= entry_hash(name, old_record)
+        if new_record is not None:
+            delta ^= entry_hash(name, new_record)
+        bucket = bucket_of(name)
+        with self.lock:
+            if new_record is not None:
+                self.members.setdefault(bucket, set()).add(name)
+            else:
+                names = self.members.get(bucket)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self.members[bucket]
+            if delta:
+                self._apply(bucket, delta)
+
+    def rebuild(self, records):
+        leaves = [0] * LEAVES
+        members = {}
+        for name, record in records.items():
+            bucket = bucket_of(name)
+            leaves[bucket] ^= entry_hash(name, record)
+            members.setdefault(bucket, set()).add(name)
+        levels = [leaves]
+        for _ in range(DEPTH):
+            child = levels[0]
+            parent = [0] * (len(child) // FANOUT)
+            for index, value in enumerate(child):
+                parent[index // FANOUT] ^= value
+            levels.insert(0, parent)
+        with self.lock:
+            self.levels = levels
+            self.members = members
+
+    def root(self):
+        with self.lock:
+            return self.levels[0][0]
+
+    # Hashes dos nós pedidos num nível da árvore (0 é a raiz, DEPTH são as folhas)
+    def nodes(self, depth, indices):
+        with self.lock:
+            level = self.levels[depth]
+            return [level[index] for index in indices]
+
+    # Nomes de cada folha pedida
+    def bucket_names(self, buckets):
+        with self.lock:
+            return {bucket: list(self.members.get(bucket, ())) for bucket in buckets}
+
+    # Nomes das folhas de "start" até "end" (exclusive), juntando folhas inteiras até passar de "limit" nomes
+    # Retorna (nomes, próxima folha); a próxima folha é "end" quando o intervalo terminou
+    def names_from(self, start, limit, end=LEAVES):
+        names = []
+        bucket = start
+        with self.lock:
+            while bucket < end and len(names) < limit:
+                names.extend(self.members.get(bucket, ()))
+                bucket += 1
+        return names, bucket
+
+
+# Função para encontrar as folhas que diferem de outra agenda, descendo só pelos nós diferentes
+# "remote_nodes(depth, indices)" retorna os hashes da outra agenda; são DEPTH + 1 idas e voltas no máximo
+def differing_buckets(tree, remote_nodes, limit=LEAVES):
+    differing = [0]
+    for depth in range(DEPTH + 1):
+        remote = remote_nodes(depth, differing)
+        local = tree.nodes(depth, differing)
+        differing = [index for index, mine, theirs in zip(differing, local, remote) if mine != theirs]
+        if not differing:
+            return []
+        if depth < DEPTH:
+            differing = [index * FANOUT + child for index in differing[:limit] for child in range(FANOUT)]
+    return differing[:limit]
@@ -0,0 +1,210 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites (s) dos intervalos dos histogramas de latência
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Percentis estimados pelos histogramas na resposta de 'stats'
+QUANTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Função para formatar os rótulos de uma amostra no formato de texto do Prometheus
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+# Função para formatar os rótulos como chave da resposta de 'stats' ("" quando não há rótulos)
+def _label_text(key):
+    return ','.join(f'{name}={value}' for name, value in key)
+
+
+# Contador que só cresce, com um valor por combinação de rótulos
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _values(self):
+        with self.lock:
+            return list(self.values.items())
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self._values()]
+
+    def summary(self):
+        return {_label_text(key): value for key, value in self._values()}
+
+
+# Valor que sobe e desce (conexões abertas, tamanho do último snapshot)
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+# Valor calculado na hora da leitura: "function()" retorna um número ou uma lista de (rótulos, valor)
+class CallbackGauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def _values(self):
+        result = self.function()
+        if isinstance(result, (int, float)):
+            return [((), result)]
+        return [(_key(labels), value) for labels, value in result]
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self._values()]
+
+    def summary(self):
+        return {_label_text(key): value for key, value in self._values()}
+
+
+# Histograma de durações: contagem por intervalo, soma e total, por combinação de rótulos
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}  # rótulos -> [contagem por intervalo (o último é +Inf), soma]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _values(self):
+        with self.lock:
+            return [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+
+    def samples(self):
+        samples = []
+        for key, counts, total in self._values():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((f'{self.name}_bucket', key + (('le', le),), cumulative))
+            samples.append((f'{self.name}_sum', key, total))
+            samples.append((f'{self.name}_count', key, cumulative))
+        return samples
+
+    # Percentil estimado: o limite superior do intervalo onde ele cai
+    def _quantile(self, counts, fraction):
+        target = fraction * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        summary = {}
+        for key, counts, total in self._values():
+            count = sum(counts)
+            stats = {'count': count, 'sum': total, 'avg': total / count if count else 0.0}
+            stats.update((name, self._quantile(counts, fraction)) for name, fraction in QUANTILES)
+            summary[_label_text(key)] = stats
+        return summary
+
+
+# Conjunto das métricas de uma agenda, com os formatos de saída ('stats' e texto do Prometheus)
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self._register(Gauge(name, help))
+
+    def callback(self, name, help, function):
+        return self._register(CallbackGauge(name, help, function))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    # Todas as métricas como dicionário: nome -> {rótulos: valor}
+    def collect(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.summary() for metric in metrics}
+
+    # Todas as métricas no formato de texto do Prometheus
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Função para servir as métricas por HTTP (GET /metrics) numa thread em segundo plano
+def serve_metrics(registry, host, port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Sem uma linha no terminal a cada leitura
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
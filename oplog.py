@@ -0,0 +1,56 @@
+import collections
+import itertools
+import threading
+import uuid
+
+
+# Log ordenado das operações aplicadas nesta agenda, com números de sequência crescentes
+class OperationLog:
+    def __init__(self, max_entries=100000, epoch=None, seq=0, sink=None):
+        # A época identifica a "história" do log: muda quando a sequência recomeça do zero
+        # ou quando a agenda substitui todo o seu estado por uma cópia de outra agenda
+        self.epoch = epoch or uuid.uuid4().hex
+        self.seq = seq
+        self.entries = collections.deque(maxlen=max_entries)  # (seq, ação, nome, telefone, versão)
+        self.lock = threading.Lock()
+        # Função chamada (na ordem da sequência) a cada operação registrada, como a gravação em disco
+        self.sink = sink
+
+    # Registra uma operação e retorna o seu número de sequência
+    def append(self, action, name, phone=None, version=None):
+        with self.lock:
+            self.seq += 1
+            self.entries.append((self.seq, action, name, phone, version))
+            if self.sink is not None:
+                self.sink(self.seq, action, name, phone, version)
+            return self.seq
+
+    # Restaura o log a partir do estado salvo em disco, sem repassar as operações ao "sink"
+    def restore(self, epoch, seq, entries):
+        with self.lock:
+            self.epoch = epoch
+            self.seq = seq
+            self.entries.clear()
+            self.entries.extend(entries)
+
+    # Posição atual do log: (época, última sequência)
+    def position(self):
+        with self.lock:
+            return self.epoch, self.seq
+
+    # Operações posteriores à posição informada, ou None se elas não estão mais (ou nunca estiveram) no log
+    def since(self, epoch, seq):
+        with self.lock:
+            if epoch != self.epoch or seq > self.seq:
+                return None
+            first_seq = self.entries[0][0] if self.entries else self.seq + 1
+            if seq < first_seq - 1:
+                return None
+            return list(itertools.islice(self.entries, seq - first_seq + 1, None))
+
+    # Inicia uma nova época, descartando as operações antigas
+    def reset(self):
+        with self.lock:
+            self.epoch = uuid.uuid4().hex
+            self.seq = 0
+            self.entries.clear()
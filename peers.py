@@ -0,0 +1,204 @@
+import itertools
+import select
+import socket
+import threading
+import time
+
+from protocol import BINARY, PICKLE, negotiate, send_message, recv_message
+
+# Tempo máximo (s) para abrir a conexão com outra agenda: um IP inalcançável não trava a escrita
+CONNECT_TIMEOUT = 1.0
+
+# Tempo máximo (s) de espera por uma resposta de outra agenda
+IO_TIMEOUT = 60.0
+
+# Falhas seguidas que marcam a agenda como indisponível (circuito aberto)
+FAILURE_THRESHOLD = 3
+
+# Tempo (s) até uma nova tentativa com uma agenda indisponível, mesmo sem resposta à verificação periódica
+RETRY_INTERVAL = 5.0
+
+
+# Erro levantado na hora, sem tentar conectar, quando a agenda está marcada como indisponível
+class PeerUnavailableError(ConnectionError):
+    pass
+
+
+# Conexão persistente com outra agenda, reaberta automaticamente em caso de falha
+# Depois de FAILURE_THRESHOLD falhas seguidas o circuito abre: os pedidos falham na hora até que
+# uma verificação (ping) tenha sucesso ou passe RETRY_INTERVAL, quando um novo pedido é tentado
+# Cada conexão nova combina o formato binário com a agenda; as agendas antigas continuam em pickle
+class PeerConnection:
+    def __init__(self, address, connect_timeout=CONNECT_TIMEOUT, on_recover=None):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self.on_recover = on_recover  # Função chamada (com o endereço) quando a agenda volta a responder
+        self.sock = None
+        self.codec = PICKLE
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self.failures = 0
+        self.retry_at = 0.0
+
+    # Abre a conexão se ainda não existir ou se a outra agenda a tiver encerrado
+    def _ensure_connected(self):
+        if self.sock is not None and self._is_stale():
+            self._close()
+        if self.sock is None:
+            sock = self._connect()
+            if negotiate(sock):
+                self.codec = BINARY
+            else:
+                sock.close()
+                sock = self._connect()
+                self.codec = PICKLE
+            self.sock = sock
+        return self.sock
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        sock.settimeout(IO_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    # Uma conexão ociosa que fica "legível" só pode ter sido fechada (ou resetada) pela outra ponta
+    def _is_stale(self):
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                return False
+            return self.sock.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    # Indica se vale a pena tentar falar com a agenda (circuito fechado ou hora de uma nova tentativa)
+    def available(self):
+        return self.failures < FAILURE_THRESHOLD or time.monotonic() >= self.retry_at
+
+    def _record_success(self):
+        recovered = self.failures >= FAILURE_THRESHOLD
+        self.failures = 0
+        if recovered:
+            print(f"Servidor {self.address} voltou a responder.")
+            if self.on_recover is not None:
+                self.on_recover(self.address)
+
+    def _record_failure(self):
+        self.failures += 1
+        if self.failures >= FAILURE_THRESHOLD:
+            if self.failures == FAILURE_THRESHOLD:
+                print(f"Servidor {self.address} marcado como indisponível.")
+            self.retry_at = time.monotonic() + RETRY_INTERVAL
+
+    # Executa a operação na conexão atual, tentando de novo uma vez com uma conexão nova
+    # "probe" ignora o circuito aberto (usado pela verificação periódica)
+    def _with_retry(self, operation, probe=False):
+        if not probe and not self.available():
+            raise PeerUnavailableError(f"Servidor {self.address} está indisponível.")
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    result = operation(self._ensure_connected())
+                    self._record_success()
+                    return result
+                except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+                    self._close()
+                    if attempt:
+                        self._record_failure()
+                        raise
+                except OSError:
+                    self._close()
+                    self._record_failure()
+                    raise
+
+    # Envia uma mensagem sem esperar resposta
+    def send(self, message):
+        def operation(sock):
+            send_message(sock, message, next(self.request_ids), self.codec)
+        self._with_retry(operation)
+
+    # Envia uma mensagem e espera a resposta correspondente
+    def request(self, message, probe=False):
+        def operation(sock):
+            request_id = next(self.request_ids)
+            send_message(sock, message, request_id, self.codec)
+            while True:
+                reply = recv_message(sock, self.codec)
+                if reply is None:
+                    raise ConnectionResetError("Conexão encerrada pela outra agenda.")
+                reply_id, response = reply
+                if reply_id == request_id:
+                    return response
+        return self._with_retry(operation, probe)
+
+    # Verifica se a agenda responde, mesmo que esteja marcada como indisponível
+    def ping(self):
+        return self.request(('ping', None, None), probe=True)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+
+# Conjunto de conexões persistentes, uma por agenda
+class PeerPool:
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT):
+        self.connect_timeout = connect_timeout
+        self.connections = {}
+        self.listeners = []  # Funções chamadas quando uma agenda volta a responder
+        self.lock = threading.Lock()
+
+    def get(self, address):
+        with self.lock:
+            connection = self.connections.get(address)
+            if connection is None:
+                connection = PeerConnection(address, self.connect_timeout, self._recovered)
+                self.connections[address] = connection
+            return connection
+
+    def add_recover_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _recovered(self, address):
+        for listener in self.listeners:
+            listener(address)
+
+    # Estado de cada agenda conhecida: disponível ou não, e falhas seguidas
+    def status(self):
+        with self.lock:
+            connections = list(self.connections.values())
+        return {connection.address: {'available': connection.failures < FAILURE_THRESHOLD, 'failures': connection.failures}
+                for connection in connections}
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.connections.values())
+        for connection in connections:
+            connection.close()
+
+
+# Verificação periódica (heartbeat) das outras agendas: detecta agendas que caíram antes que uma escrita
+# precise delas e fecha o circuito assim que uma agenda indisponível volta a responder
+class HealthMonitor:
+    def __init__(self, pool, peers, interval=1.0):
+        self.pool = pool
+        self.peers = peers  # Função que retorna os endereços a verificar
+        self.interval = interval
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            for address in self.peers():
+                try:
+                    self.pool.get(address).ping()
+                except OSError:
+                    pass  # A falha já fica registrada na conexão
@@ -0,0 +1,80 @@
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+# Quantidade de pilhas mais frequentes incluídas na resposta de 'stats'
+TOP_STACKS = 20
+
+
+# Profiler por amostragem: a cada "interval" segundos, registra a pilha de chamadas das threads que estão
+# atendendo uma requisição (marcadas com "track"), sem instrumentar cada função
+# As pilhas são gravadas em "output" no formato "função;função;... amostras", lido por geradores de flame graph
+class SamplingProfiler:
+    def __init__(self, interval=0.005, output=None, flush_interval=10.0):
+        self.interval = interval
+        self.output = output
+        self.flush_interval = flush_interval
+        self.tracked = collections.Counter()  # id da thread -> requisições em andamento nela
+        self.stacks = collections.Counter()  # pilha -> amostras
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # Marca a thread atual enquanto ela atende uma requisição
+    @contextlib.contextmanager
+    def track(self):
+        ident = threading.get_ident()
+        with self.lock:
+            self.tracked[ident] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.tracked[ident] -= 1
+                if not self.tracked[ident]:
+                    del self.tracked[ident]
+
+    def _sample(self):
+        with self.lock:
+            idents = list(self.tracked)
+        if not idents:
+            return
+        frames = sys._current_frames()
+        sampled = []
+        for ident in idents:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                sampled.append(';'.join(reversed(stack)))
+        with self.lock:
+            self.stacks.update(sampled)
+
+    def _run(self):
+        next_flush = time.time() + self.flush_interval
+        while True:
+            time.sleep(self.interval)
+            self._sample()
+            if self.output is not None and time.time() >= next_flush:
+                self.flush()
+                next_flush = time.time() + self.flush_interval
+
+    # As pilhas mais frequentes: [(pilha, amostras)]
+    def top(self, count=TOP_STACKS):
+        with self.lock:
+            return self.stacks.most_common(count)
+
+    # Grava todas as pilhas amostradas até agora em "output"
+    def flush(self):
+        if self.output is None:
+            return
+        with self.lock:
+            lines = [f"{stack} {count}\n" for stack, count in self.stacks.items()]
+        tmp_path = self.output + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.output)
@@ -0,0 +1,170 @@
+import asyncio
+import pickle
+import struct
+import threading
+
+import binary_codec
+
+# Cabeçalho de cada mensagem: tamanho do corpo (4 bytes) + id da requisição (4 bytes)
+HEADER = struct.Struct('!II')
+
+# Tamanho máximo aceito para uma única mensagem (proteção contra cabeçalhos corrompidos)
+MAX_FRAME_SIZE = 1 << 30
+
+# Formatos de serialização das mensagens, do preferido para o mais antigo
+# O pickle continua aceito para os clientes e agendas anteriores ao formato binário
+BINARY = 'binary'
+PICKLE = 'pickle'
+CODECS = (BINARY, PICKLE)
+
+# Primeiro byte de toda mensagem em pickle (protocolo 2 ou mais novo)
+PICKLE_MARKER = 0x80
+
+# Tamanho máximo de cada leitura do socket
+RECV_CHUNK_SIZE = 1 << 20
+
+# Abaixo deste tamanho o cabeçalho e o corpo são enviados numa única chamada
+SMALL_FRAME_SIZE = 1 << 16
+
+
+# Função para ler exatamente "size" bytes do socket (None se a conexão fechou antes do primeiro byte)
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], min(size - received, RECV_CHUNK_SIZE))
+        if n == 0:
+            if received == 0:
+                return None
+            raise ConnectionResetError("Conexão encerrada no meio de uma mensagem.")
+        received += n
+    return buffer
+
+
+# Função para enviar um corpo já serializado com o cabeçalho de tamanho
+def send_frame(sock, payload, request_id=0):
+    header = HEADER.pack(len(payload), request_id)
+    if len(payload) < SMALL_FRAME_SIZE:
+        sock.sendall(header + payload)
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+# Função para receber um corpo completo, retornando (id da requisição, bytes) ou None no fim da conexão
+def recv_frame(sock):
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    size, request_id = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionResetError(f"Mensagem de {size} bytes excede o limite permitido.")
+    payload = recv_exact(sock, size) if size else bytearray()
+    if payload is None:
+        raise ConnectionResetError("Conexão encerrada no meio de uma mensagem.")
+    return request_id, payload
+
+
+# Mensagem serializada uma só vez por formato e enviada como está nas respostas seguintes
+class Encoded:
+    def __init__(self, obj):
+        self.obj = obj
+        self.payloads = {}  # formato -> bytes
+        self.lock = threading.Lock()
+
+    def payload(self, codec):
+        with self.lock:
+            payload = self.payloads.get(codec)
+            if payload is None:
+                payload = self.payloads[codec] = encode(self.obj, codec)
+            return payload
+
+
+# Função para identificar o formato de uma mensagem recebida pelo primeiro byte
+def payload_codec(payload):
+    return PICKLE if payload[:1] == bytes([PICKLE_MARKER]) else BINARY
+
+
+# Função para serializar um objeto
+def encode(obj, codec=PICKLE):
+    if isinstance(obj, Encoded):
+        return obj.payload(codec)
+    if codec == BINARY:
+        return binary_codec.dumps(obj)
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Função para desserializar um objeto
+def decode(payload, codec=PICKLE):
+    if codec == BINARY:
+        try:
+            return binary_codec.loads(payload)
+        except ValueError as e:
+            raise ConnectionResetError(f"Mensagem inválida: {e}")
+    return pickle.loads(payload)
+
+
+# Função para enviar um objeto como mensagem
+def send_message(sock, obj, request_id=0, codec=PICKLE):
+    send_frame(sock, encode(obj, codec), request_id)
+
+
+# Função para receber um objeto, retornando (id da requisição, objeto) ou None no fim da conexão
+def recv_message(sock, codec=PICKLE):
+    frame = recv_frame(sock)
+    if frame is None:
+        return None
+    request_id, payload = frame
+    return request_id, decode(payload, codec)
+
+
+# Função para combinar o formato binário com a outra ponta da conexão
+# Retorna False se ela não o conhece (agenda antiga: fecha a conexão ao receber a mensagem); a conexão
+# deve então ser refeita em pickle
+def negotiate(sock):
+    try:
+        send_message(sock, ('hello', None, None), codec=BINARY)
+        reply = recv_message(sock, BINARY)
+    except OSError:
+        return False
+    return reply is not None and isinstance(reply[1], list) and BINARY in reply[1]
+
+
+# Função para enviar um objeto como mensagem por um StreamWriter (modo assíncrono)
+async def send_message_async(writer, obj, request_id=0, codec=PICKLE):
+    payload = encode(obj, codec)
+    header = HEADER.pack(len(payload), request_id)
+    if len(payload) < SMALL_FRAME_SIZE:
+        writer.write(header + payload)
+    else:
+        writer.write(header)
+        writer.write(payload)
+    await writer.drain()
+
+
+# Função para receber um corpo completo de um StreamReader (modo assíncrono), ou None no fim da conexão
+async def recv_frame_async(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionResetError("Conexão encerrada no meio de uma mensagem.")
+    size, request_id = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionResetError(f"Mensagem de {size} bytes excede o limite permitido.")
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ConnectionResetError("Conexão encerrada no meio de uma mensagem.")
+    return request_id, payload
+
+
+# Função para receber um objeto de um StreamReader (modo assíncrono), ou None no fim da conexão
+async def recv_message_async(reader, codec=PICKLE):
+    frame = await recv_frame_async(reader)
+    if frame is None:
+        return None
+    request_id, payload = frame
+    return request_id, decode(payload, codec)
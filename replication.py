@@ -0,0 +1,258 @@
+import itertools
+import threading
+import time
+
+from handoff import HintStore, hint_path
+
+# Modos de confirmação aceitos: só a agenda local, a maioria do cluster ou todas as agendas
+ACK_MODES = ('local', 'majority', 'all')
+
+
+# Acompanha quantas agendas confirmaram uma escrita
+class ReplicationAck:
+    def __init__(self, needed, peers):
+        self.needed = needed
+        self.remaining = peers
+        self.confirmed = 0
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        if needed <= 0 or peers == 0:
+            self.done.set()
+
+    # Registra a resposta de uma agenda (sucesso ou falha)
+    def peer_done(self, ok):
+        with self.lock:
+            self.remaining -= 1
+            if ok:
+                self.confirmed += 1
+            if self.confirmed >= self.needed or self.remaining == 0:
+                self.done.set()
+
+    # Espera a confirmação e retorna (agendas que confirmaram, agendas necessárias)
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        with self.lock:
+            return self.confirmed, self.needed
+
+
+# Intervalo (s) entre tentativas de entregar as operações guardadas para uma agenda indisponível
+HINT_RETRY_INTERVAL = 1.0
+
+
+# Fila de replicação de uma agenda: agrupa as operações pendentes por nome e as envia em lotes
+# Enquanto a agenda está indisponível, as operações vão para "hints" (sem esperar por ela) e são entregues
+# em lote, antes de qualquer operação nova, quando ela voltar
+class PeerReplicator:
+    def __init__(self, peer, batch_size, origin, oplog, hints=None):
+        self.peer = peer
+        self.batch_size = batch_size
+        self.origin = origin
+        self.oplog = oplog
+        self.hints = hints if hints is not None else HintStore()
+        self.pending = {}  # nome -> (sequência, operação mais recente); a ordem de inserção é preservada
+        self.acks = {}  # nome -> confirmações aguardando o envio dessa operação
+        self.tokens = {}  # nome -> [(nome, token, resposta)] das escritas com token de idempotência
+        self.outstanding = {}  # confirmação -> [operações ainda não enviadas, houve falha]
+        # Para as métricas: desde quando há operações na fila e o lote sendo enviado agora
+        self.pending_since = None
+        self.in_flight = 0
+        self.in_flight_since = None
+        self.condition = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # Enfileira operações (sequência, operação) que serão confirmadas juntas por "ack"
+    # "tokens" traz (nome, token, resposta) das escritas com token, enviados depois do lote que as contém
+    def enqueue(self, entries, ack, tokens=()):
+        with self.condition:
+            if not self.pending:
+                self.pending_since = time.time()
+            for seq, operation in entries:
+                name = operation[1]
+                self.pending[name] = (seq, operation)  # Atualizações do mesmo nome se sobrepõem
+                self.acks.setdefault(name, []).append(ack)
+            for name, token, response in tokens:
+                self.tokens.setdefault(name, []).append((name, token, response))
+            self.outstanding[ack] = [len(entries), False]
+            self.condition.notify()
+
+    # Registra o envio (ou a falha) de um lote; uma confirmação termina quando todas as suas operações saíram
+    def _finish(self, acks, ok):
+        finished = []
+        with self.condition:
+            for ack in acks:
+                state = self.outstanding[ack]
+                state[0] -= 1
+                state[1] = state[1] or not ok
+                if state[0] == 0:
+                    del self.outstanding[ack]
+                    finished.append((ack, not state[1]))
+        for ack, ack_ok in finished:
+            ack.peer_done(ack_ok)
+
+    # Para de replicar para esta agenda (que saiu do cluster); as confirmações pendentes terminam com falha
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            acks = [ack for name_acks in self.acks.values() for ack in name_acks]
+            self.acks.clear()
+            self.tokens.clear()
+            self.condition.notify()
+        self.hints.clear()  # A agenda saiu do cluster: as operações guardadas para ela não servem mais
+        self._finish(acks, False)
+
+    # Acorda a fila para tentar entregar as operações guardadas (a agenda voltou a responder)
+    def wake(self):
+        with self.condition:
+            self.condition.notify()
+
+    def _take_batch(self):
+        with self.condition:
+            while not self.pending and not self.closed:
+                if self.hints and self.peer.available():
+                    return [], None, [], []  # Nada novo, mas há operações guardadas a entregar
+                self.condition.wait(HINT_RETRY_INTERVAL if self.hints else None)
+            if self.closed:
+                return None
+            names = list(itertools.islice(self.pending, self.batch_size))
+            entries = [self.pending.pop(name) for name in names]
+            acks = [ack for name in names for ack in self.acks.pop(name)]
+            tokens = [token for name in names for token in self.tokens.pop(name, ())]
+            # Só quando a fila esvazia é seguro dizer até qual sequência a outra agenda está em dia
+            drained = not self.pending
+            self.in_flight = len(entries)
+            self.in_flight_since = self.pending_since
+            if drained:
+                self.pending_since = None
+        batch = [operation for _, operation in entries]
+        position = (self.origin, self.oplog.epoch, max(seq for seq, _ in entries)) if drained else None
+        return batch, position, acks, tokens
+
+    def _run(self):
+        while True:
+            taken = self._take_batch()
+            if taken is None:
+                break
+            batch, position, acks, tokens = taken
+            if not self.peer.available():
+                # Agenda sabidamente fora do ar: guarda as operações (e os tokens) e falha as confirmações na hora
+                self.hints.add(batch, tokens)
+                self._finish(acks, False)
+                self._sent()
+                continue
+            try:
+                self._deliver_hints()
+                if batch:
+                    self.peer.request(('batch', batch, position))
+                    print(f"Sincronizando {len(batch)} operações para {self.peer.address}")
+                self._send_tokens([(token, response) for _, token, response in tokens])
+                ok = True
+            except OSError:
+                print(f"Servidor {self.peer.address} está offline. Operações guardadas para entregar depois.")
+                self.hints.add(batch, tokens)
+                ok = False
+            self._finish(acks, ok)
+            self._sent()
+
+    def _sent(self):
+        with self.condition:
+            self.in_flight = 0
+            self.in_flight_since = None
+
+    # Estado da fila: operações na fila, sendo enviadas e guardadas, e há quanto tempo (s) a mais antiga espera
+    def stats(self):
+        with self.condition:
+            waiting = [since for since in (self.in_flight_since, self.pending_since) if since is not None]
+            return {'pending': len(self.pending), 'in_flight': self.in_flight, 'hints': len(self.hints),
+                    'lag_seconds': time.time() - min(waiting) if waiting else 0.0}
+
+    # Envia os tokens (token, resposta) de escritas já entregues à agenda
+    # Sem resposta: agendas anteriores aos tokens simplesmente ignoram a mensagem
+    def _send_tokens(self, tokens):
+        if tokens:
+            self.peer.send(('tokens', tokens, None))
+
+    # Entrega, em lotes, as operações guardadas enquanto a agenda estava indisponível
+    def _deliver_hints(self):
+        delivered = 0
+        while True:
+            entries = self.hints.peek(self.batch_size)
+            if not entries:
+                break
+            self.peer.request(('batch', [operation for _, (_, operation) in entries], None))
+            self._send_tokens(self.hints.discard(entries))
+            delivered += len(entries)
+        if delivered:
+            print(f"{delivered} operações guardadas entregues para {self.peer.address}.")
+
+
+# Pipeline de replicação em segundo plano para as outras agendas
+class ReplicationQueue:
+    def __init__(self, pool, servers, origin, oplog, ack_mode='local', batch_size=1000, hint_dir=None):
+        self.pool = pool
+        self.hint_dir = hint_dir  # Diretório das operações guardadas para agendas indisponíveis (None: só em memória)
+        self.origin = origin
+        self.oplog = oplog
+        self.ack_mode = ack_mode
+        self.batch_size = batch_size
+        self.replicators = {}  # agenda -> PeerReplicator
+        self.lock = threading.Lock()
+        for server in servers:
+            self.add_peer(server)
+
+    # Passa a replicar para mais uma agenda (que entrou no cluster)
+    def add_peer(self, server):
+        with self.lock:
+            if server not in self.replicators:
+                hints = HintStore(hint_path(self.hint_dir, server) if self.hint_dir else None)
+                if len(hints):
+                    print(f"{len(hints)} operações guardadas para {server} carregadas do disco.")
+                self.replicators[server] = PeerReplicator(self.pool.get(server), self.batch_size, self.origin, self.oplog, hints)
+
+    # Acorda a fila de uma agenda que voltou a responder, para entregar as operações guardadas
+    def peer_recovered(self, server):
+        with self.lock:
+            replicator = self.replicators.get(server)
+        if replicator is not None:
+            replicator.wake()
+
+    # Estado da fila de cada agenda
+    def stats(self):
+        with self.lock:
+            replicators = list(self.replicators.items())
+        return {server: replicator.stats() for server, replicator in replicators}
+
+    def remove_peer(self, server):
+        with self.lock:
+            replicator = self.replicators.pop(server, None)
+        if replicator is not None:
+            replicator.close()
+
+    # Quantas das outras agendas que recebem a escrita precisam confirmar, conforme o modo de confirmação
+    def _needed(self, peers):
+        if self.ack_mode == 'all':
+            return peers
+        if self.ack_mode == 'majority':
+            return (peers + 1) // 2  # Maioria do cluster, já contando a agenda local
+        return 0
+
+    # Enfileira a operação e retorna o acompanhamento da confirmação
+    # Com "token", a resposta da escrita é guardada também nas agendas que a recebem
+    def submit(self, action, name, phone=None, version=None, seq=0, targets=None, token=None, response=None):
+        tokens = [(name, token, response)] if token is not None else ()
+        return self.submit_many([(action, name, phone, version, seq)], targets, tokens)
+
+    # Enfileira várias operações (ação, nome, telefone, versão, sequência) com uma única confirmação
+    # "targets" limita as agendas que recebem as operações (todas, se None)
+    def submit_many(self, operations, targets=None, tokens=()):
+        with self.lock:
+            if targets is None:
+                replicators = list(self.replicators.values())
+            else:
+                replicators = [self.replicators[target] for target in targets if target in self.replicators]
+        ack = ReplicationAck(self._needed(len(replicators)), len(replicators))
+        entries = [(seq, (action, name, phone, version)) for action, name, phone, version, seq in operations]
+        for replicator in replicators:
+            replicator.enqueue(entries, ack, tokens)
+        return ack
@@ -0,0 +1,52 @@
+import bisect
+import hashlib
+
+# Pontos de cada agenda no anel: mais pontos distribuem os nomes de forma mais uniforme entre as agendas
+VNODES = 64
+
+
+# Função para calcular a posição de um texto no anel; igual em todas as agendas
+def ring_position(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+# Função para identificar uma agenda (IP, porta de sincronização) nas posições do anel
+def node_key(node):
+    host, port = node
+    return f"{host}:{port}"
+
+
+# Anel de hashes consistentes: cada nome pertence às próximas agendas do anel, no sentido horário
+# É imutável: incluir ou retirar uma agenda cria um anel novo, que substitui o anterior de uma só vez
+class HashRing:
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.vnodes = vnodes
+        self.nodes = frozenset(nodes)
+        points = sorted((ring_position(f"{node_key(node)}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.positions = [position for position, _ in points]
+        self.points = [node for _, node in points]
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def with_node(self, node):
+        return HashRing(self.nodes | {node}, self.vnodes)
+
+    def without_node(self, node):
+        return HashRing(self.nodes - {node}, self.vnodes)
+
+    # As "count" agendas responsáveis pelo nome, em ordem (a primeira é a principal)
+    # Incluir ou retirar uma agenda só muda os responsáveis dos nomes próximos aos pontos dela
+    def owners(self, name, count):
+        count = min(count, len(self.nodes))
+        owners = []
+        index = bisect.bisect_right(self.positions, ring_position(name))
+        while len(owners) < count:
+            node = self.points[index % len(self.points)]
+            if node not in owners:
+                owners.append(node)
+            index += 1
+        return owners
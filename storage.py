@@ -0,0 +1,263 @@
+import glob
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+from hlc import ZERO_VERSION
+
+# Cabeçalho de cada registro do log de escrita antecipada: tamanho + crc32 do corpo
+RECORD_HEADER = struct.Struct('!II')
+
+# Cabeçalho do snapshot: identificador do formato + tamanho dos metadados
+SNAPSHOT_MAGIC = b'AGENDA1\n'
+SNAPSHOT_HEADER = struct.Struct('!8sQ')
+
+SNAPSHOT_FILE = 'snapshot.bin'
+SEGMENT_PATTERN = 'wal-*.log'
+
+
+# Função para ler os registros válidos de um segmento do log (para no primeiro registro incompleto ou corrompido)
+def read_records(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        size, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + size
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break  # Escrita interrompida no meio (queda da agenda)
+        yield pickle.loads(data[start:end])
+        offset = end
+
+
+# Função para acrescentar um registro (tamanho + crc32 + corpo) a um arquivo aberto
+def write_record(file, record):
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+    file.write(payload)
+
+
+# Função para gravar o snapshot de forma atômica (arquivo temporário + rename)
+def write_snapshot_file(path, metadata, records):
+    meta = pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL)
+    body = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(meta)))
+        f.write(meta)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path))
+
+
+# Função para ler o snapshot mapeando o arquivo em memória, sem copiá-lo antes de desserializar
+def read_snapshot_file(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, meta_size = SNAPSHOT_HEADER.unpack_from(mapped, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Arquivo {path} não é um snapshot da agenda.")
+        with memoryview(mapped) as view:
+            meta_start = SNAPSHOT_HEADER.size
+            metadata = pickle.loads(view[meta_start:meta_start + meta_size])
+            records = pickle.loads(view[meta_start + meta_size:])
+    if not metadata.get('versioned'):
+        # Snapshot anterior às versões: só nome -> telefone
+        records = {name: (phone, ZERO_VERSION) for name, phone in records.items()}
+    metadata['records'] = records
+    return metadata
+
+
+def fsync_directory(path):
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return  # Sistemas sem suporte a abrir diretórios (Windows)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Log de escrita antecipada com "group commit": um único fsync confirma todas as escritas acumuladas
+class WriteAheadLog:
+    def __init__(self, path, header, fsync_interval=0.005, fsync_batch=512):
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.file = open(path, 'ab', buffering=1 << 20)
+        self.condition = threading.Condition()
+        self.sync_lock = threading.Lock()  # Impede a troca de arquivo durante um fsync
+        self.pending = 0
+        self.waiters = 0
+        self.written_seq = 0
+        self.durable_seq = 0
+        self._write(header)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _write(self, record):
+        write_record(self.file, record)
+
+    # Acrescenta um registro ao buffer; "seq" é a sequência da operação, quando houver
+    def append(self, record, seq=None):
+        with self.condition:
+            self._write(record)
+            if seq is not None:
+                self.written_seq = seq
+            self.pending += 1
+            if self.pending >= self.fsync_batch:
+                self.condition.notify_all()
+
+    # Espera até que a operação "seq" esteja gravada em disco
+    def wait_durable(self, seq):
+        with self.condition:
+            self.waiters += 1
+            self.condition.notify_all()
+            while self.durable_seq < seq:
+                self.condition.wait()
+            self.waiters -= 1
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Sem ninguém esperando, aguarda um pouco para juntar mais escritas no mesmo fsync
+                if not self.waiters and self.pending < self.fsync_batch:
+                    self.condition.wait(self.fsync_interval)
+            self.sync()
+
+    # Grava em disco tudo o que está no buffer
+    def sync(self):
+        with self.sync_lock:
+            with self.condition:
+                self.file.flush()
+                seq = self.written_seq
+                self.pending = 0
+                file = self.file
+            os.fsync(file.fileno())
+            with self.condition:
+                self.durable_seq = max(self.durable_seq, seq)
+                self.condition.notify_all()
+
+    # Passa a escrever em outro arquivo (que começa pelo registro "header"), gravando antes o que estava pendente
+    def switch(self, path, header):
+        with self.sync_lock:
+            with self.condition:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = open(path, 'ab', buffering=1 << 20)
+                self._write(header)
+                self.durable_seq = max(self.durable_seq, self.written_seq)
+                self.condition.notify_all()
+
+
+# Persistência local da agenda: log de escrita antecipada em segmentos + snapshots periódicos
+class Storage:
+    def __init__(self, data_dir, fsync_interval=0.005, fsync_batch=512):
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_dir = data_dir
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+        self.snapshot_lock = threading.Lock()
+        self.wal = None
+        self.epoch = None
+        self.segment = None
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.data_dir, SEGMENT_PATTERN)))
+
+    def _next_segment_path(self):
+        segments = self._segments()
+        number = int(os.path.basename(segments[-1])[4:-4]) + 1 if segments else 1
+        return os.path.join(self.data_dir, f'wal-{number:08d}.log')
+
+    # Reconstrói o estado salvo: snapshot mais as operações do log posteriores a ele
+    def load(self):
+        state = read_snapshot_file(self.snapshot_path)
+        if state is None:
+            state = {'epoch': None, 'seq': 0, 'peer_positions': {}, 'records': {}}
+        state['ops'] = []
+        snapshot_seq = state['seq']
+        records = state['records']
+        for segment in self._segments():
+            segment_records = read_records(segment)
+            header = next(segment_records, None)
+            if header is None:
+                continue
+            if state['epoch'] is None:
+                state['epoch'] = header[1]
+            if header[1] != state['epoch']:
+                continue  # Segmento de uma época anterior a um snapshot mais novo
+            for record in segment_records:
+                if record[0] == 'op':
+                    _, seq, action, name, phone = record[:5]
+                    version = record[5] if len(record) > 5 else ZERO_VERSION  # Log anterior às versões
+                    if seq <= snapshot_seq:
+                        continue  # Já incluída no snapshot
+                    if action in ('add', 'update'):
+                        records[name] = (phone, version)
+                    elif action == 'remove':
+                        records[name] = (None, version)
+                    elif action == 'forget':
+                        records.pop(name, None)
+                    state['ops'].append((seq, action, name, phone, version))
+                    state['seq'] = seq
+                elif record[0] == 'peer':
+                    _, origin, epoch, seq = record
+                    state['peer_positions'][origin] = (epoch, seq)
+        if state['epoch'] is None:
+            return None
+        return state
+
+    # Abre um novo segmento do log para as próximas escritas
+    def open(self, epoch):
+        self.epoch = epoch
+        self.segment = self._next_segment_path()
+        self.wal = WriteAheadLog(self.segment, ('epoch', epoch), self.fsync_interval, self.fsync_batch)
+
+    def log_operation(self, seq, action, name, phone, version):
+        self.wal.append(('op', seq, action, name, phone, version), seq)
+
+    def log_peer_position(self, origin, epoch, seq):
+        self.wal.append(('peer', origin, epoch, seq))
+
+    def wait_durable(self, seq):
+        self.wal.wait_durable(seq)
+
+    # Troca de segmento e retorna os segmentos anteriores, que o próximo snapshot tornará desnecessários
+    def _rotate(self):
+        old_segments = self._segments()
+        self.segment = self._next_segment_path()
+        self.wal.switch(self.segment, ('epoch', self.epoch))
+        return old_segments
+
+    # Grava um snapshot; "capture" retorna (época, sequência, registros, posições das outras agendas)
+    # Retorna quantos contatos (sem as lápides) foram gravados
+    def snapshot(self, capture):
+        with self.snapshot_lock:
+            old_segments = self._rotate()
+            epoch, seq, records, peer_positions = capture()
+            metadata = {'epoch': epoch, 'seq': seq, 'peer_positions': peer_positions, 'versioned': True}
+            write_snapshot_file(self.snapshot_path, metadata, records)
+            for segment in old_segments:
+                os.remove(segment)
+            return sum(phone is not None for phone, _ in records.values())
+
+    # Substitui todo o estado salvo (nova época), como após copiar a agenda de outra agenda
+    def reset(self, epoch, records, peer_positions):
+        with self.snapshot_lock:
+            metadata = {'epoch': epoch, 'seq': 0, 'peer_positions': peer_positions, 'versioned': True}
+            write_snapshot_file(self.snapshot_path, metadata, records)
+            self.epoch = epoch
+            old_segments = self._rotate()
+            for segment in old_segments:
+                os.remove(segment)
@@ -0,0 +1,199 @@
+import itertools
+import threading
+
+from protocol import Encoded
+
+# Condições aceitas nas alterações: o contato não pode existir ('absent') ou precisa existir ('present')
+CONDITIONS = (None, 'absent', 'present')
+
+
+# Cópia imutável da agenda num instante, identificada pela versão, guardada parte por parte
+# As partes que não mudaram são as mesmas do snapshot anterior; a agenda inteira num só dicionário ("records",
+# "contacts") e os bytes serializados só são montados quando alguém os pede, uma vez por versão
+class Snapshot:
+    def __init__(self, version, parts, live_parts):
+        self.version = version
+        # Não devem ser alterados: são compartilhados entre os leitores e com os snapshots seguintes
+        self.parts = parts  # Por parte: nome -> (telefone, versão), incluindo as remoções (telefone None)
+        self.live_parts = live_parts  # Por parte: nome -> telefone, só os contatos
+        self._records = None
+        self._contacts = None
+        self._payload = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(map(len, self.live_parts))
+
+    def __bool__(self):
+        return any(self.live_parts)
+
+    # Todos os registros (nome, (telefone, versão)), parte por parte, sem juntar as partes
+    def items(self):
+        return itertools.chain.from_iterable(part.items() for part in self.parts)
+
+    # Todos os registros num só dicionário: nome -> (telefone, versão), incluindo as remoções
+    @property
+    def records(self):
+        if self._records is None:
+            with self.lock:
+                if self._records is None:
+                    self._records = _merge(self.parts)
+        return self._records
+
+    # Os contatos num só dicionário: nome -> telefone
+    @property
+    def contacts(self):
+        if self._contacts is None:
+            with self.lock:
+                if self._contacts is None:
+                    self._contacts = _merge(self.live_parts)
+        return self._contacts
+
+    # Os contatos já serializados, prontos para enviar como mensagem
+    def encoded(self):
+        if self._payload is None:
+            contacts = self.contacts
+            with self.lock:
+                if self._payload is None:
+                    self._payload = Encoded(contacts)
+        return self._payload
+
+
+def _merge(parts):
+    merged = {}
+    for part in parts:
+        merged.update(part)
+    return merged
+
+
+# Agenda dividida em partes (shards) pelo hash do nome, cada uma com a sua trava
+# Alterações de nomes em partes diferentes não disputam a mesma trava
+# Cada nome guarda (telefone, versão); a remoção deixa uma lápide (telefone None) com a versão da remoção,
+# e uma alteração com versão menor ou igual à do registro é descartada (vence a última escrita)
+class ContactStore:
+    def __init__(self, shards=64, clock=None):
+        self.clock = clock  # Relógio que gera as versões das escritas locais
+        self.shards = [{} for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.live = [0] * shards  # Contatos (sem as lápides) em cada parte
+        # Cada parte tem uma versão, incrementada a cada alteração; a soma delas é a versão da agenda
+        self.versions = [0] * shards
+        # Cópia de cada parte (e só dos contatos dela) na última versão copiada, reaproveitada enquanto a parte não muda
+        self.frozen = [{} for _ in range(shards)]
+        self.frozen_live = [{} for _ in range(shards)]
+        self.frozen_versions = [0] * shards
+        self.current = Snapshot(0, list(self.frozen), list(self.frozen_live))
+        self.snapshot_lock = threading.Lock()
+
+    def _index(self, name):
+        return hash(name) % len(self.shards)
+
+    def get(self, name, default=None):
+        index = self._index(name)
+        with self.locks[index]:
+            phone, _ = self.shards[index].get(name, (None, None))
+        return default if phone is None else phone
+
+    # O registro (telefone, versão) do nome, incluindo lápides, ou None
+    def record(self, name):
+        index = self._index(name)
+        with self.locks[index]:
+            return self.shards[index].get(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return sum(self.live)
+
+    def __bool__(self):
+        return any(self.live)
+
+    # Quantidade de lápides (aproximada: as partes são lidas sem as travas)
+    def tombstone_count(self):
+        return sum(len(shard) for shard in self.shards) - sum(self.live)
+
+    # Aplica uma alteração de forma atômica, se a condição for satisfeita e a versão for mais nova que a do registro
+    # Sem versão, a alteração é desta agenda e recebe uma nova do relógio; 'forget' apaga o registro sem deixar
+    # lápide (com versão, só se o registro não mudou depois dela)
+    # "on_change(ação, nome, registro antigo, registro novo)" é chamada ainda com a trava, mantendo a ordem por nome
+    # Retorna o resultado de "on_change", ou None quando a alteração não foi aplicada
+    def apply(self, action, name, phone=None, version=None, condition=None, on_change=None):
+        index = self._index(name)
+        with self.locks[index]:
+            shard = self.shards[index]
+            old = shard.get(name)
+            old_phone, old_version = old if old is not None else (None, None)
+            if condition == 'absent' and old_phone is not None:
+                return None
+            if condition == 'present' and old_phone is None:
+                return None
+            if action == 'forget':
+                if old is None or (version is not None and old_version > version):
+                    return None
+                del shard[name]
+                new = None
+            else:
+                if version is None:
+                    version = self.clock.now()
+                else:
+                    self.clock.observe(version)
+                    if old is not None and version <= old_version:
+                        return None
+                if action == 'remove':
+                    phone = None
+                new = shard[name] = (phone, version)
+            self.live[index] += (new is not None and new[0] is not None) - (old_phone is not None)
+            self.versions[index] += 1
+            if on_change is None:
+                return True
+            return on_change(action, name, old, new)
+
+    # Trava todas as partes, na mesma ordem sempre, para obter uma visão consistente
+    def _lock_all(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def _unlock_all(self):
+        for lock in reversed(self.locks):
+            lock.release()
+
+    # Cópia consistente (de um mesmo instante) de todos os registros, como um Snapshot
+    # As travas ficam presas só enquanto as partes alteradas desde a última cópia são copiadas; os contatos de
+    # cada parte alterada são separados depois, sem bloquear as escritas. As demais partes são reaproveitadas
+    def snapshot(self):
+        with self.snapshot_lock:
+            self._lock_all()
+            try:
+                versions = list(self.versions)
+                if sum(versions) == self.current.version:
+                    return self.current
+                changed = []
+                for index, shard in enumerate(self.shards):
+                    if self.frozen_versions[index] != versions[index]:
+                        self.frozen[index] = shard.copy()
+                        self.frozen_versions[index] = versions[index]
+                        changed.append(index)
+            finally:
+                self._unlock_all()
+            for index in changed:
+                self.frozen_live[index] = {name: phone for name, (phone, _) in self.frozen[index].items() if phone is not None}
+            self.current = Snapshot(sum(versions), list(self.frozen), list(self.frozen_live))
+            return self.current
+
+    # Substitui todos os registros (nome -> (telefone, versão)) de uma vez
+    def replace_all(self, records):
+        shards = [{} for _ in self.shards]
+        live = [0] * len(self.shards)
+        for name, record in records.items():
+            index = self._index(name)
+            shards[index][name] = record
+            live[index] += record[0] is not None
+            self.clock.observe(record[1])
+        self._lock_all()
+        try:
+            self.shards = shards
+            self.live = live
+            self.versions = [version + 1 for version in self.versions]
+        finally:
+            self._unlock_all()
@@ -0,0 +1,107 @@
+import lzma
+import time
+import zlib
+
+from merkle import LEAVES
+from protocol import BINARY, MAX_FRAME_SIZE, decode, encode
+
+# Compressões aceitas nas partes da cópia completa
+COMPRESSIONS = ('zlib', 'lzma', 'none')
+
+# Quantidade padrão e máxima de registros por parte
+DEFAULT_CHUNK_SIZE = 10000
+MAX_CHUNK_SIZE = 100000
+
+# Tentativas seguidas de pedir a mesma parte antes de desistir da agenda de origem
+TRANSFER_RETRIES = 5
+
+# Espera (s) antes da primeira nova tentativa, dobrada a cada falha seguida até MAX_RETRY_DELAY
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10.0
+
+
+# Função para comprimir uma parte; cada parte é comprimida separadamente, para que a transferência
+# possa continuar de qualquer parte (inclusive com outra agenda de origem)
+def compress(data, compression):
+    if compression == 'zlib':
+        return zlib.compress(data, 1)
+    if compression == 'lzma':
+        return lzma.compress(data, preset=1)
+    return data
+
+
+# Função para descomprimir uma parte, sem aceitar mais que MAX_FRAME_SIZE bytes descomprimidos
+def decompress(data, compression):
+    if compression == 'zlib':
+        decompressor = zlib.decompressobj()
+    elif compression == 'lzma':
+        decompressor = lzma.LZMADecompressor()
+    else:
+        return data
+    try:
+        result = decompressor.decompress(data, MAX_FRAME_SIZE)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Parte corrompida: {e}")
+    if not decompressor.eof:
+        raise ValueError("Parte incompleta ou maior que o limite permitido.")
+    return result
+
+
+# Função para montar uma parte: os registros (nome -> (telefone, versão)) serializados, comprimidos e com o
+# CRC32 dos bytes enviados
+def pack_chunk(records, compression):
+    data = compress(encode(records, BINARY), compression)
+    return {'compression': compression, 'data': data, 'crc': zlib.crc32(data), 'count': len(records)}
+
+
+# Função para conferir e abrir uma parte recebida (ValueError se ela estiver corrompida)
+def unpack_chunk(chunk):
+    if not isinstance(chunk, dict):
+        raise ValueError(chunk)
+    data = chunk['data']
+    if zlib.crc32(data) != chunk['crc']:
+        raise ValueError("CRC da parte não confere.")
+    try:
+        records = decode(decompress(data, chunk['compression']), BINARY)
+    except ConnectionResetError as e:  # Mensagem binária inválida
+        raise ValueError(str(e))
+    if not isinstance(records, dict) or len(records) != chunk['count']:
+        raise ValueError("Quantidade de registros da parte não confere.")
+    return records
+
+
+# Cópia completa da agenda de outra agenda em partes ('fetch_chunk'), aplicadas à medida que chegam
+# O cursor é a próxima folha da árvore de hashes; as folhas são as mesmas em todas as agendas, então uma conexão
+# perdida (ou uma troca de agenda de origem) não recomeça do zero: o pedido é repetido a partir da última parte aplicada
+# Com "start" e "end", copia só as folhas desse intervalo, para dividir a cópia entre várias agendas
+class StateTransfer:
+    def __init__(self, apply, chunk_size=DEFAULT_CHUNK_SIZE, compression='zlib', start=0, end=LEAVES):
+        self.apply = apply  # Função que aplica os registros de uma parte
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.cursor = start  # None quando a cópia termina
+        self.end = end
+        self.received = 0  # Registros recebidos
+        self.compressed_bytes = 0
+
+    # Pede as partes a uma agenda ("request" envia a mensagem e retorna a resposta) até o fim da cópia
+    # Levanta ConnectionError depois de TRANSFER_RETRIES falhas seguidas com a mesma parte
+    def run(self, request, retries=TRANSFER_RETRIES):
+        failures = 0
+        while self.cursor is not None:
+            try:
+                chunk = request(('fetch_chunk', {'cursor': self.cursor, 'end': self.end, 'limit': self.chunk_size,
+                                                 'compression': self.compression}, None))
+                records = unpack_chunk(chunk)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                failures += 1
+                if failures > retries:
+                    raise ConnectionError(f"Cópia interrompida na folha {self.cursor}: {e}")
+                print(f"Falha ao receber a parte da folha {self.cursor} ({e}); tentando de novo.")
+                time.sleep(min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY))
+                continue
+            failures = 0
+            self.apply(records)
+            self.received += len(records)
+            self.compressed_bytes += len(chunk['data'])
+            self.cursor = chunk['next_cursor']